@@ -1,27 +1,38 @@
 import os
 import threading
 import logging
-from logging.handlers import RotatingFileHandler
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, g
 from flask_cors import CORS
 from flask_jwt_extended import (
-    JWTManager, jwt_required, create_access_token
+    JWTManager, jwt_required, verify_jwt_in_request, get_jwt_identity, get_jwt
 )
-from sqlalchemy import create_engine
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import sessionmaker
 
 # 匯入共用模型模組與 Base
 from models import Base, User, Material, Category, InRecord, OutRecord
+from tenants import (
+    get_session_factory, ensure_schema, db_uri_from_claims, dispose_retired_engines, resolve_tenant, tenant_from_claims,
+    enter_database, leave_database
+)
+from auth_tokens import issue_tokens, verify_password, is_token_revoked, LoginBusyError
+from services import session_registry
+from backups import backup_scheduler
+from log_config import setup_logging
+from metrics import init_app as init_metrics, set_request_department
+from sql_profiler import init_app as init_sql_profiler
+from cpu_profiler import init_app as init_cpu_profiler
 
 # 匯入拆分後的藍圖
-from routes.user import user_bp
+from routes.user import user_bp, admit_session
 from routes.material import material_bp
 from routes.category import category_bp
 from routes.record import record_bp
-from routes.report import report_bp
+from routes.report import report_bp, prewarm_report_modules
 from routes.backup import backup_bp
 from routes.font import font_bp
+from routes.tenant import tenant_bp
+from routes.metrics import metrics_bp
+from routes.profile import profile_bp
 
 # --- 初始化與設定 ---
 app = Flask(__name__)
@@ -33,62 +44,82 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f"sqlite:
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'your_test_secret_key_1234567890')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = 3600 * 8  # 8小時（秒）
+app.config['JWT_REFRESH_TOKEN_EXPIRES'] = 3600 * 24 * 14  # 14天，頁面以 /api/token/refresh 換新，不需重新登入
 app.config['JWT_TOKEN_LOCATION'] = ['headers', 'query_string']
 app.config['JWT_QUERY_STRING_NAME'] = 'token'
 
 jwt = JWTManager(app)
+
+@jwt.token_in_blocklist_loader
+def check_if_token_revoked(jwt_header, jwt_payload):
+    return is_token_revoked(jwt_payload)
 CORS(app, supports_credentials=True)
+# 請求計時須最先註冊，才涵蓋下方租戶解析與 session 建立
+init_metrics(app)
+# 管理者帶 X-SQL-Profile: 1 時分析該請求的 SQL；慢查詢一律記錄
+init_sql_profiler(app)
+# 管理者帶 X-CPU-Profile: 1 或 ?cprofile=1 時以 cProfile 分析該請求
+init_cpu_profiler(app)
 
 # --- 設定 logging 輸出到 APP.log 和 console ---
-log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
+# 請求執行緒只將紀錄放入佇列，由背景執行緒寫檔；層級以 LOG_LEVEL / LOG_LEVELS 環境變數設定
 log_file = os.path.join(basedir, 'APP.log')
-file_handler = RotatingFileHandler(log_file, maxBytes=10*1024*1024, backupCount=5, encoding='utf-8')
-file_handler.setFormatter(log_formatter)
-file_handler.setLevel(logging.DEBUG)
-
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(log_formatter)
-console_handler.setLevel(logging.DEBUG)
-
+setup_logging(log_file)
 logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
-
-db_uri_lock = threading.Lock()
-checked_dbs = set()
-
-# --- 根據 username 決定資料庫 URI ---
-def get_db_uri_for_user(username: str) -> str:
-    logger.debug(f"判斷資料庫連線，username={username}")
-    if username:
-        uname = username.lower()
-        if uname.startswith('dep'):
-            suffix = uname[3:]
-            if suffix.endswith('t'):
-                suffix = suffix[:-1]
-            if suffix.isdigit():
-                dep_num = int(suffix)
-                if 1 <= dep_num <= 9:
-                    db_file = f"materials_{dep_num}.db"
-                    uri = f"sqlite:///{os.path.join(basedir, db_file)}"
-                    logger.debug(f"使用 {username} 對應資料庫 {uri}")
-                    return uri
-    default_uri = f"sqlite:///{default_db_path}"
-    logger.debug(f"使用預設資料庫 {default_uri}")
-    return default_uri
 
 # --- 創建資料表的函數 ---
 def create_tables_if_not_exist(database_uri):
-    engine = create_engine(database_uri)
     try:
-        Base.metadata.create_all(engine)  # 創建所有資料表
+        ensure_schema(database_uri)  # 創建所有資料表並補上低庫存索引
         logger.info("資料表已成功創建或已存在。")
     except SQLAlchemyError as e:
         logger.error(f"資料表創建失敗: {e}")
         raise
 
+# --- 請求前依使用者設定資料庫 session ---
+
+@app.before_request
+def set_db_session_per_user():
+    if request.method == 'OPTIONS' or not request.path.startswith('/api'):
+        return
+
+    username, claims = None, None
+    try:
+        verify_jwt_in_request(optional=True)
+        username = get_jwt_identity()
+        claims = get_jwt()
+    except Exception as e:
+        # 無效 token 交由各端點的 jwt_required 回應，這裡先使用預設資料庫
+        logger.debug("JWT 驗證失敗，使用預設資料庫: %s", e)
+
+    # 登入時已將租戶寫入 token，這裡不需任何 I/O 即可決定資料庫
+    db_uri = db_uri_from_claims(username, claims)
+    if db_uri is None:
+        return jsonify({'error': '所屬部門尚未啟用或已停用'}), 403
+    # 資料庫還原中（排空等待或取代中）不接受新請求
+    if not enter_database(db_uri):
+        return jsonify({'error': '資料庫還原中，請稍後再試'}), 503, {'Retry-After': '5'}
+    g.db_gate = db_uri
+    g.db_uri = db_uri
+    if username:
+        tenant = tenant_from_claims(username, claims)
+        set_request_department(tenant)
+        # 名額只在登入、auto-auth 與換發 token 時佔用；一般請求只延長既有名額的閒置期限
+        session_registry.touch(username, tenant)
+    ensure_schema(db_uri)
+    g.db_session = get_session_factory(db_uri)
+
+@app.teardown_request
+def remove_db_session(exception=None):
+    sess = getattr(g, 'db_session', None)
+    if sess is not None:
+        sess.remove()
+    gate = g.pop('db_gate', None)
+    if gate is not None:
+        leave_database(gate)
+    dispose_retired_engines()
+    # 不 dispose engine，因為使用快取共用 engine
+
 # --- 健康檢查 API ---
 @app.route('/api/health', methods=['GET'], strict_slashes=False)
 def health_check():
@@ -104,16 +135,20 @@ def login():
     if not username or not password:
         return jsonify({"msg": "用戶名和密碼為必填項"}), 400
 
-    session = sessionmaker(bind=create_engine(app.config['SQLALCHEMY_DATABASE_URI']))()
+    session = get_session_factory(app.config['SQLALCHEMY_DATABASE_URI'])()
     try:
         user = session.query(User).filter_by(username=username).first()
-        logger.debug(f"查詢用戶: {username}, 查詢結果: {user}")
+        logger.debug("查詢用戶: %s, 找到: %s", username, user is not None)
 
-        if user and user.verify_password(password):
-            access_token = create_access_token(identity=username)
-            return jsonify(access_token=access_token), 200
+        if user and verify_password(user.password_hash, password):
+            queued = admit_session(username, resolve_tenant(username))
+            if queued:
+                return queued
+            return jsonify(issue_tokens(username)), 200
         else:
             return jsonify({"msg": "用戶名或密碼錯誤"}), 401
+    except LoginBusyError:
+        return jsonify({"msg": "登入人數過多，請稍後再試"}), 503, {'Retry-After': '5'}
     except SQLAlchemyError as e:
         logger.error(f"資料庫查詢失敗: {e}")
         return jsonify({"msg": "伺服器錯誤"}), 500
@@ -128,15 +163,24 @@ app.register_blueprint(record_bp)
 app.register_blueprint(report_bp)
 app.register_blueprint(backup_bp)
 app.register_blueprint(font_bp)
+app.register_blueprint(tenant_bp)
+app.register_blueprint(metrics_bp)
+app.register_blueprint(profile_bp)
 
 # --- 主程式啟動 ---
 if __name__ == '__main__':
-    with db_uri_lock:
-        try:
-            create_tables_if_not_exist(app.config['SQLALCHEMY_DATABASE_URI'])
-            checked_dbs.add(app.config['SQLALCHEMY_DATABASE_URI'])
-        except SQLAlchemyError as e:
-            logger.error(f"資料表創建失敗: {e}")
-            exit(1)
+    try:
+        create_tables_if_not_exist(app.config['SQLALCHEMY_DATABASE_URI'])
+    except SQLAlchemyError as e:
+        logger.error(f"資料表創建失敗: {e}")
+        exit(1)
+
+    # 啟動後稍待再於背景預載報表模組與字型，不延後開始接受請求
+    prewarm_timer = threading.Timer(2.0, prewarm_report_modules)
+    prewarm_timer.daemon = True
+    prewarm_timer.start()
+
+    # 背景排程備份所有租戶資料庫（BACKUP_INTERVAL=0 可停用）
+    backup_scheduler.start()
 
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), debug=False)
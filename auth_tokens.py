@@ -0,0 +1,120 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from flask_jwt_extended import create_access_token, create_refresh_token
+from werkzeug.security import check_password_hash
+from tenants import tenant_claims
+
+logger = logging.getLogger(__name__)
+
+# 密碼驗證（PBKDF2）刻意耗費 CPU，集中在少數執行緒執行，登入尖峰時不會佔滿所有請求執行緒
+PASSWORD_VERIFY_WORKERS = int(os.environ.get('PASSWORD_VERIFY_WORKERS', 2))
+# 排隊加驗證超過此秒數即回應 503，請前端稍後重試
+PASSWORD_VERIFY_TIMEOUT = 10
+
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_VERIFY_WORKERS, thread_name_prefix='password-verify')
+
+class LoginBusyError(Exception):
+    """密碼驗證佇列等待逾時"""
+
+def verify_password(password_hash: str, password: str, timeout: float = PASSWORD_VERIFY_TIMEOUT) -> bool:
+    """在密碼驗證執行緒池中執行 check_password_hash，逾時拋出 LoginBusyError"""
+    if not password_hash or password is None:
+        return False
+    future = password_executor.submit(check_password_hash, password_hash, password)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        logger.warning(f"密碼驗證等待超過 {timeout} 秒，拒絕本次登入")
+        raise LoginBusyError()
+
+# 同一次登入後輪替出的所有 token 共用此 claim，偵測到 refresh token 重複使用時整組撤銷
+TOKEN_FAMILY_CLAIM = 'fam'
+
+class RefreshTokenStore:
+    """
+    記錄已輪替（使用過）的 refresh token jti 與已撤銷的 token 家族，直到對應 token 過期為止。
+    只存在記憶體中，伺服器重新啟動後舊 refresh token 在到期前仍可使用一次。
+    """
+    PURGE_EVERY = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revoked = {}
+        self._revoked_families = {}
+        self._writes = 0
+
+    def _purge(self):
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            now = time.time()
+            self._revoked = {k: v for k, v in self._revoked.items() if v > now}
+            self._revoked_families = {k: v for k, v in self._revoked_families.items() if v > now}
+
+    def revoke(self, jti: str, expires_at: float) -> bool:
+        """撤銷 jti；已撤銷過（重複使用）時回傳 False。檢查與撤銷在同一個鎖內，並行換發只有一個會成功"""
+        with self._lock:
+            if jti in self._revoked:
+                return False
+            self._revoked[jti] = expires_at
+            self._purge()
+            return True
+
+    def revoke_family(self, family: str, expires_at: float):
+        with self._lock:
+            self._revoked_families[family] = max(expires_at, self._revoked_families.get(family, 0))
+            self._purge()
+
+    def is_revoked(self, jti: str, family: str = None) -> bool:
+        with self._lock:
+            return jti in self._revoked or (family is not None and family in self._revoked_families)
+
+refresh_token_store = RefreshTokenStore()
+
+def _revoke_token_family(username: str, jwt_payload: dict):
+    """refresh token 重複使用（遭竊或重送）時撤銷整個家族，合法使用者手上的 token 也一併失效"""
+    now = time.time()
+    family = jwt_payload.get(TOKEN_FAMILY_CLAIM)
+    if family is not None:
+        # 家族中最新的 token 不會比「現在 + refresh token 有效期間」更晚過期
+        lifetime = max(jwt_payload.get('exp', now) - jwt_payload.get('iat', now), 0)
+        refresh_token_store.revoke_family(family, now + lifetime)
+    logger.warning("使用者 %s 的 refresh token %s 重複使用，已撤銷整組 token", username, jwt_payload.get('jti'))
+
+def is_token_revoked(jwt_payload: dict) -> bool:
+    """
+    供 JWTManager.token_in_blocklist_loader 使用：已使用過的 refresh token，
+    以及家族被撤銷的所有 token（含 access token）都視為撤銷
+    """
+    family = jwt_payload.get(TOKEN_FAMILY_CLAIM)
+    if jwt_payload.get('type') == 'refresh':
+        if refresh_token_store.is_revoked(jwt_payload.get('jti')):
+            _revoke_token_family(jwt_payload.get('sub'), jwt_payload)
+            return True
+        return refresh_token_store.is_revoked(None, family)
+    return family is not None and refresh_token_store.is_revoked(None, family)
+
+def issue_tokens(username: str, family: str = None) -> dict:
+    """登入或換新時回傳 access token 與 refresh token，兩者都帶租戶 claim 與 token 家族；登入時開始新的家族"""
+    claims = dict(tenant_claims(username), **{TOKEN_FAMILY_CLAIM: family or uuid.uuid4().hex})
+    return {
+        'access_token': create_access_token(identity=username, additional_claims=claims),
+        'refresh_token': create_refresh_token(identity=username, additional_claims=claims),
+    }
+
+def rotate_refresh_token(username: str, jwt_payload: dict):
+    """
+    撤銷目前的 refresh token 並在同一家族內發出新的一組 token，同一個 refresh token 只能使用一次。
+    已使用過（遭竊或重送）時撤銷整個家族並回傳 None，呼叫端應回應 401。
+    """
+    if not refresh_token_store.revoke(jwt_payload['jti'], jwt_payload.get('exp', time.time())):
+        # 並行的換新請求都通過了 blocklist 檢查，只有先撤銷成功的那一個能拿到新 token
+        _revoke_token_family(username, jwt_payload)
+        return None
+    tokens = issue_tokens(username, jwt_payload.get(TOKEN_FAMILY_CLAIM))
+    logger.debug("使用者 %s 換新 token，舊 refresh token %s 已撤銷", username, jwt_payload['jti'])
+    return tokens
@@ -0,0 +1,647 @@
+import io
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import argparse
+import sqlite3
+import hashlib
+import logging
+import zipfile
+import zlib
+import tempfile
+import threading
+from datetime import datetime
+from urllib.request import pathname2url
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+from models import SCHEMA_VERSION
+from tenants import BASE_DIR, tenant_databases, replace_database_file, drained_database, DatabaseBusyError
+
+logger = logging.getLogger(__name__)
+
+# 備份相關檔案統一放在 backups/ 底下，不再散落在專案根目錄
+BACKUP_ROOT = os.path.join(BASE_DIR, 'backups')
+BACKUP_TMP_DIR = os.path.join(BACKUP_ROOT, 'tmp')
+
+# sqlite3 backup API 每一步複製的頁數，步與步之間釋放讀取鎖讓寫入者進行
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP = 0.005
+# 同一資料庫在此秒數內且未變動時重複使用快照，讓中斷的下載能以 Range 續傳同一份內容
+SNAPSHOT_REUSE_SECONDS = 300
+COPY_CHUNK_SIZE = 1024 * 1024
+
+def source_signature(db_path):
+    """資料庫與 WAL 檔的大小與修改時間，用來判斷快照之後是否有寫入"""
+    signature = []
+    for path in (db_path, f"{db_path}-wal"):
+        try:
+            st = os.stat(path)
+            signature.append((st.st_size, st.st_mtime_ns))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+def snapshot_database(db_path, dest_path, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP):
+    """
+    以 sqlite3 backup API 分段複製線上資料庫到 dest_path，得到一致的快照；
+    來源以唯讀方式開啟，複製期間不阻擋其他連線寫入。回傳快照大小（bytes）。
+    """
+    src = sqlite3.connect(f"file:{pathname2url(db_path)}?mode=ro", uri=True)
+    dst = sqlite3.connect(dest_path)
+    try:
+        src.backup(dst, pages=pages, sleep=sleep)
+    finally:
+        dst.close()
+        src.close()
+    return os.path.getsize(dest_path)
+
+def gzip_file(src_path, dest_path, level=6):
+    """串流壓縮 src_path 到 dest_path，不將整個檔案讀入記憶體"""
+    with open(src_path, 'rb') as src, gzip.open(dest_path, 'wb', compresslevel=level) as dst:
+        shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+    return os.path.getsize(dest_path)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return True
+    except OSError as e:
+        # Windows 上檔案仍被下載中的回應開啟時無法刪除，稍後再試
+        logger.debug("暫時無法刪除 %s: %s", path, e)
+        return False
+
+# tmp 內各種暫存檔的前綴：下載快照、全部門打包；其餘（<tenant>_）為排程備份
+SNAPSHOT_TMP_PREFIX = 'snapshot_'
+BUNDLE_TMP_PREFIX = 'bundle_'
+# 啟動時只清除超過此秒數未修改的暫存檔，避免刪到其他行程剛建立的檔案；
+# 超過快照快取保留時間（2 × SNAPSHOT_REUSE_SECONDS）的快照已不會再被使用
+STALE_TMP_SECONDS = SNAPSHOT_REUSE_SECONDS * 2
+
+def clear_stale_tmp_files(match, tmp_dir=BACKUP_TMP_DIR, min_age=STALE_TMP_SECONDS):
+    """
+    刪除 tmp_dir 中 match(檔名) 為真且已閒置 min_age 秒的檔案，回傳刪除數量。
+    當機或重新啟動時中斷的下載、打包與排程備份會留下完整的資料庫複本，由各元件啟動時呼叫清理。
+    """
+    try:
+        names = os.listdir(tmp_dir)
+    except FileNotFoundError:
+        return 0
+    cutoff = time.time() - min_age
+    removed = 0
+    for name in names:
+        path = os.path.join(tmp_dir, name)
+        try:
+            if not match(name) or not os.path.isfile(path) or os.path.getmtime(path) > cutoff:
+                continue
+        except OSError:
+            continue
+        if remove_quietly(path):
+            removed += 1
+    if removed:
+        logger.info("已清除 %s 中 %d 個殘留的暫存檔", tmp_dir, removed)
+    return removed
+
+def make_snapshot(db_path, compress=False, tmp_dir=BACKUP_TMP_DIR):
+    """在 tmp_dir 建立快照（可選 gzip），回傳檔案路徑；呼叫端負責刪除"""
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, raw_path = tempfile.mkstemp(suffix='.db', prefix=SNAPSHOT_TMP_PREFIX, dir=tmp_dir)
+    os.close(fd)
+    try:
+        snapshot_database(db_path, raw_path)
+        if not compress:
+            return raw_path
+        gz_path = f"{raw_path}.gz"
+        gzip_file(raw_path, gz_path)
+        remove_quietly(raw_path)
+        return gz_path
+    except Exception:
+        remove_quietly(raw_path)
+        raise
+
+class SnapshotCache:
+    """
+    下載用快照快取：同一資料庫與壓縮選項在 SNAPSHOT_REUSE_SECONDS 內且來源未變動時回傳同一份檔案與 ETag，
+    過期或被取代的快照在之後的呼叫中刪除。
+    產生快照（備份、gzip、sha256）只持有該 (db_path, compress) 的鎖，不同資料庫可同時產生；
+    _lock 只保護 _entries、_key_locks 與清理清單。
+    """
+
+    def __init__(self, reuse_seconds=SNAPSHOT_REUSE_SECONDS):
+        self.reuse_seconds = reuse_seconds
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._key_locks = {}
+        self._pending_delete = []
+        # 上次執行中斷而殘留的下載快照與全部門打包暫存檔
+        clear_stale_tmp_files(lambda name: name.startswith((SNAPSHOT_TMP_PREFIX, BUNDLE_TMP_PREFIX)))
+
+    def _sweep(self, now):
+        for key, entry in list(self._entries.items()):
+            if now - entry['created'] > self.reuse_seconds * 2:
+                self._pending_delete.append(entry['path'])
+                del self._entries[key]
+        self._pending_delete = [p for p in self._pending_delete if not remove_quietly(p)]
+
+    def get(self, db_path, compress=False):
+        """回傳 {'path', 'etag', 'size', 'reused'}"""
+        key = (db_path, compress)
+        with self._lock:
+            self._sweep(time.monotonic())
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # 同一 key 的並行請求在這裡等待，前一個產生的快照即可重複使用
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            now = time.monotonic()
+            signature = source_signature(db_path)
+            if (entry and now - entry['created'] <= self.reuse_seconds
+                    and entry['signature'] == signature and os.path.exists(entry['path'])):
+                return dict(entry, reused=True)
+
+            path = make_snapshot(db_path, compress)
+            entry = {
+                'path': path,
+                'etag': file_sha256(path)[:32],
+                'size': os.path.getsize(path),
+                'signature': signature,
+                'created': now,
+            }
+            with self._lock:
+                previous = self._entries.get(key)
+                if previous:
+                    self._pending_delete.append(previous['path'])
+                self._entries[key] = entry
+            return dict(entry, reused=False)
+
+snapshot_cache = SnapshotCache()
+
+# --- 全部門備份打包 ---
+class _ZipStreamBuffer(io.RawIOBase):
+    """只能寫入、不可 seek 的緩衝區，zipfile 寫入的資料由產生器隨即取出送給用戶端"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _snapshot_for_bundle(tenant, db_path):
+    fd, path = tempfile.mkstemp(suffix='.db', prefix=f"{BUNDLE_TMP_PREFIX}{tenant}_", dir=BACKUP_TMP_DIR)
+    os.close(fd)
+    try:
+        started = time.perf_counter()
+        size = snapshot_database(db_path, path)
+        return path, size, time.perf_counter() - started
+    except Exception:
+        remove_quietly(path)
+        raise
+
+def _discard_bundle_snapshot(future):
+    if not future.cancelled() and future.exception() is None:
+        remove_quietly(future.result()[0])
+
+def stream_backup_bundle(databases, max_workers=None, compresslevel=6):
+    """
+    產生器：同時為 databases 建立線上快照（最多 max_workers 份暫存），每完成一份就壓縮寫入 zip 並立即送出，
+    整個 zip 不會在記憶體或磁碟上組成完整副本。最後附上 manifest.json（含各資料庫大小與整體 MB/s）。
+    """
+    max_workers = max_workers or BACKUP_WORKERS
+    os.makedirs(BACKUP_TMP_DIR, exist_ok=True)
+    started = time.perf_counter()
+    buffer = _ZipStreamBuffer()
+    pending = list(databases)
+    in_flight = {}
+    entries = []
+    sent_bytes = 0
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bundle-snapshot')
+
+    def submit_next():
+        if pending:
+            tenant, db_path = pending.pop(0)
+            in_flight[executor.submit(_snapshot_for_bundle, tenant, db_path)] = (tenant, db_path)
+
+    try:
+        for _ in range(max_workers):
+            submit_next()
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zf:
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tenant, db_path = in_flight.pop(future)
+                    submit_next()
+                    try:
+                        path, size, snapshot_seconds = future.result()
+                    except Exception as e:
+                        logger.error(f"租戶 {tenant} 快照失敗，未放入備份包: {e}")
+                        entries.append({'tenant': tenant, 'status': 'error', 'error': str(e)})
+                        continue
+                    try:
+                        with open(path, 'rb') as src, zf.open(f"{tenant}.db", 'w', force_zip64=True) as dst:
+                            for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b''):
+                                dst.write(chunk)
+                                data = buffer.pop()
+                                if data:
+                                    sent_bytes += len(data)
+                                    yield data
+                    finally:
+                        remove_quietly(path)
+                    entries.append({'tenant': tenant, 'status': 'ok', 'file': f"{tenant}.db", 'bytes': size,
+                                    'snapshot_seconds': round(snapshot_seconds, 3)})
+                    data = buffer.pop()
+                    if data:
+                        sent_bytes += len(data)
+                        yield data
+
+            elapsed = time.perf_counter() - started
+            source_bytes = sum(e.get('bytes', 0) for e in entries)
+            summary = {
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'databases': sorted(entries, key=lambda e: e['tenant']),
+                'source_bytes': source_bytes,
+                'seconds': round(elapsed, 3),
+                'mb_per_second': round(source_bytes / 1024 / 1024 / elapsed, 2) if elapsed > 0 else None,
+            }
+            zf.writestr('manifest.json', json.dumps(summary, ensure_ascii=False, indent=2))
+        data = buffer.pop()
+        sent_bytes += len(data)
+        yield data
+        elapsed = time.perf_counter() - started
+        logger.info(f"全部門備份包完成：{len(entries)} 個資料庫，原始 {summary['source_bytes'] / 1024 / 1024:.2f} MB，"
+                    f"傳送 {sent_bytes / 1024 / 1024:.2f} MB，{elapsed:.3f} 秒，"
+                    f"{summary['source_bytes'] / 1024 / 1024 / elapsed if elapsed > 0 else 0:.2f} MB/s")
+    finally:
+        # 用戶端中途斷線時清掉尚未打包的快照
+        for future in in_flight:
+            future.add_done_callback(_discard_bundle_snapshot)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# --- 排程備份 ---
+SCHEDULED_DIR = os.path.join(BACKUP_ROOT, 'scheduled')
+# 排程間隔秒數，0 表示不啟動背景排程
+BACKUP_INTERVAL = int(os.environ.get('BACKUP_INTERVAL', 3600))
+BACKUP_WORKERS = 4
+# 祖父-父-子保留策略：每小時保留最近 24 小時、每日最近 7 天、每週最近 4 週、每月最近 12 個月各一份
+RETENTION = {'hourly': 24, 'daily': 7, 'weekly': 4, 'monthly': 12}
+
+def apply_retention(entries, retention=RETENTION):
+    """
+    依祖父-父-子策略挑出要保留的備份：每小時、每天、每週、每月各保留最新的一份，
+    分別保留最近 retention 個週期；最新一份永遠保留。回傳 (保留, 刪除)。
+    """
+    entries = sorted(entries, key=lambda e: e['created_at'], reverse=True)
+    keep_ids = set()
+    if entries:
+        keep_ids.add(entries[0]['file'])
+    buckets = {
+        'hourly': lambda dt: dt.strftime('%Y-%m-%d %H'),
+        'daily': lambda dt: dt.strftime('%Y-%m-%d'),
+        'weekly': lambda dt: '%d-W%02d' % dt.isocalendar()[:2],
+        'monthly': lambda dt: dt.strftime('%Y-%m'),
+    }
+    for name, bucket_of in buckets.items():
+        seen = []
+        for entry in entries:
+            bucket = bucket_of(datetime.fromisoformat(entry['created_at']))
+            if bucket in seen:
+                continue
+            if len(seen) >= retention.get(name, 0):
+                break
+            seen.append(bucket)
+            keep_ids.add(entry['file'])
+    keep = [e for e in entries if e['file'] in keep_ids]
+    drop = [e for e in entries if e['file'] not in keep_ids]
+    return keep, drop
+
+class BackupScheduler:
+    """
+    定期備份所有租戶資料庫：以執行緒池同時備份，PRAGMA data_version 未變或快照 SHA-256
+    與上次相同時略過；新備份以 gzip 壓縮，套用保留策略後寫入 manifest.json。
+    """
+
+    def __init__(self, root=SCHEDULED_DIR, interval=BACKUP_INTERVAL, retention=RETENTION, max_workers=BACKUP_WORKERS):
+        self.root = root
+        self.interval = interval
+        self.retention = retention
+        self.max_workers = max_workers
+        self.manifest_path = os.path.join(root, 'manifest.json')
+        self._run_lock = threading.Lock()
+        self._version_lock = threading.Lock()
+        self._watchers = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'tenants': {}}
+
+    def _write_manifest(self, manifest):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def data_version(self, db_path):
+        """
+        以常駐連線讀取 PRAGMA data_version；其他連線（含其他行程）提交後數值會改變。
+        回傳 (目前值, 上次備份時的值)。
+        """
+        with self._version_lock:
+            watcher = self._watchers.get(db_path)
+            if watcher is None:
+                conn = sqlite3.connect(f"file:{pathname2url(db_path)}?mode=ro", uri=True, check_same_thread=False)
+                watcher = self._watchers[db_path] = {'conn': conn, 'backed_up': None}
+            current = watcher['conn'].execute("PRAGMA data_version").fetchone()[0]
+            return current, watcher['backed_up']
+
+    def forget(self, db_path):
+        """關閉 db_path 的常駐連線（資料庫檔案被取代時），下次執行時重新建立並視為未備份"""
+        with self._version_lock:
+            watcher = self._watchers.pop(db_path, None)
+        if watcher is not None:
+            watcher['conn'].close()
+
+    def _mark_backed_up(self, db_path, version):
+        with self._version_lock:
+            if db_path in self._watchers:
+                self._watchers[db_path]['backed_up'] = version
+
+    def backup_tenant(self, tenant, db_path, last_entry):
+        started = time.perf_counter()
+        result = {'tenant': tenant, 'db_path': db_path}
+        version, backed_up = self.data_version(db_path)
+        if backed_up is not None and version == backed_up and last_entry:
+            result.update(status='unchanged', reason='data_version')
+            return result, None
+
+        fd, raw_path = tempfile.mkstemp(suffix='.db', prefix=f"{tenant}_", dir=BACKUP_TMP_DIR)
+        os.close(fd)
+        try:
+            source_bytes = snapshot_database(db_path, raw_path)
+            checksum = file_sha256(raw_path)
+            if last_entry and last_entry.get('sha256') == checksum:
+                self._mark_backed_up(db_path, version)
+                result.update(status='unchanged', reason='checksum')
+                return result, None
+
+            created = datetime.now()
+            relative = os.path.join(tenant, f"{tenant}_{created.strftime('%Y%m%d_%H%M%S')}.db.gz")
+            target = os.path.join(self.root, relative)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            compressed_bytes = gzip_file(raw_path, target)
+        finally:
+            remove_quietly(raw_path)
+
+        self._mark_backed_up(db_path, version)
+        entry = {
+            'file': relative.replace(os.sep, '/'),
+            'created_at': created.isoformat(timespec='seconds'),
+            'sha256': checksum,
+            'source_bytes': source_bytes,
+            'bytes': compressed_bytes,
+        }
+        result.update(status='ok', file=entry['file'], bytes=compressed_bytes, seconds=round(time.perf_counter() - started, 3))
+        return result, entry
+
+    def run_once(self):
+        """備份所有租戶一次，回傳本次摘要；同一時間只會有一個執行中的排程"""
+        with self._run_lock:
+            os.makedirs(self.root, exist_ok=True)
+            os.makedirs(BACKUP_TMP_DIR, exist_ok=True)
+            started = time.perf_counter()
+            manifest = self.load_manifest()
+            history = manifest.setdefault('tenants', {})
+            results = []
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='scheduled-backup') as executor:
+                futures = {}
+                for tenant, db_path in tenant_databases():
+                    entries = sorted(history.get(tenant, []), key=lambda e: e['created_at'])
+                    futures[executor.submit(self.backup_tenant, tenant, db_path, entries[-1] if entries else None)] = tenant
+                for future in as_completed(futures):
+                    tenant = futures[future]
+                    try:
+                        result, entry = future.result()
+                    except Exception as e:
+                        logger.exception(f"租戶 {tenant} 排程備份失敗: {e}")
+                        result, entry = {'tenant': tenant, 'status': 'error', 'error': str(e)}, None
+                    if entry:
+                        history.setdefault(tenant, []).append(entry)
+                    results.append(result)
+
+            removed = 0
+            for tenant, entries in history.items():
+                keep, drop = apply_retention(entries, self.retention)
+                for entry in drop:
+                    if remove_quietly(os.path.join(self.root, entry['file'])):
+                        removed += 1
+                    else:
+                        keep.append(entry)
+                history[tenant] = sorted(keep, key=lambda e: e['created_at'])
+
+            summary = {
+                'finished_at': datetime.now().isoformat(timespec='seconds'),
+                'seconds': round(time.perf_counter() - started, 3),
+                'backed_up': sum(1 for r in results if r['status'] == 'ok'),
+                'unchanged': sum(1 for r in results if r['status'] == 'unchanged'),
+                'failed': sum(1 for r in results if r['status'] == 'error'),
+                'removed': removed,
+                'results': sorted(results, key=lambda r: r['tenant']),
+            }
+            manifest['last_run'] = summary
+            self._write_manifest(manifest)
+            logger.info(f"排程備份完成: 新備份 {summary['backed_up']}，未變動 {summary['unchanged']}，"
+                        f"失敗 {summary['failed']}，依保留策略刪除 {removed}，耗時 {summary['seconds']} 秒")
+            return summary
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.exception(f"排程備份發生錯誤: {e}")
+
+    def start(self):
+        """啟動背景排程執行緒（daemon），每 interval 秒執行一次"""
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        # 上次執行中斷而殘留的排程備份暫存檔（<tenant>_*.db 與其 .gz）
+        clear_stale_tmp_files(lambda name: not name.startswith((SNAPSHOT_TMP_PREFIX, BUNDLE_TMP_PREFIX)))
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='backup-scheduler', daemon=True)
+        self._thread.start()
+        logger.info(f"排程備份已啟動，每 {self.interval} 秒執行一次")
+
+    def stop(self):
+        self._stop.set()
+
+backup_scheduler = BackupScheduler()
+
+# --- 還原 ---
+PRE_RESTORE_DIR = os.path.join(BACKUP_ROOT, 'pre_restore')
+GZIP_MAGIC = b'\x1f\x8b'
+SQLITE_MAGIC = b'SQLite format 3\x00'
+# 還原檔至少須包含的資料表，其餘缺少的資料表在取代後由 ensure_schema() 補上
+REQUIRED_TABLES = {'materials', 'in_record', 'out_record', 'user'}
+_restore_lock = threading.Lock()
+
+class RestoreError(Exception):
+    """上傳的還原檔無效（格式、完整性或結構版本不符）"""
+
+def receive_restore_file(stream, dest_dir):
+    """
+    將上傳內容串流寫入 dest_dir 下的暫存檔（與目標資料庫同一檔案系統，才能以 os.replace 原子取代），
+    開頭為 gzip magic（1f 8b）時邊讀邊解壓。回傳暫存檔路徑；呼叫端負責刪除。
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix='.restore', prefix='.', dir=dest_dir)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            head = stream.read(2)
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if head == GZIP_MAGIC else None
+            chunk = head
+            while chunk:
+                if decompressor is not None:
+                    try:
+                        chunk = decompressor.decompress(chunk)
+                    except zlib.error as e:
+                        raise RestoreError(f"gzip 解壓失敗: {e}")
+                out.write(chunk)
+                chunk = stream.read(COPY_CHUNK_SIZE)
+            if decompressor is not None:
+                if not decompressor.eof:
+                    raise RestoreError("gzip 檔案不完整")
+                out.write(decompressor.flush())
+        return tmp_path
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+
+def validate_restore_file(path):
+    """檢查 SQLite 檔頭、PRAGMA integrity_check、必要資料表與結構版本，回傳 {'schema_version', 'tables'}"""
+    with open(path, 'rb') as f:
+        if f.read(len(SQLITE_MAGIC)) != SQLITE_MAGIC:
+            raise RestoreError("不是 SQLite 資料庫檔案")
+    conn = sqlite3.connect(f"file:{pathname2url(path)}?mode=ro", uri=True)
+    try:
+        problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+        if problems != ['ok']:
+            raise RestoreError(f"資料庫完整性檢查失敗: {'; '.join(problems[:5])}")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    except sqlite3.DatabaseError as e:
+        raise RestoreError(f"無法讀取資料庫: {e}")
+    finally:
+        conn.close()
+    if version > SCHEMA_VERSION:
+        raise RestoreError(f"還原檔結構版本 {version} 比程式版本 {SCHEMA_VERSION} 新")
+    missing = REQUIRED_TABLES - tables
+    if missing:
+        raise RestoreError(f"還原檔缺少資料表: {', '.join(sorted(missing))}")
+    return {'schema_version': version, 'tables': sorted(tables)}
+
+def pre_restore_snapshot(tenant, db_path):
+    """取代前先保留目前資料庫的 gzip 快照，回傳檔案路徑"""
+    dest_dir = os.path.join(PRE_RESTORE_DIR, tenant)
+    os.makedirs(dest_dir, exist_ok=True)
+    path = make_snapshot(db_path, compress=True, tmp_dir=dest_dir)
+    final_path = os.path.join(dest_dir, f"{tenant}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db.gz")
+    os.replace(path, final_path)
+    return final_path
+
+def restore_database(tenant, db_path, stream, safety_snapshot=True):
+    """
+    以上傳的快照還原租戶資料庫：串流寫入暫存檔、驗證，排空該租戶的請求與連線後保留還原前快照，
+    再原子取代並重建連線池。驗證失敗時拋出 RestoreError，無法排空或檔案被占用時拋出 DatabaseBusyError，
+    兩者原資料庫都不受影響。回傳還原摘要。
+    """
+    started = time.perf_counter()
+    db_path = os.path.abspath(db_path)
+    tmp_path = receive_restore_file(stream, os.path.dirname(db_path))
+    try:
+        received = time.perf_counter()
+        info = validate_restore_file(tmp_path)
+        validated = time.perf_counter()
+        size = os.path.getsize(tmp_path)
+        db_uri = f"sqlite:///{db_path}"
+        with _restore_lock, drained_database(db_uri):
+            drained = time.perf_counter()
+            safety_path = pre_restore_snapshot(tenant, db_path) if safety_snapshot and os.path.exists(db_path) else None
+            backup_scheduler.forget(db_path)
+            replace_database_file(db_uri, tmp_path)
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+    summary = {
+        'tenant': tenant,
+        'bytes': size,
+        'schema_version': info['schema_version'],
+        'pre_restore_snapshot': os.path.relpath(safety_path, BASE_DIR) if safety_path else None,
+        'receive_seconds': round(received - started, 3),
+        'validate_seconds': round(validated - received, 3),
+        'drain_seconds': round(drained - validated, 3),
+        'total_seconds': round(time.perf_counter() - started, 3),
+    }
+    logger.info(f"租戶 {tenant} 已還原，{size} bytes，結構版本 {info['schema_version']}，耗時 {summary['total_seconds']} 秒"
+                f"{f'，還原前快照 {safety_path}' if safety_path else ''}")
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='資料庫備份工具')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('run', help='立即備份所有租戶資料庫一次（套用保留策略並更新 manifest）')
+    restore_parser = subparsers.add_parser('restore', help='以快照檔（.db 或 .db.gz）還原租戶資料庫；服務執行中請改用 /api/backup/restore')
+    restore_parser.add_argument('tenant', help='租戶代碼，例如 main、dep3')
+    restore_parser.add_argument('file', help='快照檔路徑')
+    restore_parser.add_argument('--no-safety-snapshot', action='store_true', help='不保留還原前快照')
+    opts = parser.parse_args(argv)
+
+    if opts.command == 'run':
+        summary = backup_scheduler.run_once()
+        for r in summary['results']:
+            print(f"{r['tenant']:<6} {r['status']:<9} {r.get('file') or r.get('reason') or r.get('error', '')}")
+        print(f"新備份 {summary['backed_up']}，未變動 {summary['unchanged']}，失敗 {summary['failed']}，"
+              f"刪除 {summary['removed']}，共 {summary['seconds']} 秒")
+        return 0 if summary['failed'] == 0 else 1
+    if opts.command == 'restore':
+        db_path = dict(tenant_databases()).get(opts.tenant)
+        if db_path is None:
+            print(f"找不到租戶 {opts.tenant} 的資料庫")
+            return 2
+        try:
+            with open(opts.file, 'rb') as f:
+                summary = restore_database(opts.tenant, db_path, f, safety_snapshot=not opts.no_safety_snapshot)
+        except (OSError, RestoreError, DatabaseBusyError) as e:
+            print(f"還原失敗: {e}")
+            return 1
+        print(f"{opts.tenant} 已還原：{summary['bytes']} bytes，結構版本 {summary['schema_version']}，共 {summary['total_seconds']} 秒")
+        if summary['pre_restore_snapshot']:
+            print(f"還原前快照: {summary['pre_restore_snapshot']}")
+        return 0
+    return 2
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from sqlalchemy.orm import sessionmaker
+
+from tenants import BASE_DIR, registry, department_key, department_label, ensure_schema, get_engine
+
+logger = logging.getLogger(__name__)
+
+# 批次報表輸出根目錄，每次執行會在底下建立一個以時間命名的子目錄
+DEFAULT_OUTPUT_ROOT = os.path.join(BASE_DIR, 'reports')
+
+def render_department_report(dep_num, db_path, args, output_dir):
+    """
+    在子行程中為單一部門產生 PDF 報表並寫入 output_dir，
+    回傳該部門的 manifest 項目（含耗時）。
+    """
+    # ReportLab 排版是 CPU 密集工作，只在子行程內載入與執行
+    from routes.report import get_report_params, build_pdf_report
+
+    started = time.perf_counter()
+    entry = {
+        'dep_num': dep_num,
+        'department': department_key(dep_num),
+        'label': department_label(dep_num),
+        'db_path': db_path,
+    }
+    db_uri = f"sqlite:///{db_path}"
+    session = None
+    try:
+        ensure_schema(db_uri)
+        engine = get_engine(db_uri)
+        session = sessionmaker(bind=engine)()
+        dep_args = dict(args)
+        dep_args['school_dept'] = f"鳳山商工 {department_label(dep_num)}"
+        params = get_report_params(dep_args)
+        buffer = build_pdf_report(session, params, dep_args.get('query_mode', 'daterange'))
+        filename = f"{department_key(dep_num)}_{params[0]}.pdf"
+        with open(os.path.join(output_dir, filename), 'wb') as f:
+            f.write(buffer.getbuffer())
+        entry.update(status='ok', file=filename, bytes=buffer.getbuffer().nbytes)
+    except Exception as e:
+        entry.update(status='error', error=str(e))
+    finally:
+        if session is not None:
+            session.close()
+    entry['seconds'] = round(time.perf_counter() - started, 3)
+    return entry
+
+def run_batch(args, output_root=DEFAULT_OUTPUT_ROOT, max_workers=None, departments=None):
+    """
+    以 ProcessPoolExecutor 為所有部門資料庫平行產生同一份報表，
+    輸出到日期命名的目錄並寫入 manifest.json，回傳 manifest。
+    參數格式與 /api/report/preview 的 query string 相同；departments 預設為租戶登錄表中啟用的部門。
+    """
+    from routes.report import get_report_params
+
+    # 參數錯誤時在派工前就拋出 ValueError
+    report_type = get_report_params(args)[0]
+
+    if departments is None:
+        departments = registry.live_departments()
+    run_dir = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{report_type}"
+    output_dir = os.path.join(output_root, run_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    if max_workers is None:
+        max_workers = max(1, min(len(departments), os.cpu_count() or 1))
+
+    started = time.perf_counter()
+    results = []
+    if departments:
+        # 使用 spawn，子行程不會繼承父行程（Flask）已開啟的 SQLite 連線
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {
+                executor.submit(render_department_report, dep_num, db_path, dict(args), output_dir): (dep_num, db_path)
+                for dep_num, db_path in departments
+            }
+            for future in as_completed(futures):
+                dep_num, db_path = futures[future]
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    # 子行程異常結束（例如 BrokenProcessPool）時仍記錄該部門
+                    entry = {
+                        'dep_num': dep_num,
+                        'department': department_key(dep_num),
+                        'label': department_label(dep_num),
+                        'db_path': db_path,
+                        'status': 'error',
+                        'error': str(e),
+                    }
+                logger.info(f"部門 {entry['department']} 報表產生結果: {entry['status']}")
+                results.append(entry)
+    results.sort(key=lambda e: e['dep_num'])
+
+    manifest = {
+        'report_type': report_type,
+        'params': dict(args),
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'output_dir': output_dir,
+        'workers': max_workers,
+        'total_seconds': round(time.perf_counter() - started, 3),
+        'succeeded': sum(1 for e in results if e['status'] == 'ok'),
+        'failed': sum(1 for e in results if e['status'] != 'ok'),
+        'departments': results,
+    }
+    with open(os.path.join(output_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    logger.info(f"批次報表完成: {manifest['succeeded']} 成功, {manifest['failed']} 失敗, 共 {manifest['total_seconds']} 秒")
+    return manifest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='為所有部門資料庫批次產生 PDF 報表')
+    parser.add_argument('--report-type', default='stock_summary',
+                        choices=['stock_summary', 'in_records', 'out_records', 'low_stock_alert'])
+    parser.add_argument('--year', type=int, help='月份模式的年份（預設為本月）')
+    parser.add_argument('--month', type=int, help='月份模式的月份（預設為本月）')
+    parser.add_argument('--start-date', help='日期範圍模式的開始日期 YYYY-MM-DD')
+    parser.add_argument('--end-date', help='日期範圍模式的結束日期 YYYY-MM-DD')
+    parser.add_argument('--category', default='all')
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_ROOT)
+    parser.add_argument('--workers', type=int, default=None, help='子行程數（預設為 CPU 核心數）')
+    parser.add_argument('--params', help='直接指定 /api/report/preview 格式的參數 JSON，忽略上面的報表選項')
+    parser.add_argument('--result', help='另外把 manifest 寫到這個 JSON 檔（背景工作用）')
+    opts = parser.parse_args(argv)
+
+    if opts.params:
+        args = json.loads(opts.params)
+    else:
+        args = {'report_type': opts.report_type, 'category': opts.category}
+        if opts.start_date or opts.end_date:
+            args.update(query_mode='daterange', start_date=opts.start_date, end_date=opts.end_date)
+        else:
+            today = datetime.now()
+            args.update(query_mode='month', year=opts.year or today.year, month=opts.month or today.month)
+
+    try:
+        manifest = run_batch(args, output_root=opts.output_dir, max_workers=opts.workers)
+    except ValueError as e:
+        print(f"參數錯誤: {e}")
+        return 2
+    if opts.result:
+        with open(opts.result, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    for entry in manifest['departments']:
+        detail = entry.get('file') or entry.get('error')
+        print(f"{entry['department']:<6} {entry['label']:<4} {entry['status']:<5} {entry.get('seconds', '-')}s  {detail}")
+    print(f"共 {manifest['total_seconds']} 秒，輸出目錄: {manifest['output_dir']}")
+    return 0 if manifest['failed'] == 0 else 1
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
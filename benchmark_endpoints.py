@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+from datetime import datetime
+from urllib.request import pathname2url
+
+# 量測時不輸出一般 log、不對慢查詢執行 EXPLAIN，避免量到 log 本身的成本
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('SLOW_QUERY_MS', '0')
+
+from tenants import department_key, registry, department_db_path
+from benchmark_startup import DEFAULT_OUTPUT_DIR, git_revision
+
+DEFAULT_ITERATIONS = 30
+DEFAULT_WARMUP = 2
+# 單一情境累計超過此秒數即停止，避免大資料量下列出全部紀錄的端點拖垮整個測試
+DEFAULT_MAX_SECONDS = 60
+# 比較基準時 p95 變慢超過此比例視為退步
+DEFAULT_TOLERANCE = 0.2
+
+def peak_rss_bytes():
+    """目前行程的最高常駐記憶體（bytes），無法取得時回傳 None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 單位為 KB，macOS 為 bytes
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    except (AttributeError, OSError):
+        pass
+    return None
+
+def percentile(sorted_values, p):
+    """線性內插百分位數，sorted_values 須已排序"""
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (k - low)
+
+def sample_dataset(db_path, rng, count=200):
+    """從部門資料庫取出情境用的條碼、分類與最近有紀錄的年月"""
+    conn = sqlite3.connect(f"file:{pathname2url(db_path)}?mode=ro", uri=True)
+    try:
+        barcodes = [row[0] for row in conn.execute(
+            "SELECT barcode FROM materials WHERE barcode IS NOT NULL ORDER BY RANDOM() LIMIT ?", (count,))]
+        categories = [row[0] for row in conn.execute(
+            "SELECT category FROM materials GROUP BY category ORDER BY COUNT(*) DESC")]
+        latest = conn.execute("SELECT MAX(date) FROM in_record").fetchone()[0]
+        counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in ('materials', 'in_record', 'out_record')}
+    finally:
+        conn.close()
+    latest = datetime.fromisoformat(latest) if latest else datetime.now()
+    return {
+        'barcodes': barcodes or ['BC-00M0001'],
+        'categories': categories or ['all'],
+        'year': latest.year,
+        'month': latest.month,
+        'counts': counts,
+    }
+
+def build_scenarios(data, rng):
+    """情境名稱 -> 產生請求路徑的函式；分類挑選資料量中位數的分類，避免只量到最大或最小的分類"""
+    category = data['categories'][len(data['categories']) // 2]
+    month_args = f"query_mode=month&year={data['year']}&month={data['month']}"
+    return {
+        'materials_list': lambda: '/api/materials',
+        'materials_by_category': lambda: f"/api/materials?category={category}",
+        'materials_summary': lambda: '/api/materials/summary',
+        'materials_summary_categories': lambda: '/api/materials/summary/categories',
+        'barcode_lookup': lambda: f"/api/materials/barcode/{rng.choice(data['barcodes'])}",
+        'in_records_by_category': lambda: f"/api/in-records?category={category}",
+        'out_records_by_category': lambda: f"/api/out-records?category={category}",
+        'report_stock_summary_pdf': lambda: f"/api/report/preview?report_type=stock_summary&{month_args}",
+        'report_in_records_excel': lambda: f"/api/report/export_excel?report_type=in_records&{month_args}",
+        'report_low_stock_pdf': lambda: '/api/report/preview?report_type=low_stock_alert',
+    }
+
+def run_scenario(client, headers, make_path, iterations, warmup, max_seconds):
+    for _ in range(warmup):
+        client.get(make_path(), headers=headers)
+    latencies, statuses = [], {}
+    budget_started = time.perf_counter()
+    for _ in range(iterations):
+        path = make_path()
+        started = time.perf_counter()
+        response = client.get(path, headers=headers)
+        response.get_data()
+        latencies.append(time.perf_counter() - started)
+        statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+        if time.perf_counter() - budget_started > max_seconds:
+            break
+    latencies.sort()
+    return {
+        'iterations': len(latencies),
+        'statuses': statuses,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'min_ms': round(latencies[0] * 1000, 3),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+
+def run_benchmark(dep_num, iterations=DEFAULT_ITERATIONS, warmup=DEFAULT_WARMUP, max_seconds=DEFAULT_MAX_SECONDS,
+                  only=None, seed=42, progress=print):
+    """以 Flask test client 對部門資料庫執行各情境，回傳結果字典"""
+    from flask_jwt_extended import create_access_token
+    from tenants import tenant_claims
+    from app import app
+
+    dep = registry.department(dep_num)
+    db_path = dep['db_path'] if dep else department_db_path(dep_num)
+    if not os.path.exists(db_path):
+        raise ValueError(f"找不到部門資料庫 {db_path}，請先以 generate_dataset.py 產生")
+    rng = random.Random(seed)
+    data = sample_dataset(db_path, rng)
+    username = department_key(dep_num)
+    with app.app_context():
+        token = create_access_token(identity=username, additional_claims=tenant_claims(username))
+    headers = {'Authorization': f"Bearer {token}"}
+    client = app.test_client()
+
+    scenarios = build_scenarios(data, rng)
+    if only:
+        unknown = set(only) - set(scenarios)
+        if unknown:
+            raise ValueError(f"未知的情境: {', '.join(sorted(unknown))}（可用：{', '.join(scenarios)}）")
+        scenarios = {name: make_path for name, make_path in scenarios.items() if name in only}
+
+    results = {}
+    for name, make_path in scenarios.items():
+        results[name] = run_scenario(client, headers, make_path, iterations, warmup, max_seconds)
+        r = results[name]
+        progress(f"{name:<30} n={r['iterations']:<4} p50={r['p50_ms']:>9.1f} ms  p95={r['p95_ms']:>9.1f} ms  "
+                 f"p99={r['p99_ms']:>9.1f} ms  status={r['statuses']}")
+    return {
+        'department': username,
+        'db_path': db_path,
+        'dataset': data['counts'],
+        'scenarios': results,
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+
+def compare_results(baseline, current, tolerance=DEFAULT_TOLERANCE):
+    """比較兩份結果的 p50/p95，回傳 (各情境比較列, 是否有退步)"""
+    rows, regressed = [], False
+    for name, now in current['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        row = {'scenario': name}
+        for key in ('p50_ms', 'p95_ms'):
+            row[key] = (before[key], now[key], round(now[key] / before[key] - 1, 3) if before[key] else None)
+        row['regressed'] = row['p95_ms'][2] is not None and row['p95_ms'][2] > tolerance
+        regressed = regressed or row['regressed']
+        rows.append(row)
+    return rows, regressed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='以 Flask test client 量測主要端點延遲（p50/p95/p99）與最高記憶體用量')
+    parser.add_argument('--department', type=int, default=1, help='使用的部門資料庫編號（預設 1）')
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS, help='每個情境的量測次數')
+    parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP, help='每個情境量測前的暖機次數')
+    parser.add_argument('--max-seconds', type=float, default=DEFAULT_MAX_SECONDS, help='單一情境量測時間上限（秒）')
+    parser.add_argument('--only', help='只執行指定情境，以逗號分隔')
+    parser.add_argument('--seed', type=int, default=42, help='條碼挑選的亂數種子')
+    parser.add_argument('--output', help='JSON 輸出路徑（預設 bench_results/endpoints_<時間>.json）')
+    parser.add_argument('--compare', help='與先前的 JSON 結果比較，p95 退步超過 --tolerance 時 exit code 為 1')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='可接受的 p95 變慢比例（預設 0.2）')
+    opts = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    try:
+        bench = run_benchmark(opts.department, opts.iterations, opts.warmup, opts.max_seconds,
+                              [s.strip() for s in opts.only.split(',')] if opts.only else None, opts.seed)
+    except ValueError as e:
+        print(e)
+        return 2
+    results = {
+        'benchmark': 'endpoints',
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'iterations': opts.iterations,
+        'seconds': round(time.perf_counter() - started, 3),
+        **bench,
+    }
+    rss = results['peak_rss_bytes']
+    print(f"\n資料量 {results['dataset']}，最高常駐記憶體 {f'{rss / 1024 / 1024:.1f} MB' if rss else '無法取得'}")
+
+    output = opts.output or os.path.join(DEFAULT_OUTPUT_DIR, f"endpoints_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"結果已寫入 {output}")
+
+    if opts.compare:
+        with open(opts.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows, regressed = compare_results(baseline, results, opts.tolerance)
+        print(f"\n與 {opts.compare}（{baseline.get('git_revision')}）比較：")
+        for row in rows:
+            p50, p95 = row['p50_ms'], row['p95_ms']
+            print(f"{row['scenario']:<30} p50 {p50[0]:>9.1f} -> {p50[1]:>9.1f} ms  p95 {p95[0]:>9.1f} -> {p95[1]:>9.1f} ms"
+                  f"  ({f'{p95[2]:+.0%}' if p95[2] is not None else '-'}){'  退步' if row['regressed'] else ''}")
+        return 1 if regressed else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
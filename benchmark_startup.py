@@ -0,0 +1,185 @@
+import os
+import re
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import subprocess
+import urllib.request
+import urllib.error
+from datetime import datetime
+
+from tenants import BASE_DIR, registry, department_key
+
+# 基準測試結果輸出目錄（JSON），可用於比較不同版本的啟動時間
+DEFAULT_OUTPUT_DIR = os.path.join(BASE_DIR, 'bench_results')
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$')
+
+def measure_import_times(runs=3):
+    """
+    以 `python -X importtime -c "import app"` 量測每個模組的匯入時間，
+    執行 runs 次後每個模組取最小值（微秒），依累計時間排序。
+    """
+    best = {}
+    totals = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import app'],
+            cwd=BASE_DIR, capture_output=True, text=True, encoding='utf-8', errors='replace'
+        )
+        totals.append(time.perf_counter() - started)
+        if proc.returncode != 0:
+            raise RuntimeError(f"匯入 app 失敗: {proc.stderr[-500:]}")
+        for line in proc.stderr.splitlines():
+            match = IMPORTTIME_LINE.match(line)
+            if not match:
+                continue
+            self_us, cumulative_us = int(match.group(1)), int(match.group(2))
+            depth = len(match.group(3)) // 2
+            name = match.group(4)
+            current = best.get(name)
+            if current is None or cumulative_us < current['cumulative_us']:
+                best[name] = {'module': name, 'self_us': self_us, 'cumulative_us': cumulative_us, 'depth': depth}
+
+    modules = sorted(best.values(), key=lambda m: m['cumulative_us'], reverse=True)
+    return {
+        'runs': runs,
+        'process_seconds': [round(t, 3) for t in totals],
+        'app_cumulative_us': best.get('app', {}).get('cumulative_us'),
+        'modules': modules
+    }
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def make_tokens(secret, usernames):
+    """用與伺服器相同的 JWT_SECRET_KEY 產生各部門帳號的 access token，與登入時一樣帶租戶 claim"""
+    from flask import Flask
+    from flask_jwt_extended import JWTManager, create_access_token
+    from tenants import tenant_claims
+
+    token_app = Flask(__name__)
+    token_app.config['JWT_SECRET_KEY'] = secret
+    JWTManager(token_app)
+    with token_app.app_context():
+        return {name: create_access_token(identity=name, additional_claims=tenant_claims(name)) for name in usernames}
+
+def timed_get(url, token=None, timeout=30):
+    """送出 GET，回傳 (狀態碼, 耗時秒數)；連線失敗時狀態碼為 None"""
+    headers = {'Authorization': f"Bearer {token}"} if token else {}
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        status = None
+    return status, time.perf_counter() - started
+
+def measure_server_startup(startup_timeout=60.0):
+    """
+    啟動 `python app.py`，量測從啟動到第一次 /api/health 成功的時間，
+    接著對每個部門資料庫量測第一次 /api/materials 的回應時間（含 engine 建立與結構檢查）。
+    """
+    port = free_port()
+    secret = 'benchmark_startup_secret_key_0123456789'
+    env = dict(os.environ, PORT=str(port), JWT_SECRET_KEY=secret)
+    base_url = f"http://127.0.0.1:{port}/api"
+
+    departments = registry.live_departments()
+    tokens = make_tokens(secret, [department_key(dep_num) for dep_num, _ in departments])
+
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, 'app.py'], cwd=BASE_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    result = {'port': port}
+    try:
+        first_health = None
+        attempts = 0
+        while time.perf_counter() - started < startup_timeout:
+            attempts += 1
+            status, _ = timed_get(f"{base_url}/health", timeout=2)
+            if status == 200:
+                first_health = time.perf_counter() - started
+                break
+            if proc.poll() is not None:
+                raise RuntimeError(f"app.py 提前結束，exit code={proc.returncode}")
+            time.sleep(0.02)
+        result['first_health_seconds'] = round(first_health, 3) if first_health is not None else None
+        result['health_attempts'] = attempts
+
+        dep_results = []
+        for dep_num, db_path in departments:
+            key = department_key(dep_num)
+            status, first = timed_get(f"{base_url}/materials", token=tokens[key])
+            _, warm = timed_get(f"{base_url}/materials", token=tokens[key])
+            dep_results.append({
+                'department': key,
+                'db_path': db_path,
+                'status': status,
+                'first_materials_seconds': round(first, 4),
+                'warm_materials_seconds': round(warm, 4)
+            })
+        result['departments'] = dep_results
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return result
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='量測 app 的匯入時間與冷啟動到第一個回應的時間')
+    parser.add_argument('--runs', type=int, default=3, help='importtime 量測次數（取最小值）')
+    parser.add_argument('--top', type=int, default=25, help='表格顯示累計時間最長的前 N 個模組')
+    parser.add_argument('--skip-server', action='store_true', help='只量測匯入時間，不啟動伺服器')
+    parser.add_argument('--output', help='JSON 輸出路徑（預設 bench_results/startup_<時間>.json）')
+    opts = parser.parse_args(argv)
+
+    results = {
+        'benchmark': 'startup',
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'import': measure_import_times(opts.runs)
+    }
+
+    print(f"{'cumulative(ms)':>15} {'self(ms)':>10}  module")
+    for m in results['import']['modules'][:opts.top]:
+        print(f"{m['cumulative_us'] / 1000:>15.1f} {m['self_us'] / 1000:>10.1f}  {'  ' * m['depth']}{m['module']}")
+
+    if not opts.skip_server:
+        results['server'] = measure_server_startup()
+        print(f"\n啟動到第一次 /api/health 成功: {results['server']['first_health_seconds']} 秒")
+        for dep in results['server']['departments']:
+            print(f"{dep['department']:<6} status={dep['status']} 第一次 /api/materials {dep['first_materials_seconds']} 秒"
+                  f"（之後 {dep['warm_materials_seconds']} 秒）")
+
+    output = opts.output or os.path.join(DEFAULT_OUTPUT_DIR, f"startup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n結果已寫入 {output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
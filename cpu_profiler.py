@@ -0,0 +1,192 @@
+import os
+import sys
+import time
+import pstats
+import logging
+import cProfile
+import threading
+from io import StringIO
+from collections import Counter
+from flask import g, request
+from tenants import BASE_DIR
+from sql_profiler import REQUEST_ID_PATTERN, request_id, requesting_admin
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+# 管理者帶此標頭或 ?cprofile=1 時以 cProfile 包住該請求
+PROFILE_HEADER = 'X-CPU-Profile'
+PROFILE_QUERY_ARG = 'cprofile'
+# 最多保留的 .pstats 檔案數，超過時刪除最舊的
+PROFILE_KEEP = 50
+# 取樣分析器的預設與上限
+SAMPLE_INTERVAL = 0.01
+SAMPLE_MAX_SECONDS = 60
+MAX_STACK_DEPTH = 128
+
+# cProfile 同一時間只允許一個請求使用（3.12 起同一行程只能有一個 profiler）
+_cprofile_lock = threading.Lock()
+_current = threading.local()
+
+def profile_path(rid):
+    """依請求識別碼回傳 .pstats 路徑，識別碼不合法時回傳 None"""
+    if not rid or not REQUEST_ID_PATTERN.fullmatch(rid):
+        return None
+    return os.path.join(PROFILE_DIR, f"{rid}.pstats")
+
+def list_profiles():
+    """已儲存的請求分析（新到舊）"""
+    try:
+        names = [n for n in os.listdir(PROFILE_DIR) if n.endswith('.pstats')]
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names:
+        st = os.stat(os.path.join(PROFILE_DIR, name))
+        profiles.append({'request_id': name[:-len('.pstats')], 'bytes': st.st_size, 'mtime': st.st_mtime})
+    profiles.sort(key=lambda p: p['mtime'], reverse=True)
+    for p in profiles:
+        p['created_at'] = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(p.pop('mtime')))
+    return profiles
+
+def _prune_profiles():
+    profiles = list_profiles()
+    for p in profiles[PROFILE_KEEP:]:
+        try:
+            os.remove(profile_path(p['request_id']))
+        except OSError:
+            pass
+
+def profile_summary(path, sort='cumulative', limit=40):
+    """pstats 文字摘要，供不方便下載 .pstats 時直接檢視"""
+    out = StringIO()
+    stats = pstats.Stats(path, stream=out)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+def _cprofile_requested():
+    return request.headers.get(PROFILE_HEADER) == '1' or request.args.get(PROFILE_QUERY_ARG) == '1'
+
+def init_app(app):
+    """註冊每請求 cProfile：結果存成 profiles/<request_id>.pstats，回應帶 X-Request-Id 與 X-CPU-Profile 標頭"""
+
+    @app.before_request
+    def _start_cprofile():
+        _current.profile = None
+        if not _cprofile_requested() or requesting_admin(' cProfile 分析') is None:
+            return
+        if not _cprofile_lock.acquire(blocking=False):
+            g.cprofile_status = 'busy'
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # 其他分析工具已啟用
+            _cprofile_lock.release()
+            logger.warning("無法啟用 cProfile: %s", e)
+            g.cprofile_status = 'busy'
+            return
+        _current.profile = profiler
+        g.cprofile_started = time.perf_counter()
+
+    @app.after_request
+    def _finish_cprofile(response):
+        profiler = getattr(_current, 'profile', None)
+        if profiler is not None:
+            _current.profile = None
+            profiler.disable()
+            _cprofile_lock.release()
+            rid = request_id()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(profile_path(rid))
+            _prune_profiles()
+            elapsed = time.perf_counter() - g.cprofile_started
+            logger.info("cProfile 已儲存 %s %s（%.1f ms）: %s.pstats", request.method, request.path, elapsed * 1000, rid)
+            response.headers['X-Request-Id'] = rid
+            response.headers[PROFILE_HEADER] = rid
+        elif g.get('cprofile_status'):
+            response.headers[PROFILE_HEADER] = g.cprofile_status
+        return response
+
+    @app.teardown_request
+    def _abort_cprofile(exception=None):
+        # after_request 未執行（未處理的例外）時仍須停止 profiler 並釋放鎖
+        profiler = getattr(_current, 'profile', None)
+        if profiler is not None:
+            _current.profile = None
+            profiler.disable()
+            _cprofile_lock.release()
+
+# --- 取樣分析器 ---
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class StackSampler:
+    """
+    低負擔取樣分析器：背景執行緒每 interval 秒以 sys._current_frames() 取得所有執行緒的堆疊，
+    累計成 collapsed stack（"執行緒;外層;...;內層 次數"），可直接交給 flamegraph.pl / speedscope。
+    不使用 setprofile，執行中的請求不會因此變慢；同一時間只允許一個取樣。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._status = {'running': False}
+        self._collapsed = None
+
+    def start(self, seconds, interval=SAMPLE_INTERVAL):
+        """開始在背景取樣 seconds 秒；已有取樣進行中時回傳 False"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._status = {
+                'running': True,
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'seconds': seconds,
+                'interval': interval,
+            }
+            self._thread = threading.Thread(target=self._run, args=(seconds, interval), name='stack-sampler', daemon=True)
+            self._thread.start()
+        logger.info("開始取樣分析 %.1f 秒，間隔 %.3f 秒", seconds, interval)
+        return True
+
+    def status(self):
+        with self._lock:
+            return dict(self._status)
+
+    def result(self):
+        """最近一次完成的 collapsed stack 文字，尚無結果時回傳 None"""
+        with self._lock:
+            return self._collapsed
+
+    def _run(self, seconds, interval):
+        own = threading.get_ident()
+        stacks = Counter()
+        names = {}
+        samples = 0
+        started = time.perf_counter()
+        deadline = started + seconds
+        try:
+            while time.perf_counter() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    if ident not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    labels = []
+                    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                        labels.append(_frame_label(frame.f_code))
+                        frame = frame.f_back
+                    labels.append(names.get(ident, f"thread-{ident}"))
+                    stacks[';'.join(reversed(labels))] += 1
+                samples += 1
+                time.sleep(max(0.0, min(interval, deadline - time.perf_counter())))
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._collapsed = ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+                self._status.update({'running': False, 'elapsed': round(elapsed, 3), 'samples': samples, 'stacks': len(stacks)})
+            logger.info("取樣分析完成：%.1f 秒，%d 次取樣，%d 種堆疊", elapsed, samples, len(stacks))
+
+stack_sampler = StackSampler()
@@ -1,42 +1,154 @@
+import io
 import os
-from app import get_session, default_db_path
-from models import Base, User
+import csv
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import select, insert
+from werkzeug.security import generate_password_hash
+from models import User
+from tenants import default_db_path, get_engine, ensure_schema
 
-basedir = os.path.abspath(os.path.dirname(__file__))
-db_uri = f"sqlite:///{default_db_path}"
+# SQLite 單一語句可用的參數數量有限，IN 查詢分批進行
+IN_QUERY_CHUNK = 500
+# 筆數少時直接在目前行程雜湊，省下啟動子行程的時間
+INLINE_HASH_THRESHOLD = 4
+VALID_ROLES = {'user', 'admin'}
 
-def create_users():
-    Session = get_session(db_uri)
-    session = Session()
+def default_users():
+    """預設帳號：dep1~dep9（密碼 pass1~pass9）與 dep1T~dep9T（密碼 FSVS）"""
+    users = [{'username': f"dep{i}", 'password': f"pass{i}", 'role': 'user'} for i in range(1, 10)]
+    users += [{'username': f"dep{i}T", 'password': "FSVS", 'role': 'user'} for i in range(1, 10)]
+    return users
 
-    # 建立資料表（如果尚未建立）
-    Base.metadata.create_all(bind=session.bind)
+def read_users_csv(stream):
+    """讀取 CSV（欄位 username,password[,role]），回傳 [{'username','password','role'}, ...]"""
+    reader = csv.DictReader(stream)
+    if not reader.fieldnames or not {'username', 'password'} <= {f.strip().lower() for f in reader.fieldnames}:
+        raise ValueError("CSV 必須包含 username 與 password 欄位")
+    users = []
+    for row in reader:
+        row = {(k or '').strip().lower(): (v or '').strip() for k, v in row.items()}
+        users.append({'username': row.get('username', ''), 'password': row.get('password', ''), 'role': row.get('role') or 'user'})
+    return users
 
-    # 新增 dep1 ~ dep9 使用者，密碼為 pass1 ~ pass9
-    for i in range(1, 10):
-        username = f"dep{i}"
-        if session.query(User).filter_by(username=username).first():
-            print(f"使用者 {username} 已存在，跳過")
+def validate_users(users):
+    """檢查必填欄位、角色與 CSV 內重複帳號，回傳 (有效清單, 錯誤清單)"""
+    valid, invalid, seen = [], [], set()
+    for line, user in enumerate(users, start=1):
+        username = user['username']
+        if not username or not user['password']:
+            invalid.append({'line': line, 'username': username, 'error': '帳號或密碼為空'})
+        elif len(username) > 50:
+            invalid.append({'line': line, 'username': username, 'error': '帳號超過 50 字元'})
+        elif user['role'] not in VALID_ROLES:
+            invalid.append({'line': line, 'username': username, 'error': f"不支援的角色 {user['role']}"})
+        elif username in seen:
+            invalid.append({'line': line, 'username': username, 'error': '檔案內帳號重複'})
         else:
-            user = User(username=username)
-            user.set_password(f"pass{i}")  # 設定密碼
-            session.add(user)
-            print(f"新增使用者 {username}")
-
-    # 新增 dep1T ~ dep9T 使用者，密碼皆為 'FSVS'
-    for i in range(1, 10):
-        username = f"dep{i}T"
-        if session.query(User).filter_by(username=username).first():
-            print(f"使用者 {username} 已存在，跳過")
-        else:
-            user = User(username=username)
-            user.set_password("FSVS")  # 設定密碼
-            session.add(user)
-            print(f"新增使用者 {username}")
+            seen.add(username)
+            valid.append(user)
+    return valid, invalid
+
+def find_existing_usernames(conn, usernames):
+    """以 IN 查詢一次取得已存在的帳號（超過 IN_QUERY_CHUNK 筆時分批）"""
+    existing = set()
+    usernames = list(usernames)
+    for i in range(0, len(usernames), IN_QUERY_CHUNK):
+        chunk = usernames[i:i + IN_QUERY_CHUNK]
+        existing.update(conn.execute(select(User.username).where(User.username.in_(chunk))).scalars())
+    return existing
+
+def hash_passwords(passwords, max_workers=None):
+    """以行程池在所有 CPU 核心上平行計算密碼雜湊，回傳順序與輸入相同"""
+    if len(passwords) <= INLINE_HASH_THRESHOLD:
+        return [generate_password_hash(p) for p in passwords]
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(passwords)))
+    chunksize = max(1, len(passwords) // (max_workers * 4))
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return list(executor.map(generate_password_hash, passwords, chunksize=chunksize))
+
+def provision_users(users, db_path=default_db_path, max_workers=None):
+    """
+    批次建立使用者：驗證後以一次 IN 查詢略過已存在帳號，
+    在行程池計算密碼雜湊，最後以單一交易 executemany 寫入。回傳處理結果摘要。
+    """
+    started = time.perf_counter()
+    db_uri = f"sqlite:///{db_path}"
+    ensure_schema(db_uri)
+    engine = get_engine(db_uri)
+
+    valid, invalid = validate_users(users)
+    with engine.connect() as conn:
+        existing = find_existing_usernames(conn, (u['username'] for u in valid))
+    new_users = [u for u in valid if u['username'] not in existing]
+
+    hash_started = time.perf_counter()
+    hashes = hash_passwords([u['password'] for u in new_users], max_workers)
+    hash_seconds = time.perf_counter() - hash_started
+
+    created = 0
+    if new_users:
+        now = datetime.utcnow()
+        rows = [
+            {'username': u['username'], 'password_hash': h, 'role': u['role'], 'password_last_changed': now}
+            for u, h in zip(new_users, hashes)
+        ]
+        with engine.begin() as conn:
+            # 查詢後才被其他程序建立的帳號以 OR IGNORE 略過
+            result = conn.execute(insert(User.__table__).prefix_with('OR IGNORE'), rows)
+            created = result.rowcount if result.rowcount is not None and result.rowcount >= 0 else len(rows)
+
+    return {
+        'created': created,
+        'skipped': sorted(existing),
+        # 查詢後、寫入前才被建立而略過的筆數
+        'ignored': len(new_users) - created,
+        'invalid': invalid,
+        'hash_seconds': round(hash_seconds, 3),
+        'total_seconds': round(time.perf_counter() - started, 3),
+    }
+
+def create_users(csv_path=None, db_path=default_db_path, max_workers=None):
+    if csv_path == '-':
+        # 背景工作以標準輸入傳入 CSV，密碼不會寫到磁碟
+        users = read_users_csv(io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline=''))
+    elif csv_path:
+        with open(csv_path, encoding='utf-8-sig', newline='') as f:
+            users = read_users_csv(f)
+    else:
+        users = default_users()
+    return provision_users(users, db_path, max_workers)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='批次建立使用者帳號（預設建立 dep1~dep9 與 dep1T~dep9T）')
+    parser.add_argument('--csv', help='使用者 CSV 檔，欄位 username,password[,role]；- 表示從標準輸入讀取')
+    parser.add_argument('--db', default=default_db_path, help='寫入的資料庫（預設 materials.db）')
+    parser.add_argument('--workers', type=int, default=None, help='雜湊子行程數（預設為 CPU 核心數）')
+    parser.add_argument('--result', help='另外把處理結果寫到這個 JSON 檔（背景工作用）')
+    opts = parser.parse_args(argv)
+
+    try:
+        result = create_users(opts.csv, opts.db, opts.workers)
+    except (OSError, ValueError) as e:
+        print(f"讀取使用者清單失敗: {e}")
+        return 2
+    if opts.result:
+        with open(opts.result, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
 
-    session.commit()
-    session.close()
-    print("使用者新增完成")
+    for username in result['skipped']:
+        print(f"使用者 {username} 已存在，跳過")
+    for item in result['invalid']:
+        print(f"第 {item['line']} 筆 {item['username'] or '(空白)'} 無效: {item['error']}")
+    print(f"新增 {result['created']} 位使用者，雜湊耗時 {result['hash_seconds']} 秒，共 {result['total_seconds']} 秒")
+    return 0 if not result['invalid'] else 1
 
 if __name__ == "__main__":
-    create_users()
+    sys.exit(main())
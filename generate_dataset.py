@@ -0,0 +1,197 @@
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import text
+
+from models import rebuild_low_stock_index
+from tenants import BASE_DIR, get_engine, ensure_schema, registry, department_db_path
+
+# 預設規模：接近大型部門數年的資料量
+DEFAULT_MATERIALS = 20000
+DEFAULT_CATEGORIES = 50
+DEFAULT_RECORDS = 2000000
+DEFAULT_YEARS = 5
+INSERT_BATCH = 50000
+# 入庫紀錄所占比例，其餘為出庫
+IN_RECORD_RATIO = 0.4
+# 80/20 法則：HOT_RATIO 的物料承擔 HOT_TRAFFIC 比例的異動
+HOT_RATIO = 0.2
+HOT_TRAFFIC = 0.8
+# 以廠商 EAN-13 條碼登錄的物料比例，其餘使用系統產生的 BC-00<item_id>
+EAN_BARCODE_RATIO = 0.3
+
+CATEGORY_BASES = ['電腦類', '文具類', '清潔用品', '實習耗材', '電子零件', '五金工具', '機械零件', '化學藥品', '量測儀器', '辦公設備']
+ITEM_WORDS = ['鍵盤', '滑鼠', '電阻', '電容', '螺絲', '螺帽', '砂紙', '鑽頭', '延長線', '麥克筆', '影印紙', '烙鐵頭',
+              '焊錫', '手套', '口罩', '量杯', '游標卡尺', '膠帶', '電池', '燈管', '保險絲', '排線', '銅線', '墨水匣']
+UNITS = ['個', '盒', '包', '支', '瓶', '箱', '本', '組', '卷', '片']
+LOCATIONS = ['1F倉庫', '2F工具室', '3F實習工場', '辦公室櫃', '化學藥品櫃']
+SOURCES = ['採購', '掃碼', '捐贈', '調撥', '退回']
+PURPOSES = ['實習課', '專題製作', '競賽訓練', '設備維修', '行政使用']
+CLASSES = [f"{grade}{cls}" for grade in ('一', '二', '三') for cls in ('甲', '乙', '丙', '丁')]
+HANDLERS = ['王老師', '李老師', '陳老師', '林老師', '張老師', '助理']
+
+def ean13(prefix12: str) -> str:
+    """計算 EAN-13 檢查碼並回傳完整 13 碼"""
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(prefix12))
+    return prefix12 + str((10 - total % 10) % 10)
+
+def make_categories(count):
+    return [CATEGORY_BASES[i] if i < len(CATEGORY_BASES) else f"{CATEGORY_BASES[i % len(CATEGORY_BASES)]}{i // len(CATEGORY_BASES) + 1}"
+            for i in range(count)]
+
+def make_materials(count, categories, rng):
+    """回傳物料列（tuple），item_id 延續系統的 M0001 格式，超過四碼時自然進位"""
+    rows = []
+    for n in range(1, count + 1):
+        item_id = f"M{n:04d}"
+        if rng.random() < EAN_BARCODE_RATIO:
+            barcode = ean13(f"471{rng.randrange(10 ** 4):04d}{n:05d}")  # 471 = 台灣 GS1 前綴
+        else:
+            barcode = f"BC-00{item_id}"
+        category = categories[min(int(rng.paretovariate(1.2)) - 1, len(categories) - 1)]
+        name = f"{rng.choice(ITEM_WORDS)}{rng.choice('ABCDEFGH')}{rng.randrange(1, 100)}"
+        safety_stock = rng.choice((0, 0, 5, 10, 20, 50))
+        rows.append((n, item_id, name, rng.choice(UNITS), category, safety_stock, rng.choice(LOCATIONS), barcode))
+    return rows
+
+def _record_time(start, span_seconds, index, total, rng):
+    """依序號平均分布在期間內，集中在上課時段（8~17 時）"""
+    moment = start + timedelta(seconds=span_seconds * (index + rng.random()) / total)
+    return moment.replace(hour=8 + int(moment.hour * 9 / 24), microsecond=rng.randrange(1000000))
+
+def generate_records(count, materials, years, rng, batch=INSERT_BATCH):
+    """
+    依時間順序產生出入庫紀錄，分批 yield (入庫列, 出庫列)；
+    少數熱門物料承擔大部分異動，出庫數量不超過當時庫存，最後回傳各物料庫存。
+    """
+    end = datetime.now().replace(microsecond=0)
+    start = end - timedelta(days=365 * years)
+    span = (end - start).total_seconds()
+    stock = [0] * (len(materials) + 1)
+    # 熱門物料隨機散布在各編號，而非集中在前段
+    order = list(range(1, len(materials) + 1))
+    rng.shuffle(order)
+    hot = max(1, int(len(materials) * HOT_RATIO))
+    in_rows, out_rows = [], []
+    for index in range(count):
+        material_id = order[rng.randrange(hot) if rng.random() < HOT_TRAFFIC else rng.randrange(len(order))]
+        barcode = materials[material_id - 1][7]
+        when = _record_time(start, span, index, count, rng).isoformat(sep=' ', timespec='microseconds')
+        if stock[material_id] <= 0 or rng.random() < IN_RECORD_RATIO:
+            quantity = rng.randrange(5, 200)
+            stock[material_id] += quantity
+            in_rows.append((when, material_id, quantity, rng.choice(SOURCES), rng.choice(HANDLERS), barcode))
+        else:
+            quantity = min(stock[material_id], rng.randrange(1, 150))
+            stock[material_id] -= quantity
+            out_rows.append((when, material_id, quantity, rng.choice(CLASSES), rng.choice(CLASSES), rng.choice(PURPOSES),
+                             barcode, rng.choice(SOURCES), rng.choice(HANDLERS)))
+        if len(in_rows) + len(out_rows) >= batch:
+            yield in_rows, out_rows
+            in_rows, out_rows = [], []
+    if in_rows or out_rows:
+        yield in_rows, out_rows
+    return stock
+
+def generate_dataset(db_path, materials=DEFAULT_MATERIALS, categories=DEFAULT_CATEGORIES, records=DEFAULT_RECORDS,
+                     years=DEFAULT_YEARS, seed=42, reset=False, progress=print):
+    """
+    以 executemany 分批寫入合成資料到 db_path（不存在時建立並套用結構）。
+    資料庫已有物料時需指定 reset=True 才會清空重建，避免覆蓋真實資料。回傳各階段耗時。
+    """
+    rng = random.Random(seed)
+    db_uri = f"sqlite:///{os.path.abspath(db_path)}"
+    ensure_schema(db_uri)
+    engine = get_engine(db_uri)
+    timings = {}
+    started = time.perf_counter()
+
+    with engine.begin() as conn:
+        existing = conn.execute(text("SELECT COUNT(*) FROM materials")).scalar()
+        if existing and not reset:
+            raise ValueError(f"{db_path} 已有 {existing} 筆物料，如要清空重建請加上 --reset")
+        # 產生資料用：關閉同步寫入、日誌放在記憶體，寫入速度提升數倍（中斷時重新產生即可）
+        conn.exec_driver_sql("PRAGMA synchronous = OFF")
+        conn.exec_driver_sql("PRAGMA journal_mode = MEMORY")
+        for table in ('in_record', 'out_record', 'materials', 'category'):
+            conn.exec_driver_sql(f"DELETE FROM {table}")
+
+        category_names = make_categories(categories)
+        conn.exec_driver_sql("INSERT INTO category (name) VALUES (?)", [(name,) for name in category_names])
+        material_rows = make_materials(materials, category_names, rng)
+        conn.exec_driver_sql(
+            "INSERT INTO materials (id, item_id, name, unit, category, safety_stock, current_stock, notes, barcode, is_low_stock) "
+            "VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?, 0)", material_rows
+        )
+        timings['materials_seconds'] = round(time.perf_counter() - started, 3)
+        progress(f"已寫入 {len(category_names)} 個分類、{len(material_rows)} 筆物料")
+
+        records_started = time.perf_counter()
+        written = 0
+        batches = generate_records(records, material_rows, years, rng)
+        while True:
+            try:
+                in_rows, out_rows = next(batches)
+            except StopIteration as done:
+                stock = done.value
+                break
+            conn.exec_driver_sql(
+                "INSERT INTO in_record (date, material_id, quantity, source, handler, barcode) VALUES (?, ?, ?, ?, ?, ?)", in_rows
+            )
+            conn.exec_driver_sql(
+                "INSERT INTO out_record (date, material_id, quantity, user, department, purpose, barcode, source, handler) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", out_rows
+            )
+            written += len(in_rows) + len(out_rows)
+            progress(f"已寫入 {written}/{records} 筆出入庫紀錄")
+        timings['records_seconds'] = round(time.perf_counter() - records_started, 3)
+
+        conn.exec_driver_sql("UPDATE materials SET current_stock = ? WHERE id = ?",
+                             [(stock[material_id], material_id) for material_id in range(1, materials + 1)])
+        rebuild_low_stock_index(conn)
+
+    finalize_started = time.perf_counter()
+    with engine.connect() as conn:
+        conn.exec_driver_sql("ANALYZE")
+        conn.commit()
+    timings['analyze_seconds'] = round(time.perf_counter() - finalize_started, 3)
+    timings['total_seconds'] = round(time.perf_counter() - started, 3)
+    timings['records_per_second'] = round(records / timings['records_seconds']) if timings['records_seconds'] else None
+    return timings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='產生大量合成資料到部門資料庫，供效能測試使用')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--department', type=int, help='部門編號，寫入該部門的資料庫（例如 1 => materials_1.db）')
+    target.add_argument('--db', help='直接指定資料庫檔案路徑')
+    parser.add_argument('--materials', type=int, default=DEFAULT_MATERIALS, help=f'物料筆數（預設 {DEFAULT_MATERIALS}）')
+    parser.add_argument('--categories', type=int, default=DEFAULT_CATEGORIES, help=f'分類數（預設 {DEFAULT_CATEGORIES}）')
+    parser.add_argument('--records', type=int, default=DEFAULT_RECORDS, help=f'出入庫紀錄總筆數（預設 {DEFAULT_RECORDS}）')
+    parser.add_argument('--years', type=int, default=DEFAULT_YEARS, help=f'紀錄分布的年數（預設 {DEFAULT_YEARS}）')
+    parser.add_argument('--seed', type=int, default=42, help='亂數種子，相同參數與種子會產生相同資料')
+    parser.add_argument('--reset', action='store_true', help='資料庫已有資料時清空後重建')
+    opts = parser.parse_args(argv)
+
+    if opts.db:
+        db_path = opts.db
+    else:
+        dep = registry.department(opts.department)
+        db_path = dep['db_path'] if dep else department_db_path(opts.department)
+    if opts.materials < 1 or opts.categories < 1 or opts.records < 0 or opts.years < 1:
+        parser.error('物料數、分類數與年數須大於 0，紀錄數不可為負')
+
+    print(f"產生合成資料到 {os.path.relpath(os.path.abspath(db_path), BASE_DIR)}")
+    try:
+        timings = generate_dataset(db_path, opts.materials, opts.categories, opts.records, opts.years, opts.seed, opts.reset)
+    except ValueError as e:
+        print(e)
+        return 2
+    print(f"完成：物料 {timings['materials_seconds']} 秒，紀錄 {timings['records_seconds']} 秒"
+          f"（{timings['records_per_second']} 筆/秒），ANALYZE {timings['analyze_seconds']} 秒，共 {timings['total_seconds']} 秒")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import os
+import re
+import sys
+import json
+import time
+import secrets
+import logging
+import threading
+import subprocess
+from tenants import BASE_DIR
+
+logger = logging.getLogger(__name__)
+
+JOB_DIR = os.path.join(BASE_DIR, 'jobs')
+# 每個工作目錄內的檔案：啟動時寫入的工作資訊、子行程寫入的結果與合併的 stdout/stderr
+META_FILE = 'job.json'
+RESULT_FILE = 'result.json'
+LOG_FILE = 'job.log'
+# 記憶體中最多保留的已結束工作數，超過時只忘記行程物件，目錄與結果檔仍保留
+JOB_KEEP = 50
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{16}')
+
+class BackgroundJobs:
+    """
+    以獨立的 Python 行程執行批次工作（例如 batch_report.py、create_users.py 的命令列模式），
+    行程池與 CPU 密集工作都不在網頁伺服器行程內，子行程的 __main__ 是工作腳本而不是 app.py。
+    子行程以 --result 指定的路徑寫出結果 JSON，狀態查詢時讀取。
+    """
+
+    def __init__(self, root=JOB_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def job_dir(self, job_id):
+        if not job_id or not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        return os.path.join(self.root, job_id)
+
+    def start(self, kind, script, args=(), stdin_data=None):
+        """
+        啟動 `python script args... --result <工作目錄>/result.json`，立即回傳工作狀態；
+        同類工作進行中時回傳 None。stdin_data 會寫入子行程的標準輸入（避免把密碼等內容寫到磁碟）。
+        """
+        with self._lock:
+            self._reap()
+            if any(job['kind'] == kind and job['process'].poll() is None for job in self._jobs.values()):
+                return None
+            job_id = secrets.token_hex(8)
+            job_dir = os.path.join(self.root, job_id)
+            os.makedirs(job_dir)
+            started_at = time.time()
+            # 工作種類寫入磁碟，伺服器重啟後狀態查詢仍能區分不同端點的工作
+            with open(os.path.join(job_dir, META_FILE), 'w', encoding='utf-8') as f:
+                json.dump({'kind': kind, 'script': script, 'started_at': started_at}, f)
+            argv = [sys.executable, os.path.join(BASE_DIR, script), *args,
+                    '--result', os.path.join(job_dir, RESULT_FILE)]
+            with open(os.path.join(job_dir, LOG_FILE), 'wb') as log:
+                process = subprocess.Popen(
+                    argv, cwd=BASE_DIR, stdout=log, stderr=subprocess.STDOUT,
+                    stdin=subprocess.PIPE if stdin_data is not None else subprocess.DEVNULL
+                )
+            self._jobs[job_id] = {'kind': kind, 'process': process, 'started_at': started_at}
+        if stdin_data is not None:
+            try:
+                process.stdin.write(stdin_data)
+            finally:
+                process.stdin.close()
+        logger.info("背景工作 %s（%s）已啟動，pid=%s", job_id, kind, process.pid)
+        return self.status(job_id)
+
+    def _reap(self):
+        """忘記最舊的已結束工作，只保留 JOB_KEEP 筆（呼叫端需持有 _lock）"""
+        finished = [job_id for job_id, job in self._jobs.items() if job['process'].poll() is not None]
+        for job_id in finished[:max(0, len(finished) - JOB_KEEP)]:
+            del self._jobs[job_id]
+
+    def status(self, job_id):
+        """
+        回傳 {'job_id', 'kind', 'status', 'returncode', 'result'}，status 為 running、done 或 failed；
+        找不到工作時回傳 None。伺服器重啟後仍可由工作目錄內的 job.json 與結果檔查詢已完成的工作。
+        """
+        job_dir = self.job_dir(job_id)
+        if job_dir is None or not os.path.isdir(job_dir):
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job:
+            kind = job['kind']
+        else:
+            try:
+                with open(os.path.join(job_dir, META_FILE), encoding='utf-8') as f:
+                    kind = json.load(f).get('kind')
+            except (OSError, ValueError):
+                kind = None
+        returncode = job['process'].poll() if job else None
+        info = {'job_id': job_id, 'kind': kind, 'returncode': returncode, 'result': None}
+        if job and returncode is None:
+            info['status'] = 'running'
+            return info
+
+        result_path = os.path.join(job_dir, RESULT_FILE)
+        try:
+            with open(result_path, encoding='utf-8') as f:
+                info['result'] = json.load(f)
+            info['status'] = 'done'
+        except (OSError, ValueError):
+            # 子行程異常結束，或伺服器重啟時工作被中斷
+            info['status'] = 'failed'
+            info['log'] = self.log_tail(job_dir)
+        return info
+
+    @staticmethod
+    def log_tail(job_dir, limit=2000):
+        try:
+            with open(os.path.join(job_dir, LOG_FILE), 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - limit))
+                return f.read().decode('utf-8', errors='replace')
+        except OSError:
+            return ''
+
+background_jobs = BackgroundJobs()
@@ -0,0 +1,114 @@
+import os
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+# 根 logger 層級，環境變數 LOG_LEVEL 可改為 DEBUG 等
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+# 個別模組層級，例如 LOG_LEVELS="routes.material=DEBUG,werkzeug=WARNING,sqlalchemy.engine=INFO"
+LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# 同一則 DEBUG 訊息（同一個呼叫位置：檔案與行號）在 DEBUG_SAMPLE_WINDOW 秒內超過 DEBUG_SAMPLE_BURST 筆後，
+# 只保留每 DEBUG_SAMPLE_EVERY 筆中的一筆；設為 1 即停用取樣
+DEBUG_SAMPLE_BURST = int(os.environ.get('LOG_DEBUG_SAMPLE_BURST', 20))
+DEBUG_SAMPLE_EVERY = int(os.environ.get('LOG_DEBUG_SAMPLE_EVERY', 50))
+DEBUG_SAMPLE_WINDOW = 60
+
+class DebugSampler(logging.Filter):
+    """
+    高頻 DEBUG 訊息取樣；以呼叫位置（檔案、行號）分組，計數器數量以程式中的 debug 呼叫數為上限，
+    視窗過期的計數器每個視窗清理一次
+    """
+
+    def __init__(self, burst=DEBUG_SAMPLE_BURST, every=DEBUG_SAMPLE_EVERY, window=DEBUG_SAMPLE_WINDOW):
+        super().__init__()
+        self.burst = burst
+        self.every = max(1, every)
+        self.window = window
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._last_sweep = 0.0
+
+    def _sweep(self, now):
+        """移除視窗已過期的計數器（呼叫端需持有 _lock），其略過筆數不再補記"""
+        self._counters = {k: c for k, c in self._counters.items() if now - c[0] <= self.window}
+        self._last_sweep = now
+
+    def filter(self, record):
+        if record.levelno != logging.DEBUG or self.every == 1:
+            return True
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            if record.created - self._last_sweep > self.window:
+                self._sweep(record.created)
+            counter = self._counters.get(key)
+            if counter is None or record.created - counter[0] > self.window:
+                # [視窗開始時間, 視窗內筆數, 上次輸出後略過的筆數]
+                counter = self._counters[key] = [record.created, 0, counter[2] if counter else 0]
+            counter[1] += 1
+            if counter[1] > self.burst and (counter[1] - self.burst) % self.every:
+                counter[2] += 1
+                return False
+            skipped, counter[2] = counter[2], 0
+        if skipped:
+            record.msg = f"{record.msg} [取樣：已略過 {skipped} 筆相同訊息]"
+        return True
+
+def parse_levels(spec):
+    """解析 "模組=層級,模組=層級"，回傳 {模組: 層級數值}，無法辨識的項目略過"""
+    levels = {}
+    for item in (spec or '').split(','):
+        name, sep, level = item.partition('=')
+        level = logging.getLevelName(level.strip().upper())
+        if sep and name.strip() and isinstance(level, int):
+            levels[name.strip()] = level
+    return levels
+
+_listener = None
+_queue_handler = None
+_setup_lock = threading.Lock()
+
+def setup_logging(log_file, level=None, levels=None):
+    """
+    設定非同步 logging：請求執行緒只把紀錄放入佇列（QueueHandler），
+    由背景 QueueListener 執行緒寫入輪替檔案與 console。重複呼叫時沿用既有的 listener。
+    """
+    global _listener, _queue_handler
+    with _setup_lock:
+        root = logging.getLogger()
+        root.setLevel(logging.getLevelName((level or LOG_LEVEL).upper()))
+        for name, module_level in parse_levels(LOG_LEVELS if levels is None else levels).items():
+            logging.getLogger(name).setLevel(module_level)
+        if _listener is not None:
+            return _listener
+
+        formatter = logging.Formatter(LOG_FORMAT)
+        file_handler = RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+        file_handler.setFormatter(formatter)
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        _queue_handler = QueueHandler(log_queue)
+        _queue_handler.addFilter(DebugSampler())
+        root.addHandler(_queue_handler)
+
+        _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+        return _listener
+
+def stop_logging():
+    """停止背景寫入執行緒並寫出佇列中剩餘的紀錄"""
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _queue_handler is not None:
+            logging.getLogger().removeHandler(_queue_handler)
+            _queue_handler = None
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
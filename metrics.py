@@ -0,0 +1,226 @@
+import os
+import time
+import bisect
+import logging
+import threading
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+# 延遲直方圖的上界（秒），涵蓋一般 API 與報表匯出
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 每個請求的 SQL 筆數直方圖上界，用來發現 N+1 查詢的端點
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 1000)
+# 設定後，非管理者也可帶 X-Metrics-Token 標頭讀取 /api/metrics（供 Prometheus 抓取）
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}" for labels, value in items
+        ]
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # [各區間計數（最後一格為 +Inf）, 總和, 總筆數]
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((labels, (list(e[0]), e[1], e[2])) for labels, e in self._values.items())
+        lines = self._header()
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_number(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+# --- 指標定義 ---
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', '請求處理時間（秒，含回應內容傳輸）', ('endpoint', 'department'))
+REQUESTS_TOTAL = Counter('http_requests_total', '請求數', ('endpoint', 'method', 'status'))
+REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight', '處理中的請求數', ('endpoint',))
+REQUEST_DB_SECONDS = Histogram('http_request_db_seconds', '每個請求執行 SQL 的總時間（秒）', ('endpoint', 'department'))
+REQUEST_DB_QUERIES = Histogram('http_request_db_queries', '每個請求執行的 SQL 筆數', ('endpoint',), QUERY_COUNT_BUCKETS)
+DB_QUERIES_TOTAL = Counter('db_queries_total', 'SQL 執行筆數（含背景工作）', ('department',))
+DB_QUERY_SECONDS_TOTAL = Counter('db_query_seconds_total', 'SQL 執行總時間（秒，含背景工作）', ('department',))
+POOL_CHECKOUT_WAIT = Histogram('db_pool_checkout_wait_seconds', '從連線池取得連線的等待時間（秒）', ('department',))
+
+ALL_METRICS = (REQUEST_LATENCY, REQUESTS_TOTAL, REQUESTS_IN_FLIGHT, REQUEST_DB_SECONDS, REQUEST_DB_QUERIES,
+               DB_QUERIES_TOTAL, DB_QUERY_SECONDS_TOTAL, POOL_CHECKOUT_WAIT)
+
+# 目前執行緒正在處理的請求；背景工作沒有請求時 department 記為 "-"
+_current = threading.local()
+
+def current_department():
+    stats = getattr(_current, 'request', None)
+    return stats['department'] if stats else '-'
+
+def set_request_department(department):
+    """租戶解析完成後標記目前請求所屬部門，之後的 SQL 時間與請求延遲依部門分開統計"""
+    stats = getattr(_current, 'request', None)
+    if stats is not None:
+        stats['department'] = department
+
+def render_metrics():
+    """Prometheus text exposition format (0.0.4)"""
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+# --- SQLAlchemy 事件：SQL 時間、筆數與連線池等待 ---
+logger = logging.getLogger(__name__)
+
+# 其他模組（例如 sql_profiler）需要單筆 SQL 耗時時在此註冊，共用同一組計時掛勾，不另外計時
+_query_observers = []
+
+def add_query_observer(observer):
+    """observer(conn, statement, parameters, executemany, elapsed) 在每筆 SQL 執行完成後呼叫"""
+    if observer not in _query_observers:
+        _query_observers.append(observer)
+
+class TimedQueuePool(QueuePool):
+    """記錄取得連線等待時間的 QueuePool，由 tenants.get_engine() 使用"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started, (current_department(),))
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    stats = getattr(_current, 'request', None)
+    department = stats['department'] if stats else '-'
+    DB_QUERIES_TOTAL.inc((department,))
+    DB_QUERY_SECONDS_TOTAL.inc((department,), elapsed)
+    if stats is not None:
+        stats['db_seconds'] += elapsed
+        stats['db_queries'] += 1
+    for observer in _query_observers:
+        try:
+            observer(conn, statement, parameters, executemany, elapsed)
+        except Exception:
+            # 分析工具的錯誤不應讓查詢本身失敗
+            logger.exception("SQL 觀察者 %s 執行失敗", getattr(observer, '__name__', observer))
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    # 執行失敗時不會觸發 after_cursor_execute，丟棄開始時間避免堆疊錯位
+    conn = context.connection
+    if conn is not None and conn.info.get('query_started'):
+        conn.info['query_started'].pop()
+
+# --- Flask 請求掛勾 ---
+def init_app(app):
+    """註冊請求計時；須在其他 before_request 之前呼叫，計時才包含租戶解析與 session 建立"""
+    @app.before_request
+    def _start_request_metrics():
+        endpoint = request.endpoint or 'unmatched'
+        g.metrics = _current.request = {
+            'endpoint': endpoint,
+            'department': '-',
+            'started': time.perf_counter(),
+            'db_seconds': 0.0,
+            'db_queries': 0,
+            'status': 500,
+        }
+        REQUESTS_IN_FLIGHT.inc((endpoint,))
+
+    def _finish_latency(stats):
+        """請求完成（回應內容送完）時記錄延遲並減少進行中請求數"""
+        REQUESTS_IN_FLIGHT.dec((stats['endpoint'],))
+        REQUEST_LATENCY.observe(time.perf_counter() - stats['started'], (stats['endpoint'], stats['department']))
+
+    @app.after_request
+    def _record_status(response):
+        stats = g.get('metrics')
+        if stats is not None:
+            stats['status'] = response.status_code
+            # teardown 在串流回應（例如 /api/backup/all）送出內容之前就執行，
+            # 延遲改在 WSGI 伺服器關閉回應時記錄，才包含傳輸時間
+            stats['on_close'] = True
+            response.call_on_close(lambda: _finish_latency(stats))
+        return response
+
+    @app.teardown_request
+    def _finish_request_metrics(exception=None):
+        stats = g.pop('metrics', None)
+        _current.request = None
+        if stats is None:
+            return
+        endpoint, department = stats['endpoint'], stats['department']
+        REQUESTS_TOTAL.inc((endpoint, request.method, str(stats['status'])))
+        if not stats.get('on_close'):
+            # 未經 after_request（未處理的例外）時沒有回應物件可掛勾，在這裡記錄
+            _finish_latency(stats)
+        REQUEST_DB_SECONDS.observe(stats['db_seconds'], (endpoint, department))
+        REQUEST_DB_QUERIES.observe(stats['db_queries'], (endpoint,))
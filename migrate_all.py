@@ -0,0 +1,191 @@
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from tenants import BASE_DIR, default_db_path, registry, discover_department_dbs, department_key
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(BASE_DIR, 'migrations')
+ALEMBIC_INI = os.path.join(MIGRATIONS_DIR, 'alembic.ini')
+
+# 同一個資料庫檔案同時只允許一個遷移程序，等待鎖超過此秒數即放棄並回報 locked
+LOCK_TIMEOUT = 30
+
+def discover_tenant_dbs(base_dir: str = BASE_DIR):
+    """
+    回傳 [(名稱, db_path), ...]：主資料庫 materials.db 與所有部門資料庫。
+    base_dir 為專案目錄時依租戶登錄表（含 tenants.json 新增的部門），否則掃描目錄下的 materials_N.db。
+    """
+    databases = []
+    main_db = os.path.join(base_dir, os.path.basename(default_db_path))
+    if os.path.exists(main_db):
+        databases.append(('main', main_db))
+    departments = registry.live_departments() if base_dir == BASE_DIR else discover_department_dbs(base_dir)
+    databases.extend((department_key(dep_num), db_path) for dep_num, db_path in departments)
+    return databases
+
+def make_alembic_config(db_path, output_buffer=None):
+    """不經過 Flask 建立 Alembic Config，env.py 會以 models.Base 作為 metadata"""
+    from alembic.config import Config
+
+    cfg = Config(ALEMBIC_INI, output_buffer=output_buffer)
+    cfg.set_main_option('script_location', MIGRATIONS_DIR)
+    cfg.set_main_option('sqlalchemy.url', f"sqlite:///{db_path}")
+    cfg.attributes['configure_logger'] = False
+    return cfg
+
+def head_revision(cfg):
+    from alembic.script import ScriptDirectory
+
+    return ScriptDirectory.from_config(cfg).get_current_head()
+
+def current_revision(conn):
+    from alembic.runtime.migration import MigrationContext
+
+    return MigrationContext.configure(conn).get_current_revision()
+
+def detect_unversioned_revision(conn):
+    """
+    尚未有 alembic_version 的資料庫（由 create_all 或舊版程式建立）依現有結構判斷應標記的版本；
+    空資料庫回傳 None，由第一個版本開始建立。
+    """
+    from sqlalchemy import inspect
+
+    inspector = inspect(conn)
+    if not inspector.has_table('materials'):
+        return None
+    if not inspector.has_table('user'):
+        return 'abcdef123456'
+    user_columns = {c['name'] for c in inspector.get_columns('user')}
+    if 'password_last_changed' not in user_columns:
+        return 'abcdef123456'
+    material_columns = {c['name'] for c in inspector.get_columns('materials')}
+    if 'is_low_stock' in material_columns and inspector.has_table('material_stats'):
+        triggers = set(conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'trigger'").scalars())
+        if 'trg_materials_stock_level' in triggers:
+            return '3d5f7b9c1e23'
+        return '2c4e6a8b0d12'
+    return '1234567890ab'
+
+def migrate_database(name, db_path, target='head', dry_run=False, lock_timeout=LOCK_TIMEOUT):
+    """
+    在子行程中將單一資料庫升級到 target，回傳遷移前後版本與耗時。
+    dry_run 時不修改資料庫，只以離線模式產生將執行的 SQL。
+    """
+    from alembic import command
+    from filelock import FileLock, Timeout
+    from sqlalchemy import create_engine
+
+    started = time.perf_counter()
+    entry = {'database': name, 'db_path': db_path, 'dry_run': dry_run}
+    try:
+        with FileLock(f"{db_path}.migrate.lock", timeout=lock_timeout):
+            engine = create_engine(f"sqlite:///{db_path}")
+            try:
+                with engine.connect() as conn:
+                    before = current_revision(conn)
+                    stamp = detect_unversioned_revision(conn) if before is None else None
+                entry.update(before=before, stamped=stamp)
+
+                if dry_run:
+                    buffer = io.StringIO()
+                    cfg = make_alembic_config(db_path, output_buffer=buffer)
+                    start = before or stamp
+                    head = head_revision(cfg)
+                    if start != head:
+                        command.upgrade(cfg, f"{start}:{target}" if start else target, sql=True)
+                    entry.update(status='ok', after=before, sql=buffer.getvalue())
+                else:
+                    cfg = make_alembic_config(db_path)
+                    with engine.begin() as conn:
+                        cfg.attributes['connection'] = conn
+                        if stamp is not None:
+                            command.stamp(cfg, stamp)
+                        command.upgrade(cfg, target)
+                    with engine.connect() as conn:
+                        entry.update(status='ok', after=current_revision(conn))
+            finally:
+                engine.dispose()
+    except Timeout:
+        entry.update(status='locked', error=f"{lock_timeout} 秒內無法取得遷移鎖，可能有其他遷移正在執行")
+    except Exception as e:
+        entry.update(status='error', error=str(e))
+    entry['seconds'] = round(time.perf_counter() - started, 3)
+    return entry
+
+def migrate_all(target='head', dry_run=False, max_workers=None, only=None, base_dir=BASE_DIR):
+    """
+    以 ProcessPoolExecutor 平行升級所有租戶資料庫。
+    Alembic 的 context 是模組層級的全域狀態，不能在執行緒間共用，因此每個資料庫在獨立行程中執行。
+    """
+    databases = discover_tenant_dbs(base_dir)
+    if only:
+        databases = [(name, path) for name, path in databases if name in only]
+    if max_workers is None:
+        max_workers = max(1, min(len(databases), os.cpu_count() or 1))
+
+    started = time.perf_counter()
+    results = []
+    if databases:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {
+                executor.submit(migrate_database, name, db_path, target, dry_run): (name, db_path)
+                for name, db_path in databases
+            }
+            for future in as_completed(futures):
+                name, db_path = futures[future]
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    entry = {'database': name, 'db_path': db_path, 'dry_run': dry_run, 'status': 'error', 'error': str(e)}
+                logger.info(f"資料庫 {name} 遷移結果: {entry['status']} {entry.get('before')} -> {entry.get('after')}")
+                results.append(entry)
+    order = {name: i for i, (name, _) in enumerate(databases)}
+    results.sort(key=lambda e: order[e['database']])
+
+    return {
+        'target': target,
+        'dry_run': dry_run,
+        'workers': max_workers,
+        'total_seconds': round(time.perf_counter() - started, 3),
+        'succeeded': sum(1 for e in results if e['status'] == 'ok'),
+        'failed': sum(1 for e in results if e['status'] != 'ok'),
+        'databases': results,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='平行將所有部門資料庫升級到最新的 Alembic 版本')
+    parser.add_argument('--target', default='head', help='目標版本（預設 head）')
+    parser.add_argument('--dry-run', action='store_true', help='不修改資料庫，只輸出各資料庫將執行的 SQL')
+    parser.add_argument('--workers', type=int, default=None, help='子行程數（預設為 CPU 核心數）')
+    parser.add_argument('--only', help='只處理指定資料庫，以逗號分隔，例如 main,dep1,dep3')
+    parser.add_argument('--json', dest='json_output', help='將結果另存為 JSON 檔')
+    opts = parser.parse_args(argv)
+
+    only = {name.strip() for name in opts.only.split(',') if name.strip()} if opts.only else None
+    report = migrate_all(opts.target, opts.dry_run, opts.workers, only)
+
+    for entry in report['databases']:
+        revisions = f"{entry.get('before') or '-'} -> {entry.get('after') or '-'}"
+        stamped = f"（先標記為 {entry['stamped']}）" if entry.get('stamped') else ''
+        print(f"{entry['database']:<6} {entry['status']:<6} {entry.get('seconds', '-')}s  {revisions}{stamped}"
+              f"{'  ' + entry['error'] if entry.get('error') else ''}")
+        if opts.dry_run and entry.get('sql'):
+            print(entry['sql'])
+    print(f"共 {report['total_seconds']} 秒，成功 {report['succeeded']}，失敗 {report['failed']}")
+
+    if opts.json_output:
+        with open(opts.json_output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0 if report['failed'] == 0 else 1
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -1,9 +1,10 @@
 import logging
 from logging.config import fileConfig
 
-from flask import current_app
+from flask import current_app, has_app_context
 
 from alembic import context
+from sqlalchemy import create_engine
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -11,7 +12,9 @@ config = context.config
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
-fileConfig(config.config_file_name)
+# migrate_all.py sets configure_logger=False so that its own logging is kept.
+if config.attributes.get('configure_logger', True):
+    fileConfig(config.config_file_name)
 logger = logging.getLogger('alembic.env')
 
 
@@ -36,8 +39,16 @@ def get_engine_url():
 # for 'autogenerate' support
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
-config.set_main_option('sqlalchemy.url', get_engine_url())
-target_db = current_app.extensions['migrate'].db
+# Without a Flask app context (migrate_all.py) the caller provides either
+# config.attributes['connection'] or the sqlalchemy.url option, and the
+# metadata comes straight from models.Base.
+standalone = not has_app_context()
+if standalone:
+    from models import Base
+    target_db = Base
+else:
+    config.set_main_option('sqlalchemy.url', get_engine_url())
+    target_db = current_app.extensions['migrate'].db
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
@@ -90,11 +101,25 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
-    conf_args = current_app.extensions['migrate'].configure_args
-    if conf_args.get("process_revision_directives") is None:
-        conf_args["process_revision_directives"] = process_revision_directives
-
-    connectable = get_engine()
+    if standalone:
+        conf_args = {}
+        connection = config.attributes.get('connection')
+        if connection is not None:
+            context.configure(
+                connection=connection,
+                target_metadata=get_metadata(),
+                **conf_args
+            )
+            with context.begin_transaction():
+                context.run_migrations()
+            return
+        connectable = create_engine(config.get_main_option('sqlalchemy.url'))
+    else:
+        conf_args = current_app.extensions['migrate'].configure_args
+        if conf_args.get("process_revision_directives") is None:
+            conf_args["process_revision_directives"] = process_revision_directives
+
+        connectable = get_engine()
 
     with connectable.connect() as connection:
         context.configure(
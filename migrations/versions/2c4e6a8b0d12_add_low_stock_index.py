@@ -0,0 +1,51 @@
+"""Add low-stock flag, partial index and material_stats counters
+
+Revision ID: 2c4e6a8b0d12
+Revises: 1234567890ab
+Create Date: 2026-10-19 10:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '2c4e6a8b0d12'
+down_revision = '1234567890ab'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 應用程式啟動時的結構檢查（tenants.ensure_schema）可能已先建立這些物件，逐項確認後再補上
+    # 離線模式（--sql）沒有實際連線，輸出完整 SQL
+    if op.get_context().as_sql:
+        columns, indexes, has_stats = set(), set(), False
+    else:
+        inspector = sa.inspect(op.get_bind())
+        columns = {c['name'] for c in inspector.get_columns('materials')}
+        indexes = {i['name'] for i in inspector.get_indexes('materials')}
+        has_stats = inspector.has_table('material_stats')
+    if 'is_low_stock' not in columns:
+        op.add_column('materials', sa.Column('is_low_stock', sa.Boolean(), nullable=False, server_default='0'))
+    if 'ix_materials_low_stock' not in indexes:
+        op.create_index('ix_materials_low_stock', 'materials', ['item_id'], sqlite_where=sa.text('is_low_stock = 1'))
+    if not has_stats:
+        op.create_table(
+            'material_stats',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('total_count', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('low_stock_count', sa.Integer(), nullable=False, server_default='0'),
+        )
+    op.execute(
+        "UPDATE materials SET is_low_stock = "
+        "CASE WHEN COALESCE(safety_stock, 0) > 0 AND COALESCE(current_stock, 0) <= safety_stock THEN 1 ELSE 0 END"
+    )
+    op.execute(
+        "INSERT OR REPLACE INTO material_stats (id, total_count, low_stock_count) "
+        "SELECT 1, COUNT(id), COALESCE(SUM(is_low_stock), 0) FROM materials"
+    )
+
+
+def downgrade():
+    op.drop_table('material_stats')
+    op.drop_index('ix_materials_low_stock', table_name='materials')
+    op.drop_column('materials', 'is_low_stock')
@@ -0,0 +1,61 @@
+"""Maintain low-stock flag and material_stats counters with triggers
+
+Revision ID: 3d5f7b9c1e23
+Revises: 2c4e6a8b0d12
+Create Date: 2026-10-20 10:00:00.000000
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '3d5f7b9c1e23'
+down_revision = '2c4e6a8b0d12'
+branch_labels = None
+depends_on = None
+
+LOW_STOCK_CASE = ("CASE WHEN COALESCE({row}.safety_stock, 0) > 0 AND COALESCE({row}.current_stock, 0) <= {row}.safety_stock "
+                  "THEN 1 ELSE 0 END")
+
+TRIGGERS = {
+    'trg_materials_insert_stats': f"""
+        CREATE TRIGGER IF NOT EXISTS trg_materials_insert_stats AFTER INSERT ON materials
+        BEGIN
+            UPDATE material_stats SET total_count = total_count + 1, low_stock_count = low_stock_count + NEW.is_low_stock
+            WHERE id = 1;
+            UPDATE materials SET is_low_stock = {LOW_STOCK_CASE.format(row='NEW')} WHERE id = NEW.id;
+        END""",
+    'trg_materials_delete_stats': """
+        CREATE TRIGGER IF NOT EXISTS trg_materials_delete_stats AFTER DELETE ON materials
+        BEGIN
+            UPDATE material_stats SET total_count = total_count - 1, low_stock_count = low_stock_count - OLD.is_low_stock
+            WHERE id = 1;
+        END""",
+    'trg_materials_stock_level': f"""
+        CREATE TRIGGER IF NOT EXISTS trg_materials_stock_level AFTER UPDATE OF current_stock, safety_stock ON materials
+        BEGIN
+            UPDATE materials SET is_low_stock = {LOW_STOCK_CASE.format(row='NEW')} WHERE id = NEW.id;
+        END""",
+    'trg_materials_low_stock_stats': """
+        CREATE TRIGGER IF NOT EXISTS trg_materials_low_stock_stats AFTER UPDATE OF is_low_stock ON materials
+        WHEN NEW.is_low_stock IS NOT OLD.is_low_stock
+        BEGIN
+            UPDATE material_stats SET low_stock_count = low_stock_count + NEW.is_low_stock - OLD.is_low_stock
+            WHERE id = 1;
+        END""",
+}
+
+
+def upgrade():
+    # 應用程式啟動時的結構檢查（tenants.ensure_schema）可能已先建立觸發程序，因此使用 IF NOT EXISTS
+    for ddl in TRIGGERS.values():
+        op.execute(ddl)
+    # 先前由應用程式累加的計數器可能已有誤差，建立觸發程序後依現有資料重算一次
+    op.execute(f"UPDATE materials SET is_low_stock = {LOW_STOCK_CASE.format(row='materials')}")
+    op.execute(
+        "INSERT OR REPLACE INTO material_stats (id, total_count, low_stock_count) "
+        "SELECT 1, COUNT(id), COALESCE(SUM(is_low_stock), 0) FROM materials"
+    )
+
+
+def downgrade():
+    for name in TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS {name}")
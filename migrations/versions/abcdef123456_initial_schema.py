@@ -0,0 +1,82 @@
+"""Initial schema
+
+Revision ID: abcdef123456
+Revises:
+Create Date: 2025-09-01 09:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'abcdef123456'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'materials',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('item_id', sa.String(50), nullable=False),
+        sa.Column('name', sa.String(100), nullable=False),
+        sa.Column('unit', sa.String(20), nullable=False),
+        sa.Column('category', sa.String(50), nullable=False),
+        sa.Column('safety_stock', sa.Integer()),
+        sa.Column('current_stock', sa.Integer()),
+        sa.Column('notes', sa.Text()),
+        sa.Column('barcode', sa.String(100)),
+    )
+    op.create_index('ix_materials_item_id', 'materials', ['item_id'], unique=True)
+    op.create_index('ix_materials_category', 'materials', ['category'])
+    op.create_index('ix_materials_barcode', 'materials', ['barcode'], unique=True)
+    op.create_table(
+        'in_record',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('date', sa.DateTime()),
+        sa.Column('material_id', sa.Integer(), sa.ForeignKey('materials.id'), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('source', sa.String(100)),
+        sa.Column('handler', sa.String(50)),
+        sa.Column('barcode', sa.String(100)),
+    )
+    op.create_index('ix_in_record_date', 'in_record', ['date'])
+    op.create_table(
+        'out_record',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('date', sa.DateTime()),
+        sa.Column('material_id', sa.Integer(), sa.ForeignKey('materials.id'), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('user', sa.String(50)),
+        sa.Column('department', sa.String(50)),
+        sa.Column('purpose', sa.String(100)),
+        sa.Column('barcode', sa.String(100)),
+        sa.Column('source', sa.String(100)),
+        sa.Column('handler', sa.String(50)),
+    )
+    op.create_index('ix_out_record_date', 'out_record', ['date'])
+    op.create_table(
+        'category',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(50), nullable=False, unique=True),
+    )
+    op.create_table(
+        'user',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('username', sa.String(50), nullable=False, unique=True),
+        sa.Column('password_hash', sa.String(256), nullable=False),
+        sa.Column('role', sa.String(20)),
+    )
+
+
+def downgrade():
+    op.drop_table('user')
+    op.drop_table('category')
+    op.drop_index('ix_out_record_date', table_name='out_record')
+    op.drop_table('out_record')
+    op.drop_index('ix_in_record_date', table_name='in_record')
+    op.drop_table('in_record')
+    op.drop_index('ix_materials_barcode', table_name='materials')
+    op.drop_index('ix_materials_category', table_name='materials')
+    op.drop_index('ix_materials_item_id', table_name='materials')
+    op.drop_table('materials')
@@ -1,12 +1,25 @@
-from sqlalchemy import Column, String, Integer, Text, DateTime, ForeignKey
+from sqlalchemy import Column, String, Integer, Text, DateTime, ForeignKey, Boolean, Index, text, func, select, case
 from sqlalchemy.orm import relationship, declarative_base
 from datetime import datetime, timezone
 from werkzeug.security import generate_password_hash, check_password_hash
 
 Base = declarative_base()
 
+# 資料庫結構版本，寫入各資料庫的 PRAGMA user_version。
+# 修改模型欄位、索引或資料表時請遞增，下次啟動時會對每個資料庫重新檢查並升級。
+SCHEMA_VERSION = 2
+
+def is_low_stock_level(current_stock, safety_stock) -> bool:
+    """低庫存定義：有設定安全庫存，且目前庫存不高於安全庫存"""
+    safety_stock = int(safety_stock or 0)
+    return safety_stock > 0 and int(current_stock or 0) <= safety_stock
+
 class Material(Base):
     __tablename__ = 'materials'
+    __table_args__ = (
+        # 部分索引只收錄低庫存物料，低庫存清單查詢不必掃描整張表
+        Index('ix_materials_low_stock', 'item_id', sqlite_where=text('is_low_stock = 1')),
+    )
     id = Column(Integer, primary_key=True)
     item_id = Column(String(50), unique=True, nullable=False, index=True)
     name = Column(String(100), nullable=False)
@@ -16,6 +29,7 @@ class Material(Base):
     current_stock = Column(Integer, default=0)
     notes = Column(Text)
     barcode = Column(String(100), unique=True, index=True)
+    is_low_stock = Column(Boolean, nullable=False, default=False, server_default='0')
 
     in_records = relationship('InRecord', backref='material_ref', lazy=True, cascade="all, delete-orphan")
     out_records = relationship('OutRecord', backref='material_ref', lazy=True, cascade="all, delete-orphan")
@@ -88,3 +102,75 @@ class Category(Base):
     __tablename__ = 'category'
     id = Column(Integer, primary_key=True)
     name = Column(String(50), unique=True, nullable=False)
+
+class MaterialStats(Base):
+    """每個部門資料庫一列的物料計數器，由 materials 的觸發程序（LOW_STOCK_TRIGGERS）維護"""
+    __tablename__ = 'material_stats'
+    id = Column(Integer, primary_key=True)
+    total_count = Column(Integer, nullable=False, default=0)
+    low_stock_count = Column(Integer, nullable=False, default=0)
+
+def _low_stock_case(row):
+    # 與 is_low_stock_level() 相同的定義
+    return (f"CASE WHEN COALESCE({row}.safety_stock, 0) > 0 AND COALESCE({row}.current_stock, 0) <= {row}.safety_stock "
+            f"THEN 1 ELSE 0 END")
+
+# 低庫存旗標與計數器由 SQLite 觸發程序維護：旗標依寫入當下資料列的庫存計算，計數器在同一個陳述式內調整，
+# 物料編輯與出入庫同時寫入時不會因 ORM 物件上的舊庫存值算錯旗標或累加錯誤的增量
+LOW_STOCK_TRIGGERS = {
+    'trg_materials_insert_stats': f"""
+        CREATE TRIGGER IF NOT EXISTS trg_materials_insert_stats AFTER INSERT ON materials
+        BEGIN
+            UPDATE material_stats SET total_count = total_count + 1, low_stock_count = low_stock_count + NEW.is_low_stock
+            WHERE id = 1;
+            UPDATE materials SET is_low_stock = {_low_stock_case('NEW')} WHERE id = NEW.id;
+        END""",
+    'trg_materials_delete_stats': """
+        CREATE TRIGGER IF NOT EXISTS trg_materials_delete_stats AFTER DELETE ON materials
+        BEGIN
+            UPDATE material_stats SET total_count = total_count - 1, low_stock_count = low_stock_count - OLD.is_low_stock
+            WHERE id = 1;
+        END""",
+    'trg_materials_stock_level': f"""
+        CREATE TRIGGER IF NOT EXISTS trg_materials_stock_level AFTER UPDATE OF current_stock, safety_stock ON materials
+        BEGIN
+            UPDATE materials SET is_low_stock = {_low_stock_case('NEW')} WHERE id = NEW.id;
+        END""",
+    'trg_materials_low_stock_stats': """
+        CREATE TRIGGER IF NOT EXISTS trg_materials_low_stock_stats AFTER UPDATE OF is_low_stock ON materials
+        WHEN NEW.is_low_stock IS NOT OLD.is_low_stock
+        BEGIN
+            UPDATE material_stats SET low_stock_count = low_stock_count + NEW.is_low_stock - OLD.is_low_stock
+            WHERE id = 1;
+        END""",
+}
+
+def ensure_low_stock_index(conn):
+    """
+    補上 materials.is_low_stock 欄位、部分索引與維護旗標的觸發程序（舊資料庫），
+    並在欄位或觸發程序新增、計數器不存在時，依現有資料重建旗標與計數器。
+    """
+    columns = [row[1] for row in conn.execute(text("PRAGMA table_info(materials)"))]
+    added = 'is_low_stock' not in columns
+    if added:
+        conn.execute(text("ALTER TABLE materials ADD COLUMN is_low_stock BOOLEAN NOT NULL DEFAULT 0"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_materials_low_stock ON materials (item_id) WHERE is_low_stock = 1"))
+
+    existing = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'"))}
+    missing = [name for name in LOW_STOCK_TRIGGERS if name not in existing]
+    for name in missing:
+        conn.execute(text(LOW_STOCK_TRIGGERS[name]))
+
+    has_stats = conn.execute(select(MaterialStats.id).where(MaterialStats.id == 1)).first() is not None
+    if added or missing or not has_stats:
+        rebuild_low_stock_index(conn)
+
+def rebuild_low_stock_index(conn):
+    """全表重算低庫存旗標與計數器（僅在升級或修復時使用）"""
+    conn.execute(text(f"UPDATE materials SET is_low_stock = {_low_stock_case('materials')}"))
+    total, low = conn.execute(
+        select(func.count(Material.id), func.coalesce(func.sum(case((Material.is_low_stock, 1), else_=0)), 0))
+    ).one()
+    conn.execute(text(
+        "INSERT OR REPLACE INTO material_stats (id, total_count, low_stock_count) VALUES (1, :total, :low)"
+    ), {'total': total, 'low': low})
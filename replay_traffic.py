@@ -0,0 +1,341 @@
+import os
+import re
+import sys
+import json
+import time
+import platform
+import argparse
+import threading
+import subprocess
+from datetime import datetime
+from urllib.parse import quote
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from tenants import BASE_DIR, DEPARTMENT_LABELS, department_key, resolve_tenant
+from benchmark_startup import DEFAULT_OUTPUT_DIR, free_port, make_tokens, timed_get, git_revision
+from benchmark_endpoints import DEFAULT_TOLERANCE, percentile, compare_results
+
+DEFAULT_LOG = os.path.join(BASE_DIR, 'APP.log')
+DEFAULT_THREADS = 8
+# 記錄橫跨數週，夜間與假日的空檔先壓縮到此秒數再套用 --speed
+DEFAULT_MAX_GAP = 30.0
+DEFAULT_TIMEOUT = 120.0
+# 記錄中找不到使用者時所用的帳號（APP.log 中最常見的部門帳號）
+DEFAULT_USER = 'dep1'
+# 使用者提示（"called by user: dep1"）在此秒數內出現的存取紀錄才視為同一請求
+USER_HINT_WINDOW = 2.0
+STARTUP_TIMEOUT = 60.0
+
+# werkzeug 存取紀錄：時間 - werkzeug - 等級 - 來源IP - - [時間] "方法 路徑 HTTP/1.1" 狀態碼 -
+ACCESS_LINE = re.compile(
+    r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) - werkzeug - \w+ - (\S+) - - \[[^\]]*\] "(\w+) (\S+) HTTP/[\d.]+" (\d{3})'
+)
+USER_HINT = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) - .*(?:called by user:|for user) (\w+)')
+# 開發伺服器在終端機輸出時會以 ANSI 色碼標示 304/4xx/5xx
+ANSI_ESCAPE = re.compile(r'\x1b\[[\d;]*m')
+SCHOOL_DEPT_ARG = re.compile(r'[?&]school_dept=([^&]+)')
+# 路徑中的編號、條碼轉為路由樣式，同一端點的請求合併統計
+ENDPOINT_PATTERNS = [
+    (re.compile(r'^/api/materials/barcode/[^/]+$'), '/api/materials/barcode/<barcode>'),
+    (re.compile(r'^/api/materials/M\d+$'), '/api/materials/<item_id>'),
+    (re.compile(r'^/api/(categories|in-records|out-records)/\d+$'), r'/api/\1/<id>'),
+    (re.compile(r'^/api/profile/cpu/[^/]+$'), '/api/profile/cpu/<rid>'),
+]
+
+def _log_time(value):
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S,%f')
+
+def endpoint_of(path):
+    route = path.split('?', 1)[0]
+    for pattern, replacement in ENDPOINT_PATTERNS:
+        if pattern.match(route):
+            return pattern.sub(replacement, route)
+    return route if route.startswith('/api/') else '<靜態頁面>'
+
+def _school_dept_user(path):
+    """報表的 school_dept 參數（例如 鳳山商工+商經+科）直接指出部門"""
+    match = SCHOOL_DEPT_ARG.search(path)
+    if not match:
+        return None
+    label = match.group(1).replace('+', '').replace('鳳山商工', '')
+    for dep_num, dep_label in DEPARTMENT_LABELS.items():
+        if label == dep_label:
+            return department_key(dep_num)
+    return None
+
+def parse_access_log(log_path, since=None, until=None, include_static=False):
+    """
+    解析 werkzeug 存取紀錄，回傳 (請求列表, 略過原因統計)。
+    存取紀錄本身沒有帳號：緊接在前的 "called by user: X" 記錄會指定給該來源 IP，
+    同一 IP 之後的請求沿用此帳號直到出現新的提示；報表請求則以 school_dept 參數為準。
+    記錄中沒有請求內容，只重播 GET。
+    """
+    requests, skipped = [], Counter()
+    ip_users = {}
+    hint = None
+    with open(log_path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = ANSI_ESCAPE.sub('', line.rstrip())
+            match = ACCESS_LINE.match(line)
+            if match is None:
+                hint_match = USER_HINT.match(line)
+                if hint_match:
+                    hint = (_log_time(hint_match.group(1)), hint_match.group(2))
+                continue
+            at, client, method, path, status = match.groups()
+            at = _log_time(at)
+            if hint is not None:
+                if (at - hint[0]).total_seconds() <= USER_HINT_WINDOW:
+                    ip_users[client] = hint[1]
+                hint = None
+            if (since and at < since) or (until and at >= until):
+                continue
+            if method != 'GET':
+                skipped[f"{method}（記錄中沒有請求內容）"] += 1
+                continue
+            if not path.startswith('/api/') and not include_static:
+                skipped['靜態頁面'] += 1
+                continue
+            requests.append({
+                'at': at,
+                'client': client,
+                'path': path,
+                'endpoint': endpoint_of(path),
+                'user': _school_dept_user(path) or ip_users.get(client),
+                'logged_status': int(status),
+            })
+    return requests, skipped
+
+def build_schedule(requests, speed=1.0, max_gap=DEFAULT_MAX_GAP):
+    """每個請求相對開始時間的送出秒數：保留原始間隔（超過 max_gap 者壓縮），再除以 speed；speed=0 表示不等待"""
+    offsets, offset, previous = [], 0.0, None
+    for req in requests:
+        if previous is not None and speed > 0:
+            gap = (req['at'] - previous).total_seconds()
+            if max_gap:
+                gap = min(gap, max_gap)
+            offset += max(gap, 0.0) / speed
+        previous = req['at']
+        offsets.append(offset)
+    return offsets
+
+def start_local_server(secret, startup_timeout=STARTUP_TIMEOUT):
+    """在空閒連接埠啟動 `python app.py`（停用背景備份與存取紀錄），等到 /api/health 成功後回傳 (process, base_url)"""
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), JWT_SECRET_KEY=secret)
+    env.setdefault('BACKUP_INTERVAL', '0')
+    # 重播的請求不寫入 APP.log，否則下次重播會重複讀到自己送出的流量
+    env.setdefault('LOG_LEVELS', 'werkzeug=WARNING')
+    base_url = f"http://127.0.0.1:{port}"
+    proc = subprocess.Popen([sys.executable, 'app.py'], cwd=BASE_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    started = time.perf_counter()
+    while time.perf_counter() - started < startup_timeout:
+        status, _ = timed_get(f"{base_url}/api/health", timeout=2)
+        if status == 200:
+            return proc, base_url
+        if proc.poll() is not None:
+            raise RuntimeError(f"app.py 提前結束，exit code={proc.returncode}")
+        time.sleep(0.05)
+    stop_local_server(proc)
+    raise RuntimeError(f"app.py 在 {startup_timeout} 秒內未就緒")
+
+def stop_local_server(proc):
+    """停止伺服器並回傳其最高常駐記憶體（bytes，僅 Unix 可取得）"""
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def replay(requests, offsets, base_url, tokens, threads=DEFAULT_THREADS, timeout=DEFAULT_TIMEOUT, progress=print):
+    """
+    依排程以 threads 個執行緒送出請求，回傳每個請求的 (狀態碼, 耗時秒數, 延遲送出秒數)。
+    執行緒都忙碌時請求會排隊，延遲送出時間變長代表重播端本身已跟不上原始流量。
+    """
+    results = [None] * len(requests)
+    done = Counter()
+    lock = threading.Lock()
+
+    def send(index, scheduled):
+        req = requests[index]
+        lag = time.perf_counter() - scheduled
+        url = base_url + quote(req['path'], safe="/?&=+%:@,;!$'()*~")
+        status, elapsed = timed_get(url, token=tokens[req['user']], timeout=timeout)
+        results[index] = (status, elapsed, lag)
+        with lock:
+            done['count'] += 1
+            if done['count'] % 500 == 0:
+                progress(f"已完成 {done['count']}/{len(requests)} 個請求")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='replay') as pool:
+        for index, offset in enumerate(offsets):
+            scheduled = started + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, index, scheduled)
+    return results, time.perf_counter() - started
+
+def _latency_summary(latencies, statuses):
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items() if status == 'error' or int(status) >= 500)
+    return {
+        'iterations': len(latencies),
+        'statuses': dict(statuses),
+        'errors': errors,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+    }
+
+def summarize(requests, results, departments):
+    """依端點與部門彙整延遲分布；連線失敗或逾時記為狀態 error"""
+    by_endpoint = defaultdict(lambda: ([], Counter()))
+    by_department = defaultdict(lambda: ([], Counter()))
+    lags = []
+    for req, (status, elapsed, lag) in zip(requests, results):
+        status = str(status) if status is not None else 'error'
+        for latencies, statuses in (by_endpoint[req['endpoint']], by_department[departments[req['user']]]):
+            latencies.append(elapsed)
+            statuses[status] += 1
+        lags.append(lag)
+    lags.sort()
+    return {
+        'scenarios': {name: _latency_summary(*by_endpoint[name]) for name in sorted(by_endpoint)},
+        'departments': {name: _latency_summary(*by_department[name]) for name in sorted(by_department)},
+        'send_lag_ms': {
+            'p50': round(percentile(lags, 50) * 1000, 3),
+            'p95': round(percentile(lags, 95) * 1000, 3),
+            'max': round(lags[-1] * 1000, 3),
+        },
+    }
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"日期格式須為 YYYY-MM-DD: {value}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='依 APP.log 的存取紀錄重播真實流量，統計各端點延遲分布')
+    parser.add_argument('--log', default=DEFAULT_LOG, help='werkzeug 存取紀錄來源（預設 APP.log）')
+    parser.add_argument('--url', help='重播目標（例如 http://127.0.0.1:5000）；未指定時自動啟動本機 app.py')
+    parser.add_argument('--jwt-secret', default=os.environ.get('JWT_SECRET_KEY'),
+                        help='--url 伺服器的 JWT_SECRET_KEY（預設取環境變數，未設定時與 app.py 預設值相同）')
+    parser.add_argument('--speed', type=float, default=1.0, help='重播倍速，2 表示兩倍速，0 表示不等待（預設 1）')
+    parser.add_argument('--max-gap', type=float, default=DEFAULT_MAX_GAP,
+                        help=f'相鄰請求間隔的上限秒數，0 表示保留原始間隔（預設 {DEFAULT_MAX_GAP}）')
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS, help=f'同時送出的執行緒數（預設 {DEFAULT_THREADS}）')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='單一請求逾時秒數')
+    parser.add_argument('--since', type=_parse_date, help='只重播此日期（含）之後的紀錄，YYYY-MM-DD')
+    parser.add_argument('--until', type=_parse_date, help='只重播此日期之前的紀錄，YYYY-MM-DD')
+    parser.add_argument('--limit', type=int, help='最多重播的請求數')
+    parser.add_argument('--department', type=int, help='所有請求都改用此部門帳號（例如搭配 generate_dataset.py 的資料）')
+    parser.add_argument('--default-user', default=DEFAULT_USER, help=f'紀錄中找不到帳號時使用的帳號（預設 {DEFAULT_USER}）')
+    parser.add_argument('--include-static', action='store_true', help='一併重播 HTML 等靜態頁面')
+    parser.add_argument('--output', help='JSON 輸出路徑（預設 bench_results/replay_<時間>.json）')
+    parser.add_argument('--compare', help='與先前的 JSON 結果比較，p95 退步超過 --tolerance 時 exit code 為 1')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='可接受的 p95 變慢比例（預設 0.2）')
+    opts = parser.parse_args(argv)
+    if opts.speed < 0 or opts.threads < 1:
+        parser.error('--speed 不可為負，--threads 須大於 0')
+
+    requests, skipped = parse_access_log(opts.log, opts.since, opts.until, opts.include_static)
+    if opts.limit:
+        requests = requests[:opts.limit]
+    if not requests:
+        print(f"{opts.log} 中沒有可重播的請求")
+        return 2
+    for req in requests:
+        req['user'] = department_key(opts.department) if opts.department else (req['user'] or opts.default_user)
+    offsets = build_schedule(requests, opts.speed, opts.max_gap)
+    users = sorted({req['user'] for req in requests})
+    departments = {user: resolve_tenant(user) for user in users}
+    print(f"讀取 {len(requests)} 個請求（{requests[0]['at']:%Y-%m-%d %H:%M} ~ {requests[-1]['at']:%Y-%m-%d %H:%M}），"
+          f"帳號 {', '.join(users)}；預計 {offsets[-1]:.0f} 秒，{opts.threads} 個執行緒")
+    for reason, count in skipped.most_common():
+        print(f"  略過 {count} 筆：{reason}")
+
+    proc = None
+    server_rss = None
+    started = time.perf_counter()
+    try:
+        if opts.url:
+            base_url = opts.url.rstrip('/')
+            # 與 app.py 的預設值相同，伺服器未設定 JWT_SECRET_KEY 時也能產生有效 token
+            secret = opts.jwt_secret or 'your_test_secret_key_1234567890'
+        else:
+            secret = 'replay_traffic_secret_key_0123456789'
+            proc, base_url = start_local_server(secret)
+            print(f"已啟動本機伺服器 {base_url}")
+        tokens = make_tokens(secret, users)
+        results, wall = replay(requests, offsets, base_url, tokens, opts.threads, opts.timeout)
+    except RuntimeError as e:
+        print(e)
+        return 2
+    finally:
+        if proc is not None:
+            server_rss = stop_local_server(proc)
+
+    summary = summarize(requests, results, departments)
+    output_data = {
+        'benchmark': 'replay',
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'log': opts.log,
+        'target': opts.url or 'local',
+        'speed': opts.speed,
+        'max_gap': opts.max_gap,
+        'threads': opts.threads,
+        'requests': len(requests),
+        'skipped': dict(skipped),
+        'seconds': round(time.perf_counter() - started, 3),
+        'requests_per_second': round(len(requests) / wall, 2) if wall else None,
+        'server_peak_rss_bytes': server_rss,
+        **summary,
+    }
+
+    print(f"\n{'端點':<40} {'次數':>6} {'錯誤':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9} (ms)")
+    for name, r in summary['scenarios'].items():
+        print(f"{name:<40} {r['iterations']:>6} {r['errors']:>5} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} "
+              f"{r['p99_ms']:>9.1f} {r['max_ms']:>9.1f}")
+    print('\n各部門：' + '，'.join(f"{name} {r['iterations']} 筆 p95 {r['p95_ms']:.1f} ms"
+                                  for name, r in summary['departments'].items()))
+    lag = summary['send_lag_ms']
+    print(f"{output_data['requests_per_second']} 請求/秒；送出延遲 p95 {lag['p95']:.1f} ms、最大 {lag['max']:.1f} ms"
+          + (f"；伺服器最高常駐記憶體 {server_rss / 1024 / 1024:.1f} MB" if server_rss else ''))
+
+    output = opts.output or os.path.join(DEFAULT_OUTPUT_DIR, f"replay_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(output_data, f, ensure_ascii=False, indent=2)
+    print(f"結果已寫入 {output}")
+
+    if opts.compare:
+        with open(opts.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows, regressed = compare_results(baseline, output_data, opts.tolerance)
+        print(f"\n與 {opts.compare}（{baseline.get('git_revision')}）比較：")
+        for row in rows:
+            p50, p95 = row['p50_ms'], row['p95_ms']
+            print(f"{row['scenario']:<40} p50 {p50[0]:>9.1f} -> {p50[1]:>9.1f} ms  p95 {p95[0]:>9.1f} -> {p95[1]:>9.1f} ms"
+                  f"  ({f'{p95[2]:+.0%}' if p95[2] is not None else '-'}){'  退步' if row['regressed'] else ''}")
+        return 1 if regressed else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,12 @@
 import os
-from flask import Blueprint, jsonify, send_file
+import time
+from flask import Blueprint, Response, jsonify, send_file, request, g
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime
-import shutil
 import logging
+from backups import snapshot_cache, stream_backup_bundle, restore_database, RestoreError
+from tenants import tenant_databases, MAIN_TENANT, DatabaseBusyError, leave_database
+from utils import admin_required, clear_admin_role_cache
 
 backup_bp = Blueprint('backup', __name__)
 logger = logging.getLogger(__name__)
@@ -11,31 +14,20 @@ logger = logging.getLogger(__name__)
 # 請自行調整 basedir 路徑，建議與主程式同目錄或相對路徑
 basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 
-# 動態資料庫使用者清單（依需求調整）
-DYNAMIC_DB_USERS = {'dep1', 'dep2', 'dep3', 'dep4', 'dep5'}
-
-def get_db_uri_for_user(username: str) -> str:
-    logger.debug(f"判斷資料庫連線，username={username}")
-    if username and username.lower() in DYNAMIC_DB_USERS:
-        dep_num = username.lower().replace('dep', '')
-        db_file = f"materials_{dep_num}.db"
-        uri = f"sqlite:///{os.path.join(basedir, db_file)}"
-        logger.debug(f"使用 {username} 對應資料庫 {uri}")
-        return uri
-    # 非動態資料庫使用者，回傳預設資料庫
-    default_uri = f"sqlite:///{os.path.join(basedir, 'materials.db')}"
-    logger.debug(f"使用預設資料庫 {default_uri}")
-    return default_uri
-
 @backup_bp.route('/api/backup', methods=['GET'])
 @jwt_required()
 def backup_database():
+    """
+    以 SQLite backup API 建立線上一致快照後下載，不阻擋其他寫入；
+    ?compress=gzip 回傳 gzip 壓縮檔。
+    """
     try:
         username = get_jwt_identity()
         if not username:
             return jsonify({'error': '無法取得使用者身份'}), 401
 
-        db_uri = get_db_uri_for_user(username)
+        # 請求前已依 JWT 的租戶 claim 決定資料庫
+        db_uri = g.db_uri
         # sqlite URI 格式是 sqlite:///<path>，去除前面 sqlite:/// 取得實際檔案路徑
         if not db_uri.startswith("sqlite:///"):
             logger.error(f"資料庫 URI 格式錯誤: {db_uri}")
@@ -43,32 +35,84 @@ def backup_database():
 
         db_path = db_uri.replace("sqlite:///", "")
         db_path = os.path.abspath(db_path)
-        logger.debug(f"使用者 {username} 的資料庫路徑: {db_path}")
+        logger.debug("使用者 %s 的資料庫路徑: %s", username, db_path)
 
         if not os.path.exists(db_path):
             logger.error(f"資料庫檔案不存在: {db_path}")
             return jsonify({'error': '資料庫檔案不存在'}), 404
 
-        backup_filename = f"{username}_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
-        backup_path = os.path.join(os.path.dirname(db_path), backup_filename)
+        compress = request.args.get('compress') == 'gzip'
+        started = time.perf_counter()
+        snapshot = snapshot_cache.get(db_path, compress)
+        logger.info(f"使用者 {username} 下載備份，快照 {snapshot['size']} bytes"
+                    f"{'（沿用未變動的快照）' if snapshot['reused'] else ''}，耗時 {time.perf_counter() - started:.3f} 秒")
 
-        shutil.copyfile(db_path, backup_path)
-        logger.info(f"成功建立備份檔案: {backup_path}")
+        backup_filename = f"{username}_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db{'.gz' if compress else ''}"
+        # conditional=True 支援 Range / If-Range，中斷的下載可續傳同一份快照
+        return send_file(
+            snapshot['path'],
+            as_attachment=True,
+            download_name=backup_filename,
+            mimetype='application/gzip' if compress else 'application/vnd.sqlite3',
+            conditional=True,
+            etag=snapshot['etag'],
+            max_age=0
+        )
 
-        response = send_file(backup_path, as_attachment=True, download_name=backup_filename)
-
-        def cleanup_backup_file():
-            try:
-                if os.path.exists(backup_path):
-                    os.remove(backup_path)
-                    logger.info(f"成功刪除備份檔案: {backup_path}")
-            except Exception as e:
-                logger.error(f"刪除備份檔案失敗: {e}")
+    except Exception as e:
+        logger.exception(f"資料庫備份失敗: {e}")
+        return jsonify({'error': '資料庫備份失敗'}), 500
 
-        response.call_on_close(cleanup_backup_file)
+@backup_bp.route('/api/backup/all', methods=['GET'])
+@admin_required
+def backup_all_departments():
+    """
+    管理者一次下載主資料庫與所有部門資料庫的線上快照，
+    每個快照完成即串流進同一個 zip，傳輸量與 MB/s 記錄在 log 與 zip 內的 manifest.json。
+    """
+    databases = tenant_databases()
+    if not databases:
+        return jsonify({'error': '找不到任何資料庫'}), 404
+    filename = f"all_departments_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    logger.info(f"管理者 {get_jwt_identity()} 下載全部門備份，共 {len(databases)} 個資料庫")
+    return Response(
+        stream_backup_bundle(databases),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename={filename}', 'Cache-Control': 'no-store'},
+        direct_passthrough=True
+    )
 
-        return response
+@backup_bp.route('/api/backup/restore', methods=['POST'])
+@admin_required
+def restore_backup():
+    """
+    管理者以快照還原指定租戶（?tenant=main 或 depN）的資料庫。
+    上傳 multipart 欄位 file，或直接以請求本文傳送 .db / .db.gz；
+    驗證通過後才原子取代，取代前的資料庫另存於 backups/pre_restore/。
+    """
+    tenant = request.args.get('tenant', '').strip()
+    db_path = dict(tenant_databases()).get(tenant)
+    if db_path is None:
+        return jsonify({'error': f"找不到租戶 {tenant or '(未指定)'} 的資料庫"}), 404
 
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    # 本請求也計入自己資料庫（管理者為主資料庫）的使用中請求，先歸還連線與計數，還原主資料庫時才不會等待自己
+    g.db_session.remove()
+    leave_database(g.pop('db_gate'))
+    try:
+        summary = restore_database(tenant, db_path, stream)
+    except RestoreError as e:
+        logger.warning(f"管理者 {get_jwt_identity()} 還原 {tenant} 失敗: {e}")
+        return jsonify({'error': str(e)}), 400
+    except DatabaseBusyError as e:
+        logger.warning(f"管理者 {get_jwt_identity()} 還原 {tenant} 失敗: {e}")
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '30'}
     except Exception as e:
-        logger.exception(f"資料庫備份失敗: {e}")
-        return jsonify({'error': '資料庫備份失敗'}), 500
\ No newline at end of file
+        logger.exception(f"還原 {tenant} 資料庫失敗: {e}")
+        return jsonify({'error': '資料庫還原失敗'}), 500
+
+    if tenant == MAIN_TENANT:
+        clear_admin_role_cache()
+    logger.info(f"管理者 {get_jwt_identity()} 還原 {tenant} 資料庫")
+    return jsonify(summary), 200
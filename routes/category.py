@@ -32,7 +32,7 @@ def handle_categories():
                 category = Category(name=name)
                 session.add(category)
                 session.commit()
-                logger.info(f"Category '{name}' created.")
+                logger.info("Category '%s' created.", name)
                 return jsonify({'message': '分類新增成功', 'id': category.id}), 201
             except Exception as e:
                 session.rollback()
@@ -42,7 +42,7 @@ def handle_categories():
     else:  # GET
         try:
             categories = session.query(Category).order_by(Category.name).all()
-            logger.debug(f"Fetched {len(categories)} categories.")
+            logger.debug("Fetched %d categories.", len(categories))
             return jsonify([{'id': c.id, 'name': c.name} for c in categories])
         except Exception as e:
             logger.exception(f"讀取分類資料錯誤: {e}")
@@ -73,7 +73,7 @@ def update_category(cat_id):
         try:
             category.name = name
             session.commit()
-            logger.info(f"Category {cat_id} updated to '{name}'.")
+            logger.info("Category %s updated to '%s'.", cat_id, name)
             return jsonify({'message': '分類更新成功'}), 200
         except Exception as e:
             session.rollback()
@@ -100,7 +100,7 @@ def delete_category(cat_id):
         try:
             session.delete(category)
             session.commit()
-            logger.info(f"Category {cat_id} deleted.")
+            logger.info("Category %s deleted.", cat_id)
             return jsonify({'message': '分類刪除成功'}), 200
         except Exception as e:
             session.rollback()
@@ -1,17 +1,118 @@
 import os
+import io
+import gzip
+import json
 import base64
-from flask import Blueprint, jsonify, current_app
+import hashlib
+import threading
+import logging
+from functools import lru_cache
+from flask import Blueprint, Response, jsonify, request, current_app
+from flask_jwt_extended import verify_jwt_in_request
 
 font_bp = Blueprint('font', __name__)
+logger = logging.getLogger(__name__)
+
+FONT_PATH = os.path.join(os.path.dirname(__file__), '..', 'fonts', 'NotoSansTC-Regular.ttf')
+
+# 字型檔不會在執行期間變動，瀏覽器可永久快取
+FONT_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# 子集需要登入才能取得，只允許瀏覽器快取，不可由 CDN 或代理伺服器等共用快取保存
+SUBSET_CACHE_CONTROL = 'private, max-age=31536000'
+
+# 子集最多包含的不重複字元數，PDF 頁面實際只用到數百字；超過時回應 400，避免任意字串耗用 CPU
+MAX_SUBSET_CHARS = 4000
+
+_font_lock = threading.Lock()
+_font_cache = {}
+
+def load_font():
+    """第一次呼叫時讀取字型檔，之後回傳快取的原始位元組、gzip 結果、base64 JSON 與 ETag"""
+    if _font_cache:
+        return _font_cache
+    with _font_lock:
+        if not _font_cache:
+            with open(FONT_PATH, 'rb') as f:
+                data = f.read()
+            json_body = json.dumps({'fontBase64': base64.b64encode(data).decode('utf-8')}).encode('utf-8')
+            _font_cache.update(
+                raw=data,
+                gzip=gzip.compress(data, compresslevel=6),
+                json=json_body,
+                json_gzip=gzip.compress(json_body, compresslevel=6),
+                etag=hashlib.sha256(data).hexdigest()[:32]
+            )
+            logger.info(f"字型檔已載入快取，大小 {len(data)} bytes，gzip 後 {len(_font_cache['gzip'])} bytes")
+    return _font_cache
+
+def normalize_subset_text(text: str) -> str:
+    """去除重複字元並排序，讓相同字集共用同一份子集快取與 ETag"""
+    return ''.join(sorted(set(text)))
+
+@lru_cache(maxsize=64)
+def subset_font(chars: str):
+    """只保留 chars 需要的字形，回傳 (原始位元組, gzip 位元組, ETag)"""
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+
+    font = TTFont(io.BytesIO(load_font()['raw']))
+    options = subset.Options()
+    options.name_IDs = ['*']
+    options.notdef_outline = True
+    subsetter = subset.Subsetter(options=options)
+    subsetter.populate(text=chars)
+    subsetter.subset(font)
+
+    output = io.BytesIO()
+    font.save(output)
+    data = output.getvalue()
+    etag = f"{load_font()['etag']}-{hashlib.sha1(chars.encode('utf-8')).hexdigest()[:16]}"
+    return data, gzip.compress(data, compresslevel=6), etag
+
+def font_response(raw, gzipped, etag, mimetype, cache_control=FONT_CACHE_CONTROL):
+    """依 Accept-Encoding 回傳 gzip 或原始內容，並支援 If-None-Match 條件請求"""
+    use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '').lower()
+    response = Response(gzipped if use_gzip else raw, mimetype=mimetype)
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = cache_control
+    response.set_etag(f"{etag}-gz" if use_gzip else etag)
+    return response.make_conditional(request)
+
+@font_bp.route('/api/font/noto_sans_tc.ttf', methods=['GET'])
+def get_noto_sans_tc_font_binary():
+    """
+    以二進位回傳字型檔。帶 ?text= 時只回傳這些字元需要的字形（子集），
+    PDF 頁面通常只需數 KB。產生子集需要登入，且不重複字元數不可超過 MAX_SUBSET_CHARS。
+    """
+    text = request.args.get('text')
+    if text:
+        verify_jwt_in_request()
+        chars = normalize_subset_text(text)
+        if len(chars) > MAX_SUBSET_CHARS:
+            return jsonify({'error': f'text 最多 {MAX_SUBSET_CHARS} 個不重複字元'}), 400
+    try:
+        if text:
+            raw, gzipped, etag = subset_font(chars)
+        else:
+            font = load_font()
+            raw, gzipped, etag = font['raw'], font['gzip'], font['etag']
+    except ImportError:
+        logger.error("未安裝 fonttools，無法產生字型子集")
+        return jsonify({'error': '伺服器不支援字型子集'}), 501
+    except Exception as e:
+        current_app.logger.error(f"讀取字型檔失敗: {e}")
+        return jsonify({'error': '無法讀取字型檔'}), 500
+    return font_response(raw, gzipped, etag, 'font/ttf',
+                         SUBSET_CACHE_CONTROL if text else FONT_CACHE_CONTROL)
 
 @font_bp.route('/api/font/noto_sans_tc', methods=['GET'])
 def get_noto_sans_tc_font():
-    font_path = os.path.join(os.path.dirname(__file__), '..', 'fonts', 'NotoSansTC-Regular.ttf')
+    """舊版 base64 JSON 格式，保留給尚未改用二進位端點的頁面，內容同樣只編碼一次"""
     try:
-        with open(font_path, 'rb') as f:
-            font_data = f.read()
-        font_base64 = base64.b64encode(font_data).decode('utf-8')
-        return jsonify({'fontBase64': font_base64})
+        font = load_font()
     except Exception as e:
         current_app.logger.error(f"讀取字型檔失敗: {e}")
-        return jsonify({'error': '無法讀取字型檔'}), 500
\ No newline at end of file
+        return jsonify({'error': '無法讀取字型檔'}), 500
+    return font_response(font['json'], font['json_gzip'], f"{font['etag']}-b64", 'application/json')
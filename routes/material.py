@@ -1,10 +1,14 @@
 from flask import Blueprint, request, jsonify, g
 from flask_jwt_extended import jwt_required
-from models import Material
-from sqlalchemy import func
+from models import Material, MaterialStats
+from sqlalchemy import func, select, case
+from concurrent.futures import ThreadPoolExecutor, wait
+from utils import admin_required
+from tenants import registry, department_key, department_label, get_engine, ensure_schema
 import logging
 import re
 import threading
+import time
 
 material_bp = Blueprint('material', __name__, url_prefix='/api/materials')
 logger = logging.getLogger(__name__)
@@ -65,9 +69,10 @@ def handle_materials():
                     notes=data.get('notes', ''),
                     barcode=barcode
                 )
+                # 低庫存旗標與計數器由資料庫觸發程序維護
                 session.add(material)
                 session.commit()
-            logger.info(f"Material 新增成功，item_id={material.item_id}")
+            logger.info("Material 新增成功，item_id=%s", material.item_id)
             return jsonify({
                 'message': '物料新增成功',
                 'item_id': material.item_id,
@@ -97,7 +102,7 @@ def handle_materials():
                 'current_stock': m.current_stock,
                 'notes': m.notes
             } for m in materials]
-            logger.debug(f"Fetched {len(materials)} materials.")
+            logger.debug("Fetched %d materials.", len(materials))
             return jsonify(result)
         except Exception as e:
             logger.exception(f"讀取物料資料錯誤: {e}", exc_info=True)
@@ -147,7 +152,7 @@ def modify_or_delete_material(item_id):
             material.notes = data.get('notes', material.notes)
 
             session.commit()
-            logger.info(f"Material {item_id} 更新成功。")
+            logger.info("Material %s 更新成功。", item_id)
             return jsonify({'message': '物料更新成功'}), 200
         except Exception as e:
             session.rollback()
@@ -158,7 +163,7 @@ def modify_or_delete_material(item_id):
         try:
             session.delete(material)
             session.commit()
-            logger.info(f"Material {item_id} 刪除成功。")
+            logger.info("Material %s 刪除成功。", item_id)
             return jsonify({'message': '物料刪除成功'}), 200
         except Exception as e:
             session.rollback()
@@ -173,7 +178,7 @@ def get_material_by_barcode(barcode):
     clean_barcode = barcode.strip()
     material = session.query(Material).filter(func.lower(func.trim(Material.barcode)) == clean_barcode.lower()).first()
     if not material:
-        logger.warning(f"找不到條碼: {barcode} (清理後: {clean_barcode})")
+        logger.warning("找不到條碼: %s (清理後: %s)", barcode, clean_barcode)
         return jsonify({'error': '找不到對應的物料資料'}), 404
     result = {
         'item_id': material.item_id,
@@ -185,7 +190,7 @@ def get_material_by_barcode(barcode):
         'current_stock': material.current_stock,
         'notes': material.notes
     }
-    logger.debug(f"條碼 {barcode} 查詢結果: {result}")
+    logger.debug("條碼 %s 查詢結果: item_id=%s, current_stock=%s", barcode, material.item_id, material.current_stock)
     return jsonify(result), 200
 
 
@@ -195,20 +200,164 @@ def get_material_by_barcode(barcode):
 def material_summary():
     session = g.db_session()
     try:
-        # 物料總數
-        total_count = session.query(func.count(Material.item_id)).scalar()
-
-        # 低庫存物料數
-        low_stock_count = session.query(func.count(Material.item_id)).filter(
-            Material.current_stock < Material.safety_stock,
-            Material.safety_stock > 0
-        ).scalar()
+        # 物料總數與低庫存物料數由 material_stats 計數器維護，不需掃描 materials
+        stats = session.get(MaterialStats, 1)
 
         return jsonify({
-            'total': total_count,
-            'lowStock': low_stock_count
+            'total': stats.total_count if stats else 0,
+            'lowStock': stats.low_stock_count if stats else 0
         }), 200
 
     except Exception as e:
         logger.exception(f"儀表板統計失敗: {e}")
-        return jsonify({'error': '獲取統計數據失敗'}), 500
\ No newline at end of file
+        return jsonify({'error': '獲取統計數據失敗'}), 500
+
+# 儀表板圖表用的分類彙總端點，只回傳 O(分類數) 的資料
+@material_bp.route('/summary/categories', methods=['GET'])
+@jwt_required()
+def material_category_summary():
+    session = g.db_session()
+    top_n = request.args.get('top_n', type=int)
+    if top_n is not None and top_n <= 0:
+        return jsonify({'error': 'top_n 必須大於 0'}), 400
+    try:
+        rows = session.execute(category_aggregate_query()).all()
+        categories = [
+            {'category': category, 'count': count, 'stock': stock, 'lowStock': low}
+            for category, count, stock, low in rows
+        ]
+        categories.sort(key=lambda c: (-c['stock'], c['category']))
+
+        total = sum(c['count'] for c in categories)
+        low_stock = sum(c['lowStock'] for c in categories)
+        result = {
+            'total': total,
+            'lowStock': low_stock,
+            'stock': sum(c['stock'] for c in categories),
+            'lowStockRatio': round(low_stock / total, 4) if total else 0,
+            'categoryCount': len(categories)
+        }
+
+        # top_n：只保留庫存最多的前 N 個分類，其餘合併為 others
+        if top_n is not None and len(categories) > top_n:
+            rest = categories[top_n:]
+            categories = categories[:top_n]
+            result['others'] = {
+                'categories': len(rest),
+                'count': sum(c['count'] for c in rest),
+                'stock': sum(c['stock'] for c in rest),
+                'lowStock': sum(c['lowStock'] for c in rest)
+            }
+
+        for c in categories:
+            c['lowStockRatio'] = round(c['lowStock'] / c['count'], 4) if c['count'] else 0
+        result['categories'] = categories
+        return jsonify(result), 200
+
+    except Exception as e:
+        logger.exception(f"分類統計失敗: {e}")
+        return jsonify({'error': '獲取分類統計失敗'}), 500
+
+
+# 跨部門統計：每個部門查詢的逾時秒數（可用 ?timeout= 覆寫，最多 DEPARTMENT_SUMMARY_MAX_TIMEOUT 秒）
+DEPARTMENT_SUMMARY_TIMEOUT = 5.0
+DEPARTMENT_SUMMARY_MAX_TIMEOUT = 30.0
+# 共用執行緒池，逾時的查詢不會阻塞回應
+summary_executor = ThreadPoolExecutor(max_workers=10, thread_name_prefix='dep-summary')
+
+def category_aggregate_query():
+    """依分類彙總品項數、庫存合計與低庫存品項數（使用維護中的 is_low_stock 旗標）"""
+    low_stock = case((Material.is_low_stock, 1), else_=0)
+    return select(
+        Material.category,
+        func.count(Material.id),
+        func.coalesce(func.sum(Material.current_stock), 0),
+        func.coalesce(func.sum(low_stock), 0)
+    ).group_by(Material.category)
+
+def fetch_department_summary(db_path, deadline):
+    """
+    在工作執行緒中查詢單一部門的分類彙總。
+    透過 SQLite progress handler，超過 deadline 時中斷查詢而不是讓執行緒一直佔用。
+    """
+    db_uri = f"sqlite:///{db_path}"
+    ensure_schema(db_uri)
+    engine = get_engine(db_uri)
+    with engine.connect() as conn:
+        dbapi_conn = conn.connection.dbapi_connection
+        dbapi_conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, 1000)
+        try:
+            rows = conn.execute(category_aggregate_query()).all()
+        finally:
+            dbapi_conn.set_progress_handler(None, 0)
+    return [
+        {'category': category, 'count': count, 'stock': stock, 'lowStock': low}
+        for category, count, stock, low in rows
+    ]
+
+@material_bp.route('/summary/all-departments', methods=['GET'])
+@admin_required
+def all_departments_summary():
+    """
+    管理者跨部門庫存統計：平行查詢所有部門資料庫，
+    在伺服器端合併後回傳精簡結果，個別部門失敗或逾時不影響其他部門。
+    """
+    try:
+        timeout = float(request.args.get('timeout', DEPARTMENT_SUMMARY_TIMEOUT))
+    except ValueError:
+        return jsonify({'error': 'timeout 格式錯誤'}), 400
+    # NaN 與 inf 的比較結果為 False，一併被拒絕
+    if not 0 < timeout <= DEPARTMENT_SUMMARY_MAX_TIMEOUT:
+        return jsonify({'error': f"timeout 須介於 0~{DEPARTMENT_SUMMARY_MAX_TIMEOUT:g} 秒"}), 400
+
+    started = time.monotonic()
+    deadline = started + timeout
+    departments = registry.live_departments()
+    futures = {
+        summary_executor.submit(fetch_department_summary, db_path, deadline): dep_num
+        for dep_num, db_path in departments
+    }
+    wait(futures, timeout=timeout)
+
+    result_departments = []
+    merged = {}
+    failed = []
+    for future, dep_num in sorted(futures.items(), key=lambda item: item[1]):
+        entry = {'department': department_key(dep_num), 'label': department_label(dep_num)}
+        if not future.done():
+            future.cancel()
+            entry.update(status='timeout')
+        elif future.exception() is not None:
+            logger.error(f"部門 {entry['department']} 統計失敗: {future.exception()}")
+            entry.update(status='error', error=str(future.exception()))
+        else:
+            categories = future.result()
+            entry.update(
+                status='ok',
+                total=sum(c['count'] for c in categories),
+                lowStock=sum(c['lowStock'] for c in categories),
+                stock=sum(c['stock'] for c in categories),
+                categories=categories
+            )
+            for c in categories:
+                m = merged.setdefault(c['category'], {'category': c['category'], 'count': 0, 'stock': 0, 'lowStock': 0})
+                m['count'] += c['count']
+                m['stock'] += c['stock']
+                m['lowStock'] += c['lowStock']
+        if entry['status'] != 'ok':
+            failed.append(entry['department'])
+        result_departments.append(entry)
+
+    categories = sorted(merged.values(), key=lambda c: c['category'])
+    elapsed = time.monotonic() - started
+    logger.info(f"跨部門統計完成，{len(departments) - len(failed)}/{len(departments)} 個部門成功，耗時 {elapsed:.3f} 秒")
+    return jsonify({
+        'total': sum(c['count'] for c in categories),
+        'lowStock': sum(c['lowStock'] for c in categories),
+        'stock': sum(c['stock'] for c in categories),
+        'categories': categories,
+        'departments': result_departments,
+        'failed': failed,
+        'partial': bool(failed),
+        'elapsed': round(elapsed, 3)
+    }), 200
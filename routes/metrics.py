@@ -0,0 +1,20 @@
+import hmac
+from flask import Blueprint, Response, jsonify, request
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from metrics import METRICS_TOKEN, render_metrics
+from utils import is_admin_user
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/api/metrics', methods=['GET'])
+def export_metrics():
+    """
+    Prometheus 格式的請求延遲、處理中請求數、狀態碼、SQL 時間與連線池等待。
+    管理者 JWT 或 X-Metrics-Token 標頭（與環境變數 METRICS_TOKEN 相同）皆可讀取。
+    """
+    token = request.headers.get('X-Metrics-Token')
+    if not (METRICS_TOKEN and token and hmac.compare_digest(token, METRICS_TOKEN)):
+        verify_jwt_in_request()
+        if not is_admin_user(get_jwt_identity()):
+            return jsonify({'error': '需要管理者權限'}), 403
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,71 @@
+import os
+from flask import Blueprint, Response, jsonify, request, send_file
+from sql_profiler import recent_reports
+from cpu_profiler import (
+    SAMPLE_INTERVAL, SAMPLE_MAX_SECONDS, list_profiles, profile_path, profile_summary, stack_sampler
+)
+from utils import admin_required
+
+profile_bp = Blueprint('profile', __name__, url_prefix='/api/profile')
+
+@profile_bp.route('/sql', methods=['GET'])
+@admin_required
+def list_sql_reports():
+    """最近的 SQL 分析報告（新到舊），?request_id= 只回傳該請求；只有 N+1 嫌疑的可加 ?suspects=1"""
+    reports = list(reversed(recent_reports))
+    rid = request.args.get('request_id')
+    if rid:
+        reports = [r for r in reports if r['request_id'] == rid]
+        if not reports:
+            return jsonify({'error': '找不到該請求的分析報告'}), 404
+    if request.args.get('suspects') == '1':
+        reports = [r for r in reports if r['n_plus_one_suspects']]
+    return jsonify(reports)
+
+@profile_bp.route('/cpu', methods=['GET'])
+@admin_required
+def list_cpu_profiles():
+    """已儲存的 cProfile 結果（請求帶 X-CPU-Profile: 1 或 ?cprofile=1 時產生）"""
+    return jsonify(list_profiles())
+
+@profile_bp.route('/cpu/<string:rid>', methods=['GET'])
+@admin_required
+def get_cpu_profile(rid):
+    """下載 .pstats；?format=text 回傳依 ?sort=（預設 cumulative）排序的文字摘要"""
+    path = profile_path(rid)
+    if path is None or not os.path.exists(path):
+        return jsonify({'error': '找不到該請求的 cProfile 結果'}), 404
+    if request.args.get('format') == 'text':
+        sort = request.args.get('sort', 'cumulative')
+        if sort not in ('cumulative', 'tottime', 'ncalls'):
+            return jsonify({'error': 'sort 只支援 cumulative、tottime、ncalls'}), 400
+        return Response(profile_summary(path, sort), content_type='text/plain; charset=utf-8')
+    return send_file(path, as_attachment=True, download_name=f"{rid}.pstats", mimetype='application/octet-stream')
+
+@profile_bp.route('/sample', methods=['POST'])
+@admin_required
+def start_stack_sampling():
+    """在背景取樣所有執行緒堆疊 ?seconds=（預設 10，最多 60），?interval= 秒（預設 0.01）"""
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', SAMPLE_INTERVAL))
+    except ValueError:
+        return jsonify({'error': 'seconds 與 interval 必須是數字'}), 400
+    if not 0 < seconds <= SAMPLE_MAX_SECONDS or not 0.001 <= interval <= 1:
+        return jsonify({'error': f"seconds 須介於 0~{SAMPLE_MAX_SECONDS}，interval 須介於 0.001~1"}), 400
+    if not stack_sampler.start(seconds, interval):
+        return jsonify({'error': '已有取樣進行中', 'status': stack_sampler.status()}), 409
+    return jsonify(stack_sampler.status()), 202
+
+@profile_bp.route('/sample', methods=['GET'])
+@admin_required
+def get_stack_samples():
+    """取樣進行中回傳狀態（202），完成後回傳 collapsed stack 文字，可直接產生 flamegraph"""
+    status = stack_sampler.status()
+    if status['running']:
+        return jsonify(status), 202
+    collapsed = stack_sampler.result()
+    if collapsed is None:
+        return jsonify({'error': '尚未執行取樣'}), 404
+    return Response(collapsed, content_type='text/plain; charset=utf-8',
+                    headers={'Content-Disposition': 'attachment; filename=stacks.collapsed'})
@@ -1,6 +1,5 @@
 from flask import Blueprint, request, jsonify, g
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from extensions import db
 from models import InRecord, OutRecord, Material
 from sqlalchemy import func
 import threading
@@ -22,8 +21,9 @@ def update_material_current_stock(material_item_id, session):
     if new_stock < 0:
         logger.warning(f"物料 {material_item_id} 計算後庫存為負 ({new_stock})，已校正為 0。")
         new_stock = 0
+    # is_low_stock 與 material_stats 由資料庫觸發程序依寫入當下的庫存更新
     material.current_stock = new_stock
-    logger.info(f"物料 {material_item_id} 的庫存已在 session 中更新為 {new_stock}。")
+    logger.info("物料 %s 的庫存已在 session 中更新為 %s。", material_item_id, new_stock)
     return True
 
 @record_bp.route('/api/barcode/record', methods=['POST'], strict_slashes=False)
@@ -118,7 +118,7 @@ def handle_in_records():
                     'handler': r.handler,
                     'barcode': r.barcode
                 })
-            logger.debug(f"Fetched {len(result)} in-records.")
+            logger.debug("Fetched %d in-records.", len(result))
             return jsonify(result), 200
         except Exception as e:
             logger.exception(f"讀取入庫資料錯誤: {e}")
@@ -140,7 +140,7 @@ def handle_in_records():
                 session.flush()
                 update_material_current_stock(material.item_id, session)
                 session.commit()
-                logger.info(f"InRecord added for material {material.item_id}, quantity {data['quantity']}.")
+                logger.info("InRecord added for material %s, quantity %s.", material.item_id, data['quantity'])
                 return jsonify({
                     'message': 'In record added',
                     'stock': material.current_stock,
@@ -175,7 +175,7 @@ def delete_in_record(record_id):
             session.flush()
             update_material_current_stock(material.item_id, session)
             session.commit()
-            logger.info(f"InRecord {record_id} deleted.")
+            logger.info("InRecord %s deleted.", record_id)
             return jsonify({'message': '入庫紀錄刪除成功'}), 200
         except Exception as e:
             session.rollback()
@@ -210,7 +210,7 @@ def handle_out_records():
                     'source': r.source,
                     'handler': r.handler
                 })
-            logger.debug(f"Fetched {len(result)} out-records.")
+            logger.debug("Fetched %d out-records.", len(result))
             return jsonify(result), 200
         except Exception as e:
             logger.exception(f"讀取出庫資料錯誤: {e}")
@@ -236,7 +236,7 @@ def handle_out_records():
                 session.flush()
                 update_material_current_stock(material.item_id, session)
                 session.commit()
-                logger.info(f"OutRecord added for material {material.item_id}, quantity {data['quantity']}.")
+                logger.info("OutRecord added for material %s, quantity %s.", material.item_id, data['quantity'])
                 return jsonify({
                     'message': 'Out record added',
                     'stock': material.current_stock,
@@ -271,7 +271,7 @@ def delete_out_record(record_id):
             session.flush()
             update_material_current_stock(material.item_id, session)
             session.commit()
-            logger.info(f"OutRecord {record_id} deleted.")
+            logger.info("OutRecord %s deleted.", record_id)
             return jsonify({'message': '出庫紀錄刪除成功'}), 200
         except Exception as e:
             session.rollback()
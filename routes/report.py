@@ -1,26 +1,20 @@
 import os
+import json
+import time
+import threading
 from io import BytesIO
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dateutil.relativedelta import relativedelta
 import logging
 
 from flask import Blueprint, request, jsonify, send_file, g
 from flask_jwt_extended import jwt_required
-from extensions import db
-from models import Material, InRecord, OutRecord
-from sqlalchemy import func
-
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from reportlab.lib.enums import TA_CENTER
-
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill
-from openpyxl.utils import get_column_letter
+from models import Material, InRecord, OutRecord, is_low_stock_level
+from sqlalchemy import func, select
+from utils import admin_required
+from jobs import background_jobs
+from tenants import registry, department_key, department_label, get_engine, ensure_schema
 
 report_bp = Blueprint('report', __name__)
 logger = logging.getLogger(__name__)
@@ -29,15 +23,41 @@ logger = logging.getLogger(__name__)
 basedir = os.path.abspath(os.path.dirname(__file__))
 FONT_PATH = os.path.join(basedir, '..', 'fonts', 'NotoSansTC-Regular.ttf')
 
-try:
-    if os.path.exists(FONT_PATH):
-        pdfmetrics.registerFont(TTFont('ChineseFont', FONT_PATH))
-        pdfmetrics.registerFontFamily('ChineseFont', normal='ChineseFont', bold='ChineseFont', italic='ChineseFont', boldItalic='ChineseFont')
-        logger.info(f"中文字型 'ChineseFont' 載入成功。")
-    else:
-        logger.error(f"找不到字型檔 {FONT_PATH}。PDF 報表中的中文可能無法正常顯示。")
-except Exception as e:
-    logger.error(f"註冊中文字型失敗: {e}")
+# ReportLab、openpyxl 與字型註冊都延遲到第一次產生報表時才載入，不拖慢啟動
+_font_lock = threading.Lock()
+_font_registered = False
+
+def register_chinese_font():
+    """第一次產生 PDF 前註冊中文字型，之後直接返回"""
+    global _font_registered
+    if _font_registered:
+        return
+    with _font_lock:
+        if _font_registered:
+            return
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+        try:
+            if os.path.exists(FONT_PATH):
+                pdfmetrics.registerFont(TTFont('ChineseFont', FONT_PATH))
+                pdfmetrics.registerFontFamily('ChineseFont', normal='ChineseFont', bold='ChineseFont', italic='ChineseFont', boldItalic='ChineseFont')
+                logger.info(f"中文字型 'ChineseFont' 載入成功。")
+            else:
+                logger.error(f"找不到字型檔 {FONT_PATH}。PDF 報表中的中文可能無法正常顯示。")
+        except Exception as e:
+            logger.error(f"註冊中文字型失敗: {e}")
+        _font_registered = True
+
+def prewarm_report_modules():
+    """伺服器開始服務後於背景執行緒呼叫，預先載入報表模組與字型，讓第一個報表請求不必等待"""
+    started = time.perf_counter()
+    try:
+        import reportlab.platypus  # noqa: F401
+        import openpyxl  # noqa: F401
+        register_chinese_font()
+        logger.info(f"報表模組預載完成，耗時 {time.perf_counter() - started:.3f} 秒")
+    except Exception as e:
+        logger.error(f"報表模組預載失敗: {e}")
 
 REPORT_TYPE_MAP = {
     'stock_summary': '庫存摘要報表',
@@ -64,6 +84,9 @@ def get_report_params(args):
         end_date_str = args.get('end_date')
         if not start_date_str or not end_date_str:
             raise ValueError("在日期範圍模式下，必須提供開始與結束日期。")
+        # 批次報表的參數來自 JSON，可能不是字串
+        if not isinstance(start_date_str, str) or not isinstance(end_date_str, str):
+            raise ValueError("開始與結束日期須為 YYYY-MM-DD 格式的字串。")
         dt_start = datetime.strptime(start_date_str, '%Y-%m-%d').replace(hour=0, minute=0, second=0)
         dt_end = datetime.strptime(end_date_str, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
         target_year, target_month = dt_end.year, dt_end.month
@@ -72,7 +95,10 @@ def get_report_params(args):
         month_str = args.get('month')
         if not year_str or not month_str:
             raise ValueError("在月份模式下，必須提供年份與月份。")
-        target_year, target_month = int(year_str), int(month_str)
+        try:
+            target_year, target_month = int(year_str), int(month_str)
+        except (TypeError, ValueError):
+            raise ValueError("年份與月份須為整數。")
         dt_start = datetime(target_year, target_month, 1)
         dt_end = dt_start + relativedelta(months=1) - timedelta(seconds=1)
 
@@ -108,17 +134,16 @@ def calculate_monthly_io(session, material_id, year, month):
     ).scalar()
     return monthly_in, monthly_out
 
-@report_bp.route('/api/report/preview', methods=['GET'])
-@jwt_required()
-def report_preview_pdf():
-    session = g.db_session()
-    try:
-        params = get_report_params(request.args)
-        report_type, category, item_id, school_dept, dt_start, dt_end, target_year, target_month = params
-        query_mode = request.args.get('query_mode', 'daterange')
-    except ValueError as e:
-        logger.error(f"PDF 報表參數錯誤: {e}")
-        return jsonify({'error': str(e)}), 400
+def build_pdf_report(session, params, query_mode):
+    """依報表參數產生 PDF，回傳 BytesIO；不依賴 request 與 g，批次工作也共用此函式"""
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER
+
+    register_chinese_font()
+    report_type, category, item_id, school_dept, dt_start, dt_end, target_year, target_month = params
 
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=30)
@@ -165,10 +190,9 @@ def report_preview_pdf():
             end_of_month_stock = prev_month_stock + monthly_in - monthly_out
 
             notes_text = m.notes or ''
-            is_low_stock = False
-            if m.safety_stock > 0 and end_of_month_stock <= m.safety_stock:
+            is_low_stock = is_low_stock_level(end_of_month_stock, m.safety_stock)
+            if is_low_stock:
                 notes_text = "低庫存" if not notes_text else f"低庫存; {notes_text}"
-                is_low_stock = True
 
             # 根據是否為低庫存選擇不同的樣式
             notes_paragraph = Paragraph(notes_text, styleRed if is_low_stock else styleN)
@@ -246,8 +270,8 @@ def report_preview_pdf():
         headers = ["物料編號", "分類", "名稱", "單位", "安全庫存", "目前庫存", "庫存差距"]
         data = [headers]
 
-        query = session.query(Material).filter(Material.safety_stock > 0)\
-                              .filter(Material.current_stock <= Material.safety_stock)
+        # is_low_stock 由部分索引 ix_materials_low_stock 支援
+        query = session.query(Material).filter(Material.is_low_stock == True)
 
         if category and category != 'all':
             query = query.filter(Material.category == category)
@@ -279,8 +303,55 @@ def report_preview_pdf():
 
     doc.build(elements)
     buffer.seek(0)
+    return buffer
+
+@report_bp.route('/api/report/preview', methods=['GET'])
+@jwt_required()
+def report_preview_pdf():
+    session = g.db_session()
+    try:
+        params = get_report_params(request.args)
+        report_type, category, item_id, school_dept, dt_start, dt_end, target_year, target_month = params
+        query_mode = request.args.get('query_mode', 'daterange')
+    except ValueError as e:
+        logger.error(f"PDF 報表參數錯誤: {e}")
+        return jsonify({'error': str(e)}), 400
+
+    buffer = build_pdf_report(session, params, query_mode)
     return send_file(buffer, as_attachment=False, download_name=f"{report_type}_preview.pdf", mimetype='application/pdf')
 
+@report_bp.route('/api/report/batch', methods=['POST'])
+@admin_required
+def report_batch():
+    """
+    管理者一次為所有部門產生同一份 PDF 報表。報表在獨立的 batch_report.py 行程中產生，
+    立即回傳 202 與 job_id，完成後由 GET /api/report/batch/<job_id> 取得 manifest（含各部門耗時）
+    """
+    args = request.get_json(silent=True) or request.args.to_dict()
+    try:
+        # 參數錯誤時在啟動背景工作前就回應 400
+        get_report_params(args)
+    except (TypeError, ValueError) as e:
+        logger.error("批次報表參數錯誤: %s", e)
+        return jsonify({'error': str(e)}), 400
+    try:
+        job = background_jobs.start('batch_report', 'batch_report.py', ['--params', json.dumps(args)])
+    except Exception as e:
+        logger.exception("批次報表工作啟動失敗: %s", e)
+        return jsonify({'error': '批次報表產生失敗'}), 500
+    if job is None:
+        return jsonify({'error': '已有批次報表正在產生'}), 409
+    return jsonify(job), 202
+
+@report_bp.route('/api/report/batch/<string:job_id>', methods=['GET'])
+@admin_required
+def report_batch_status(job_id):
+    """批次報表工作進行中回傳 202，完成後 result 為 manifest，失敗時附上工作記錄的最後部分"""
+    job = background_jobs.status(job_id)
+    if job is None or job['kind'] != 'batch_report':
+        return jsonify({'error': '找不到該批次報表工作'}), 404
+    return jsonify(job), 202 if job['status'] == 'running' else 200
+
 @report_bp.route('/api/report/export_excel', methods=['GET'])
 @jwt_required()
 def report_export_excel():
@@ -293,6 +364,10 @@ def report_export_excel():
         logger.error(f"Excel 報表參數錯誤: {e}")
         return jsonify({'error': str(e)}), 400
 
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment, PatternFill
+    from openpyxl.utils import get_column_letter
+
     wb = Workbook()
     ws = wb.active
     ws.title = REPORT_TYPE_MAP.get(report_type, report_type)
@@ -335,10 +410,9 @@ def report_export_excel():
             end_of_month_stock = prev_month_stock + monthly_in - monthly_out
 
             notes_text = m.notes or ''
-            is_low_stock = False
-            if m.safety_stock > 0 and end_of_month_stock <= m.safety_stock:
+            is_low_stock = is_low_stock_level(end_of_month_stock, m.safety_stock)
+            if is_low_stock:
                 notes_text = "低庫存" if not notes_text else f"低庫存; {notes_text}"
-                is_low_stock = True
 
             ws.append([
                 m.item_id, m.category, m.name, m.unit,
@@ -388,8 +462,8 @@ def report_export_excel():
         headers = ["物料編號", "分類", "名稱", "單位", "安全庫存", "目前庫存", "庫存差距"]
         ws.append(headers)
 
-        query = session.query(Material).filter(Material.safety_stock > 0)\
-                              .filter(Material.current_stock <= Material.safety_stock)
+        # is_low_stock 由部分索引 ix_materials_low_stock 支援
+        query = session.query(Material).filter(Material.is_low_stock == True)
 
         if category and category != 'all':
             query = query.filter(Material.category == category)
@@ -429,4 +503,120 @@ def report_export_excel():
     output.seek(0)
 
     filename = f"{report_type}_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    return send_file(output, as_attachment=True, download_name=filename, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
\ No newline at end of file
+    return send_file(output, as_attachment=True, download_name=filename, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+CONSOLIDATED_HEADERS = ["物料編號", "分類", "名稱", "單位", "目前庫存", "安全庫存", "低庫存", "備註/存放點"]
+
+def fetch_department_materials(db_path):
+    """在工作執行緒中透過共用 engine 讀取單一部門的物料清單，回傳 (rows, 耗時秒數)"""
+    started = time.perf_counter()
+    db_uri = f"sqlite:///{db_path}"
+    ensure_schema(db_uri)
+    engine = get_engine(db_uri)
+    stmt = select(
+        Material.item_id, Material.category, Material.name, Material.unit,
+        Material.current_stock, Material.safety_stock, Material.notes
+    ).order_by(Material.item_id)
+    with engine.connect() as conn:
+        rows = conn.execute(stmt).all()
+    return rows, time.perf_counter() - started
+
+def build_consolidated_workbook(departments, output):
+    """
+    平行查詢所有部門資料庫，每個部門寫入各自的 write-only 工作表，
+    最前面的彙總工作表依分類加總。哪個部門先查完就先寫入，
+    總耗時約等於最慢的部門。回傳各部門耗時（秒）。
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill
+
+    wb = Workbook(write_only=True)
+    font_header = Font(bold=True, name='Calibri')
+    fill_header = PatternFill(start_color='D9D9D9', end_color='D9D9D9', fill_type='solid')
+
+    def header_row(ws, values):
+        cells = []
+        for value in values:
+            cell = WriteOnlyCell(ws, value=value)
+            cell.font = font_header
+            cell.fill = fill_header
+            cells.append(cell)
+        return cells
+
+    # 工作表順序依建立順序決定，彙總表先建立、最後才寫入內容
+    ws_summary = wb.create_sheet('各科彙總')
+    sheets = {
+        dep_num: wb.create_sheet(f"{department_label(dep_num)}({department_key(dep_num)})")
+        for dep_num, _ in departments
+    }
+
+    totals = {}
+    timings = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, len(departments))) as executor:
+        futures = {executor.submit(fetch_department_materials, db_path): dep_num for dep_num, db_path in departments}
+        for future in as_completed(futures):
+            dep_num = futures[future]
+            ws = sheets[dep_num]
+            try:
+                rows, seconds = future.result()
+            except Exception as e:
+                logger.error(f"讀取部門 {department_key(dep_num)} 物料失敗: {e}")
+                ws.append([f"讀取失敗: {e}"])
+                failed.append(dep_num)
+                continue
+            timings[department_key(dep_num)] = round(seconds, 3)
+
+            ws.append(header_row(ws, CONSOLIDATED_HEADERS))
+            for item_id, category, name, unit, current_stock, safety_stock, notes in rows:
+                current_stock = current_stock or 0
+                safety_stock = safety_stock or 0
+                is_low_stock = is_low_stock_level(current_stock, safety_stock)
+                ws.append([item_id, category, name, unit, current_stock, safety_stock,
+                           '是' if is_low_stock else '', notes or ''])
+
+                total = totals.setdefault(category, {'count': 0, 'stock': 0, 'low': 0, 'by_dep': {}})
+                total['count'] += 1
+                total['stock'] += current_stock
+                total['low'] += 1 if is_low_stock else 0
+                total['by_dep'][dep_num] = total['by_dep'].get(dep_num, 0) + current_stock
+
+    dep_nums = [dep_num for dep_num, _ in departments]
+    ws_summary.append([f"各科物料庫存彙總（{datetime.now().strftime('%Y/%m/%d %H:%M')}）"])
+    ws_summary.append([])
+    ws_summary.append(header_row(ws_summary, ["分類", "品項數", "庫存合計", "低庫存品項"] + [department_label(n) for n in dep_nums]))
+    for category in sorted(totals):
+        total = totals[category]
+        ws_summary.append([category, total['count'], total['stock'], total['low']] +
+                          [total['by_dep'].get(n, 0) for n in dep_nums])
+    ws_summary.append([
+        '合計',
+        sum(t['count'] for t in totals.values()),
+        sum(t['stock'] for t in totals.values()),
+        sum(t['low'] for t in totals.values()),
+    ] + [sum(t['by_dep'].get(n, 0) for t in totals.values()) for n in dep_nums])
+    if failed:
+        ws_summary.append([])
+        ws_summary.append(['讀取失敗的部門'] + [department_label(n) for n in sorted(failed)])
+
+    wb.save(output)
+    return timings
+
+@report_bp.route('/api/report/export_all_excel', methods=['GET'])
+@admin_required
+def report_export_all_excel():
+    """管理者匯出所有部門的物料清單，單一 Excel 檔、每個部門一個工作表"""
+    departments = registry.live_departments()
+    output = BytesIO()
+    started = time.perf_counter()
+    try:
+        timings = build_consolidated_workbook(departments, output)
+    except Exception as e:
+        logger.exception(f"跨部門 Excel 匯出失敗: {e}")
+        return jsonify({'error': '跨部門 Excel 匯出失敗'}), 500
+    logger.info(f"跨部門 Excel 匯出完成，共 {time.perf_counter() - started:.3f} 秒，各部門查詢耗時: {timings}")
+    output.seek(0)
+
+    filename = f"all_departments_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    return send_file(output, as_attachment=True, download_name=filename, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
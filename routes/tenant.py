@@ -0,0 +1,24 @@
+import logging
+from flask import Blueprint, jsonify
+from tenants import registry
+from utils import admin_required
+
+tenant_bp = Blueprint('tenant', __name__, url_prefix='/api/tenants')
+logger = logging.getLogger(__name__)
+
+@tenant_bp.route('', methods=['GET'], strict_slashes=False)
+@admin_required
+def list_tenants():
+    """目前租戶登錄表：各部門名稱、資料庫檔案與對應帳號，以及等待釋放的 engine"""
+    return jsonify(registry.describe())
+
+@tenant_bp.route('/reload', methods=['POST'])
+@admin_required
+def reload_tenants():
+    """重新載入 tenants.json，新增的部門立即可用，移除的部門其 engine 在連線歸還後釋放"""
+    try:
+        result = registry.reload()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    logger.info(f"管理者重新載入租戶登錄表: {result}")
+    return jsonify(result)
@@ -1,21 +1,46 @@
 from flask import request, jsonify, g, current_app
 from flask import Blueprint
 from flask_jwt_extended import (
-    create_access_token,
     jwt_required,
+    get_jwt,
     get_jwt_identity
 )
 from models import User
+import io
 import threading
 import logging
-from werkzeug.security import check_password_hash
 from config import get_session, default_db_path
+from auth_tokens import issue_tokens, rotate_refresh_token, verify_password, LoginBusyError
+from utils import admin_required, is_admin_user
+from services import session_registry
+from jobs import background_jobs
+from tenants import resolve_tenant, tenant_from_claims
 
 user_bp = Blueprint('user', __name__, url_prefix='/api')
 
 logger = logging.getLogger(__name__)
 db_lock = threading.Lock()
 
+def queue_full_response(position, ticket):
+    """部門額滿時的 429 回應：附上排隊序號與查詢 /api/sessions/queue 用的排隊憑證"""
+    return jsonify({
+        "msg": "目前使用人數已滿，已加入等待佇列",
+        "queue_position": position,
+        "queue_ticket": ticket
+    }), 429, {'Retry-After': '10'}
+
+def admit_session(username, tenant):
+    """
+    登入、auto-auth 與換發 token 時佔用部門名額，額滿時回傳 429 回應，否則回傳 None。
+    管理者不受人數上限限制，避免其他帳號佔滿 main 名額後管理者無法操作。
+    """
+    if is_admin_user(username):
+        return None
+    admitted, position, ticket = session_registry.acquire(username, tenant)
+    if not admitted:
+        return queue_full_response(position, ticket)
+    return None
+
 @user_bp.route('/register', methods=['POST'], strict_slashes=False)
 def register():
     data = request.json
@@ -44,6 +69,46 @@ def register():
         finally:
             session.close()
 
+@user_bp.route('/users/bulk', methods=['POST'])
+@admin_required
+def bulk_create_users():
+    """
+    管理者以 CSV（欄位 username,password[,role]）批次建立帳號，
+    可用 multipart 欄位 file 上傳，或直接以 text/csv 作為請求內容。
+    密碼雜湊在獨立的 create_users.py 行程中進行，立即回傳 202 與 job_id，
+    結果由 GET /api/users/bulk/<job_id> 查詢。
+    """
+    from create_users import read_users_csv
+
+    upload = request.files.get('file')
+    raw = upload.read() if upload else request.get_data()
+    if not raw:
+        return jsonify({'error': '請上傳 CSV 檔'}), 400
+    try:
+        text = raw.decode('utf-8-sig')
+        read_users_csv(io.StringIO(text))
+    except (UnicodeDecodeError, ValueError) as e:
+        return jsonify({'error': f"CSV 格式錯誤: {e}"}), 400
+
+    try:
+        job = background_jobs.start('bulk_users', 'create_users.py', ['--csv', '-', '--db', default_db_path],
+                                    stdin_data=text.encode('utf-8'))
+    except Exception as e:
+        logger.exception("批次建立使用者工作啟動失敗: %s", e)
+        return jsonify({'error': '批次建立使用者失敗'}), 500
+    if job is None:
+        return jsonify({'error': '已有批次建立使用者工作進行中'}), 409
+    return jsonify(job), 202
+
+@user_bp.route('/users/bulk/<string:job_id>', methods=['GET'])
+@admin_required
+def bulk_create_users_status(job_id):
+    """批次建立使用者工作進行中回傳 202，完成後 result 為處理結果摘要（新增、已存在、無效清單與耗時）"""
+    job = background_jobs.status(job_id)
+    if job is None or job['kind'] != 'bulk_users':
+        return jsonify({'error': '找不到該批次建立使用者工作'}), 404
+    return jsonify(job), 202 if job['status'] == 'running' else 200
+
 @user_bp.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
@@ -55,11 +120,54 @@ def login():
     session = g.db_session()
     
     user = session.query(User).filter_by(username=username).first()
-    if not user or not check_password_hash(user.password_hash, password):
-        return jsonify({"msg": "帳號或密碼錯誤"}), 401
+    try:
+        if not user or not verify_password(user.password_hash, password):
+            return jsonify({"msg": "帳號或密碼錯誤"}), 401
+    except LoginBusyError:
+        return jsonify({"msg": "登入人數過多，請稍後再試"}), 503, {'Retry-After': '5'}
 
-    access_token = create_access_token(identity=username)
-    return jsonify(access_token=access_token)
+    queued = admit_session(username, resolve_tenant(username))
+    if queued:
+        return queued
+    return jsonify(issue_tokens(username))
+
+@user_bp.route('/token/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh_token():
+    """以 refresh token 換發新的 access token 與 refresh token（輪替），舊的 refresh token 立即失效；部門額滿且未持有名額時不換發"""
+    username = get_jwt_identity()
+    queued = admit_session(username, tenant_from_claims(username, get_jwt()))
+    if queued:
+        return queued
+    tokens = rotate_refresh_token(username, get_jwt())
+    if tokens is None:
+        return jsonify({"msg": "refresh token 已使用過，請重新登入"}), 401
+    return jsonify(tokens)
+
+@user_bp.route('/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    """釋放使用名額，讓同部門排隊中的下一位使用者取得名額"""
+    username = get_jwt_identity()
+    released = session_registry.logout(username, tenant_from_claims(username, get_jwt()))
+    return jsonify({'message': '已登出', 'released': released})
+
+@user_bp.route('/sessions', methods=['GET'])
+@admin_required
+def list_sessions():
+    """管理者查看各部門使用中的工作階段與等待佇列，可用 ?department=dep1 篩選"""
+    return jsonify(session_registry.snapshot(request.args.get('department')))
+
+@user_bp.route('/sessions/queue', methods=['GET'])
+def session_queue_status():
+    """以登入時 429 回應中的 queue_ticket 查詢目前序號（同時延長排隊期限），輪到時重新登入即可"""
+    ticket = request.args.get('ticket')
+    if not ticket:
+        return jsonify({'error': 'ticket required'}), 400
+    status = session_registry.queue_status(ticket)
+    if status is None:
+        return jsonify({'error': '排隊憑證無效或已逾時，請重新登入'}), 404
+    return jsonify(status)
 
 @user_bp.route('/auto-auth', methods=['GET'], strict_slashes=False)
 def auto_auth():
@@ -74,10 +182,13 @@ def auto_auth():
             session.add(user)
             session.commit()
             logger.info(f"Auto-auth user '{system_username}' created")
-    
-    token = create_access_token(identity=system_username)
-    logger.debug(f"Auto-auth token generated for {system_username}")
-    return jsonify({'access_token': token}), 200
+
+    queued = admit_session(system_username, resolve_tenant(system_username))
+    if queued:
+        return queued
+    tokens = issue_tokens(system_username)
+    logger.debug("Auto-auth token generated for %s", system_username)
+    return jsonify(tokens), 200
 
 @user_bp.route('/userinfo', methods=['GET'])
 @jwt_required()
@@ -1,67 +1,252 @@
+import os
+import time
+import heapq
+import secrets
+import itertools
 import threading
+from collections import OrderedDict
 from datetime import datetime, timezone
 import logging
+from tenants import MAIN_TENANT
 
 logger = logging.getLogger(__name__)
 
-class LoginStateService:
-    _instance = None
-    _instance_lock = threading.Lock()
-    
-    def __new__(cls):
-        with cls._instance_lock:
-            if cls._instance is None:
-                cls._instance = super().__new__(cls)
-                cls._instance._initialized = False
-            return cls._instance
-
-    def __init__(self):
-        if self._initialized:
-            return
+# 每個部門（租戶）同時使用的人數上限
+MAX_SESSIONS_PER_DEPARTMENT = int(os.environ.get('MAX_SESSIONS_PER_DEPARTMENT', 10))
+# 非部門帳號（管理者以外的行政、系統帳號）全部歸在 main 租戶，另設上限
+MAX_SESSIONS_MAIN = int(os.environ.get('MAX_SESSIONS_MAIN', 30))
+# 使用中的工作階段閒置超過此秒數即釋放名額
+SESSION_IDLE_TIMEOUT = 180
+# 排隊中的使用者超過此秒數未再查詢或重試登入即移出佇列
+QUEUE_IDLE_TIMEOUT = 60
+# 同一工作階段在此秒數內的多次活動只更新一次到期時間，避免每個請求都推入 heap
+TOUCH_GRANULARITY = 5
+# 背景清理執行緒沒有到期項目時的最長睡眠秒數
+SWEEP_MAX_SLEEP = 30
+
+class _Entry:
+    __slots__ = ('username', 'tenant', 'kind', 'started_at', 'last_seen', 'expires_at', 'ticket')
+
+    def __init__(self, username, tenant, kind, now):
+        self.username = username
+        self.tenant = tenant
+        self.kind = kind
+        self.started_at = datetime.now(timezone.utc)
+        self.last_seen = now
+        self.expires_at = None
+        # 排隊時發給使用者的憑證，查詢排隊狀態用；直接取得名額的工作階段沒有憑證
+        self.ticket = None
+
+class SessionRegistry:
+    """
+    以部門為單位的同時使用人數管理：每個部門最多 max_per_tenant 個使用中的工作階段（main 租戶依 tenant_caps），
+    額滿時依先來先到排隊。只有登入、auto-auth 與換發 token 會佔用名額（acquire），
+    一般請求只延長自己既有名額的閒置期限（touch）。到期時間放在 min-heap，由背景執行緒依最早到期時間喚醒清理，
+    每次更新與到期皆為 O(log n)；heap 中過時的項目在彈出時比對到期時間後略過。
+    """
+
+    def __init__(self, max_per_tenant=MAX_SESSIONS_PER_DEPARTMENT, idle_timeout=SESSION_IDLE_TIMEOUT,
+                 queue_timeout=QUEUE_IDLE_TIMEOUT, tenant_caps=None):
+        self.max_per_tenant = max_per_tenant
+        self.tenant_caps = {MAIN_TENANT: MAX_SESSIONS_MAIN} if tenant_caps is None else dict(tenant_caps)
+        self.idle_timeout = idle_timeout
+        self.queue_timeout = queue_timeout
         self._lock = threading.Lock()
-        self._active_user = None
-        self._login_queue = []
-        self._activity_time = {}
-        self._initialized = True
-    
-    def try_login(self, username):
+        self._active = {}
+        self._queues = {}
+        self._tickets = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = threading.Event()
+        self._sweeper = None
+
+    def capacity(self, tenant):
+        return self.tenant_caps.get(tenant, self.max_per_tenant)
+
+    # --- 內部操作（呼叫前須持有 self._lock） ---
+    def _schedule(self, entry, now):
+        timeout = self.idle_timeout if entry.kind == 'active' else self.queue_timeout
+        entry.last_seen = now
+        entry.expires_at = now + timeout
+        heapq.heappush(self._heap, (entry.expires_at, next(self._seq), entry))
+        if self._heap[0][2] is entry:
+            self._wakeup.set()
+
+    def _touch(self, entry, now):
+        entry.last_seen = now
+        if entry.expires_at is None or entry.expires_at - now < self._timeout_of(entry) - TOUCH_GRANULARITY:
+            self._schedule(entry, now)
+
+    def _timeout_of(self, entry):
+        return self.idle_timeout if entry.kind == 'active' else self.queue_timeout
+
+    def _admit(self, tenant, username, now, entry=None):
+        entry = entry or _Entry(username, tenant, 'active', now)
+        entry.kind = 'active'
+        self._active.setdefault(tenant, {})[username] = entry
+        self._schedule(entry, now)
+        return entry
+
+    def _drop(self, entry):
+        entry.expires_at = None
+        if entry.ticket is not None:
+            self._tickets.pop(entry.ticket, None)
+
+    def _promote(self, tenant, now):
+        """有空位時讓佇列最前面的使用者取得名額，保留到閒置逾時為止等待其重新登入"""
+        active = self._active.setdefault(tenant, {})
+        queue = self._queues.get(tenant)
+        while queue and len(active) < self.capacity(tenant):
+            username, entry = queue.popitem(last=False)
+            self._admit(tenant, username, now, entry)
+            logger.info(f"使用者 {username} 從 {tenant} 佇列中取得使用名額")
+
+    def _sweep(self, now):
+        expired = 0
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, _, entry = heapq.heappop(self._heap)
+            if entry.expires_at != expires_at:
+                continue  # 之後已再次更新，這是過時的 heap 項目
+            if entry.kind == 'active':
+                if self._active.get(entry.tenant, {}).get(entry.username) is entry:
+                    del self._active[entry.tenant][entry.username]
+                    self._drop(entry)
+                    logger.info(f"使用者 {entry.username}（{entry.tenant}）閒置超過 {self.idle_timeout} 秒，釋放名額")
+                    self._promote(entry.tenant, now)
+                    expired += 1
+            elif self._queues.get(entry.tenant, {}).get(entry.username) is entry:
+                del self._queues[entry.tenant][entry.username]
+                self._drop(entry)
+                logger.info(f"使用者 {entry.username}（{entry.tenant}）排隊逾時，移出佇列")
+                expired += 1
+        return expired
+
+    def _queue_position(self, tenant, username):
+        queue = self._queues.get(tenant)
+        if not queue or username not in queue:
+            return None
+        for position, name in enumerate(queue, start=1):
+            if name == username:
+                return position
+        return None
+
+    # --- 背景清理 ---
+    def _ensure_sweeper(self):
+        if self._sweeper is None or not self._sweeper.is_alive():
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='session-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._sweep(now)
+                delay = self._heap[0][0] - now if self._heap else SWEEP_MAX_SLEEP
+            self._wakeup.wait(timeout=max(0.0, min(delay, SWEEP_MAX_SLEEP)))
+            self._wakeup.clear()
+
+    # --- 公開介面 ---
+    def acquire(self, username, tenant):
+        """
+        取得（或延續）使用名額，回傳 (是否取得, 排隊序號, 排隊憑證)。
+        已在使用中或輪到自己時直接取得；額滿時加入（或留在）佇列，回傳目前序號與查詢排隊狀態用的憑證。
+        已在使用中的工作階段只更新到期時間，每個請求呼叫的成本為 O(1)。
+        """
+        self._ensure_sweeper()
+        now = time.monotonic()
         with self._lock:
-            if self._active_user is None:
-                self._active_user = username
-                self._activity_time[username] = datetime.now(timezone.utc)
-                logger.info(f"使用者 {username} 成功登入 (無其他使用者登入中)")
-                return True
-            elif username == self._active_user:
-                self._activity_time[username] = datetime.now(timezone.utc)
-                logger.info(f"使用者 {username} 重複登入，更新活動時間")
-                return True
+            entry = self._active.get(tenant, {}).get(username)
+            if entry is not None:
+                self._touch(entry, now)
+                return True, None, None
+            self._sweep(now)
+            active = self._active.setdefault(tenant, {})
+            queue = self._queues.setdefault(tenant, OrderedDict())
+            capacity = self.capacity(tenant)
+            if len(active) < capacity and (not queue or next(iter(queue)) == username):
+                self._admit(tenant, username, now, queue.pop(username, None))
+                logger.info("使用者 %s 取得 %s 使用名額，目前 %d/%d", username, tenant, len(active), capacity)
+                return True, None, None
+            entry = queue.get(username)
+            if entry is None:
+                entry = queue[username] = _Entry(username, tenant, 'queued', now)
+                entry.ticket = secrets.token_urlsafe(16)
+                self._tickets[entry.ticket] = entry
+                self._schedule(entry, now)
+                logger.info("%s 已達 %d 人上限，使用者 %s 加入等待佇列", tenant, capacity, username)
             else:
-                if username not in self._login_queue:
-                    self._login_queue.append(username)
-                    logger.info(f"使用者 {username} 加入等待佇列")
-                return False
-    
-    def notify_logout(self, username):
+                self._touch(entry, now)
+            return False, self._queue_position(tenant, username), entry.ticket
+
+    def touch(self, username, tenant):
+        """一般請求：延長既有名額的閒置期限，O(1)；沒有名額時不佔用也不排隊，回傳是否持有名額"""
+        now = time.monotonic()
         with self._lock:
-            if self._active_user == username:
-                logger.info(f"使用者 {username} 登出，釋放登入權限")
-                self._active_user = None
-                self._activity_time.pop(username, None)
-                if self._login_queue:
-                    next_user = self._login_queue.pop(0)
-                    self._active_user = next_user
-                    self._activity_time[next_user] = datetime.now(timezone.utc)
-                    logger.info(f"使用者 {next_user} 從佇列中取得登入權限")
-    
-    def check_inactivity(self):
+            entry = self._active.get(tenant, {}).get(username)
+            if entry is None:
+                return False
+            self._touch(entry, now)
+            return True
+
+    def logout(self, username, tenant):
+        """登出釋放名額（或離開佇列），並讓佇列中的下一位取得名額"""
+        now = time.monotonic()
         with self._lock:
-            if self._active_user:
-                last_active = self._activity_time.get(self._active_user)
-                if last_active and (datetime.now(timezone.utc) - last_active).total_seconds() > 180:
-                    logger.info(f"使用者 {self._active_user} 閒置超過3分鐘，自動登出")
-                    self.notify_logout(self._active_user)
-                    return True
+            entry = self._active.get(tenant, {}).pop(username, None)
+            if entry is not None:
+                self._drop(entry)
+                logger.info(f"使用者 {username} 登出 {tenant}，釋放名額")
+                self._promote(tenant, now)
+                return True
+            entry = self._queues.get(tenant, {}).pop(username, None)
+            if entry is not None:
+                self._drop(entry)
+                return True
             return False
 
-# 實例化登入狀態服務
-login_service = LoginStateService()
+    def queue_status(self, ticket):
+        """
+        以排隊憑證查詢狀態並延長排隊期限；回傳 {'active': bool, 'position': 序號或 None}，
+        憑證無效或已逾時回傳 None。只有拿到憑證的使用者本人能查詢與延長自己的排隊。
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            entry = self._tickets.get(ticket)
+            if entry is None:
+                return None
+            if self._active.get(entry.tenant, {}).get(entry.username) is entry:
+                return {'active': True, 'position': None}
+            self._touch(entry, now)
+            return {'active': False, 'position': self._queue_position(entry.tenant, entry.username)}
+
+    def snapshot(self, tenant=None):
+        """各部門使用中的工作階段與等待佇列"""
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            tenants = [tenant] if tenant else sorted(set(self._active) | set(self._queues))
+            result = {}
+            for key in tenants:
+                active = self._active.get(key, {})
+                queue = self._queues.get(key, {})
+                result[key] = {
+                    'capacity': self.capacity(key),
+                    'active': [
+                        {
+                            'username': e.username,
+                            'started_at': e.started_at.isoformat(timespec='seconds'),
+                            'idle_seconds': round(now - e.last_seen, 1),
+                            'expires_in': round(e.expires_at - now, 1) if e.expires_at else None,
+                        }
+                        for e in sorted(active.values(), key=lambda e: e.started_at)
+                    ],
+                    'queue': [
+                        {'username': e.username, 'position': i, 'waiting_seconds': round((datetime.now(timezone.utc) - e.started_at).total_seconds(), 1)}
+                        for i, e in enumerate(queue.values(), start=1)
+                    ],
+                }
+            return result
+
+# 全域工作階段登錄表
+session_registry = SessionRegistry()
@@ -0,0 +1,179 @@
+import os
+import re
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+from flask import g, request
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from utils import is_admin_user
+from metrics import add_query_observer
+
+logger = logging.getLogger(__name__)
+
+# 超過此毫秒數的 SQL 一律記錄（含 EXPLAIN QUERY PLAN），設為 0 停用
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+# 同一 SQL 的慢查詢在此秒數內只附一次查詢計畫，避免慢查詢本身被 EXPLAIN 放大
+EXPLAIN_INTERVAL = 300
+# 管理者帶此標頭（值為 1）時分析該請求的所有 SQL
+PROFILE_HEADER = 'X-SQL-Profile'
+# 開發環境可設 SQL_PROFILE_ALL=1 分析每個請求
+PROFILE_ALL = os.environ.get('SQL_PROFILE_ALL') == '1'
+# 同一 SQL 以不同參數執行達此次數即列為 N+1 嫌疑
+N_PLUS_ONE_THRESHOLD = 5
+# 保留最近幾筆請求分析報告供 /api/profile/sql 查詢
+REPORT_HISTORY = 50
+STATEMENT_PREVIEW = 300
+# 用戶端提供的請求識別碼也用於檔名，只接受英數與 - _
+REQUEST_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+_current = threading.local()
+_explained = {}
+_explained_lock = threading.Lock()
+recent_reports = deque(maxlen=REPORT_HISTORY)
+
+def request_id():
+    """目前請求的識別碼（沿用用戶端合法的 X-Request-Id，否則產生新的），回應時放在 X-Request-Id 標頭"""
+    rid = g.get('request_id')
+    if rid is None:
+        rid = request.headers.get('X-Request-Id', '')
+        if not REQUEST_ID_PATTERN.fullmatch(rid):
+            rid = uuid.uuid4().hex[:16]
+        g.request_id = rid
+    return rid
+
+def _preview(statement):
+    statement = ' '.join(statement.split())
+    return statement if len(statement) <= STATEMENT_PREVIEW else statement[:STATEMENT_PREVIEW] + '...'
+
+def explain_query_plan(dbapi_connection, statement, parameters):
+    """在同一個 DBAPI 連線上取得 SQLite 查詢計畫，回傳每一步的說明文字"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ())
+        return [row[-1] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+def _log_slow_query(conn, statement, parameters, elapsed, executemany):
+    plan = None
+    keyword = statement.lstrip()[:6].upper()
+    if not executemany and (keyword.startswith('SELECT') or keyword.startswith('WITH')):
+        now = time.monotonic()
+        with _explained_lock:
+            due = now - _explained.get(statement, -EXPLAIN_INTERVAL) >= EXPLAIN_INTERVAL
+            if due:
+                _explained[statement] = now
+        if due:
+            try:
+                plan = explain_query_plan(conn.connection.dbapi_connection, statement, parameters)
+            except Exception as e:
+                plan = [f"無法取得查詢計畫: {e}"]
+    stats = getattr(_current, 'profile', None)
+    where = f"，請求 {stats['method']} {stats['path']}" if stats else ''
+    logger.warning("慢查詢 %.1f ms%s: %s%s", elapsed * 1000, where, _preview(statement),
+                   ''.join(f"\n    {step}" for step in plan) if plan else '')
+
+def _observe_query(conn, statement, parameters, executemany, elapsed):
+    """由 metrics 的 after_cursor_execute 掛勾呼叫，使用同一次量測的耗時"""
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        _log_slow_query(conn, statement, parameters, elapsed, executemany)
+    stats = getattr(_current, 'profile', None)
+    if stats is None:
+        return
+    entry = stats['statements'].get(statement)
+    if entry is None:
+        entry = stats['statements'][statement] = {'count': 0, 'seconds': 0.0, 'params': set()}
+    entry['count'] += 1
+    entry['seconds'] += elapsed
+    if len(entry['params']) < 1000:
+        entry['params'].add(repr(parameters))
+
+add_query_observer(_observe_query)
+
+def build_report(stats, elapsed):
+    statements = sorted(stats['statements'].items(), key=lambda item: item[1]['seconds'], reverse=True)
+    suspects = [
+        {'statement': _preview(s), 'count': e['count'], 'distinct_params': len(e['params']), 'ms': round(e['seconds'] * 1000, 2)}
+        for s, e in statements
+        if e['count'] >= N_PLUS_ONE_THRESHOLD and len(e['params']) > 1
+    ]
+    return {
+        'request_id': stats['request_id'],
+        'method': stats['method'],
+        'path': stats['path'],
+        'user': stats['user'],
+        'at': stats['at'],
+        'total_ms': round(elapsed * 1000, 2),
+        'queries': sum(e['count'] for _, e in statements),
+        'db_ms': round(sum(e['seconds'] for _, e in statements) * 1000, 2),
+        'n_plus_one_suspects': suspects,
+        'statements': [
+            {'statement': _preview(s), 'count': e['count'], 'ms': round(e['seconds'] * 1000, 2)}
+            for s, e in statements
+        ],
+    }
+
+def requesting_admin(feature):
+    """分析功能只開放給管理者：回傳目前請求的管理者帳號，不是管理者時記錄並回傳 None"""
+    try:
+        verify_jwt_in_request(optional=True)
+        username = get_jwt_identity()
+    except Exception:
+        return None
+    if not is_admin_user(username):
+        logger.warning("使用者 %s 要求%s但不是管理者，已忽略", username, feature)
+        return None
+    return username
+
+def _profiling_requested():
+    if PROFILE_ALL:
+        return True, None
+    if request.headers.get(PROFILE_HEADER) != '1':
+        return False, None
+    username = requesting_admin(' SQL 分析')
+    return username is not None, username
+
+def init_app(app):
+    """註冊每請求 SQL 分析：結果寫入 log、回應標頭（X-SQL-Queries / X-SQL-Time-ms / Server-Timing）與最近報告清單"""
+
+    @app.before_request
+    def _start_sql_profile():
+        _current.profile = None
+        enabled, username = _profiling_requested()
+        if not enabled:
+            return
+        _current.profile = {
+            'request_id': request_id(),
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'user': username,
+            'at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'started': time.perf_counter(),
+            'statements': {},
+        }
+
+    @app.after_request
+    def _finish_sql_profile(response):
+        stats = getattr(_current, 'profile', None)
+        if stats is None:
+            return response
+        _current.profile = None
+        report = build_report(stats, time.perf_counter() - stats['started'])
+        recent_reports.append(report)
+        response.headers['X-Request-Id'] = report['request_id']
+        response.headers['X-SQL-Queries'] = str(report['queries'])
+        response.headers['X-SQL-Time-ms'] = str(report['db_ms'])
+        response.headers.add('Server-Timing', f'db;dur={report["db_ms"]};desc="{report["queries"]} queries"')
+        logger.info("SQL 分析 %s %s：%d 筆 SQL，DB %.1f ms / 總計 %.1f ms，N+1 嫌疑 %d 組",
+                    report['method'], report['path'], report['queries'], report['db_ms'], report['total_ms'],
+                    len(report['n_plus_one_suspects']))
+        for suspect in report['n_plus_one_suspects']:
+            logger.warning("N+1 嫌疑（%s）：相同 SQL 執行 %d 次（%d 組參數，%.1f ms）: %s", report['path'],
+                           suspect['count'], suspect['distinct_params'], suspect['ms'], suspect['statement'])
+        return response
+
+    @app.teardown_request
+    def _clear_sql_profile(exception=None):
+        _current.profile = None
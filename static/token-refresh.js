@@ -0,0 +1,183 @@
+/*
+ * JWT 靜默換新（需在 axios 之後、頁面程式之前載入）
+ * - 登入回應中的 refresh_token 依帳號存入 localStorage（refreshToken:<帳號>）
+ * - 頁面載入時若 localStorage 中的 access token 已過期，先以 refresh token 換新，頁面不需重新登入
+ * - API 回應 401 時自動換新 token 並重送一次原請求
+ * - 頁面停留期間於 access token 到期前自動換新
+ * 頁面仍持有舊 token 時，送出請求前會自動替換為換新後的 token。
+ */
+(function () {
+  if (!window.axios) return;
+
+  const ACCESS_KEYS = ['token', 'apiKey'];
+  const REFRESH_PREFIX = 'refreshToken:';
+  const REFRESH_URL_KEY = 'tokenRefreshUrl';
+  const REFRESH_EARLY_SECONDS = 60;
+
+  const replacedTokens = {};   // 舊 access token -> 新 access token
+  const pending = {};          // 帳號 -> 進行中的換新 Promise
+  let refreshTimer = null;
+
+  function decodePayload(token) {
+    try {
+      const part = token.split('.')[1].replace(/-/g, '+').replace(/_/g, '/');
+      return JSON.parse(atob(part));
+    } catch (e) {
+      return null;
+    }
+  }
+
+  function secondsLeft(token) {
+    const payload = decodePayload(token);
+    return payload && payload.exp ? payload.exp - Math.floor(Date.now() / 1000) : -1;
+  }
+
+  function latestToken(token) {
+    while (replacedTokens[token]) token = replacedTokens[token];
+    return token;
+  }
+
+  function refreshUrl() {
+    return localStorage.getItem(REFRESH_URL_KEY);
+  }
+
+  function saveTokens(oldAccess, data) {
+    const payload = decodePayload(data.access_token);
+    if (!payload || !payload.sub) return;
+    localStorage.setItem(REFRESH_PREFIX + payload.sub, data.refresh_token);
+    if (oldAccess) {
+      replacedTokens[oldAccess] = data.access_token;
+      ACCESS_KEYS.forEach(key => {
+        if (localStorage.getItem(key) === oldAccess) localStorage.setItem(key, data.access_token);
+      });
+    }
+    scheduleRefresh();
+  }
+
+  function refreshTokenFor(accessToken) {
+    const payload = decodePayload(accessToken);
+    return payload && payload.sub ? localStorage.getItem(REFRESH_PREFIX + payload.sub) : null;
+  }
+
+  // 頁面載入時同步換新，確保頁面程式讀取 localStorage 時已是有效 token
+  function refreshSync(accessToken) {
+    const refreshToken = refreshTokenFor(accessToken);
+    if (!refreshToken || !refreshUrl()) return;
+    try {
+      const xhr = new XMLHttpRequest();
+      xhr.open('POST', refreshUrl(), false);
+      xhr.setRequestHeader('Authorization', `Bearer ${refreshToken}`);
+      xhr.send();
+      if (xhr.status === 200) {
+        saveTokens(accessToken, JSON.parse(xhr.responseText));
+      } else if (xhr.status === 401 || xhr.status === 422) {
+        localStorage.removeItem(REFRESH_PREFIX + decodePayload(accessToken).sub);
+      }
+    } catch (e) {
+      console.warn('token 換新失敗', e);
+    }
+  }
+
+  function refreshAsync(accessToken) {
+    const payload = decodePayload(accessToken);
+    const refreshToken = refreshTokenFor(accessToken);
+    if (!payload || !refreshToken || !refreshUrl()) return Promise.reject(new Error('no refresh token'));
+    if (!pending[payload.sub]) {
+      pending[payload.sub] = axios.post(refreshUrl(), null, {
+        headers: { Authorization: `Bearer ${refreshToken}` },
+        _skipTokenRefresh: true
+      }).then(res => {
+        saveTokens(accessToken, res.data);
+        return res.data.access_token;
+      }).catch(err => {
+        if (err.response && (err.response.status === 401 || err.response.status === 422)) {
+          localStorage.removeItem(REFRESH_PREFIX + payload.sub);
+        }
+        throw err;
+      }).finally(() => {
+        delete pending[payload.sub];
+      });
+    }
+    return pending[payload.sub];
+  }
+
+  function scheduleRefresh() {
+    clearTimeout(refreshTimer);
+    const tokens = ACCESS_KEYS.map(key => localStorage.getItem(key)).filter(t => t && refreshTokenFor(t));
+    if (!tokens.length) return;
+    const soonest = tokens.reduce((a, b) => (secondsLeft(a) <= secondsLeft(b) ? a : b));
+    const delay = Math.max(secondsLeft(soonest) - REFRESH_EARLY_SECONDS, 5) * 1000;
+    refreshTimer = setTimeout(() => {
+      refreshAsync(soonest).catch(() => {}).finally(scheduleRefresh);
+    }, Math.min(delay, 2147483647));
+  }
+
+  function bearerOf(config) {
+    const headers = config.headers || {};
+    const value = (headers.get ? headers.get('Authorization') : null) || headers.Authorization || headers.authorization;
+    return value && value.startsWith('Bearer ') ? value.slice(7) : null;
+  }
+
+  function setBearer(config, token) {
+    if (config.headers && config.headers.set) {
+      config.headers.set('Authorization', `Bearer ${token}`);
+    } else {
+      config.headers = Object.assign({}, config.headers, { Authorization: `Bearer ${token}` });
+    }
+  }
+
+  function isAuthUrl(url) {
+    return /\/(login|token\/refresh|auto-auth)\/?(\?|$)/.test(url || '');
+  }
+
+  function install(instance) {
+    instance.interceptors.request.use(config => {
+      if (config._skipTokenRefresh) return config;
+      const token = bearerOf(config);
+      if (token && replacedTokens[token]) setBearer(config, latestToken(token));
+      if (config.params && config.params.token && replacedTokens[config.params.token]) {
+        config.params = Object.assign({}, config.params, { token: latestToken(config.params.token) });
+      }
+      return config;
+    });
+    instance.interceptors.response.use(response => {
+      const data = response.data;
+      if (data && data.access_token && data.refresh_token && isAuthUrl(response.config.url)) {
+        if (/\/(login|auto-auth)\/?$/.test(response.config.url)) {
+          const url = (response.config.baseURL && !/^https?:/.test(response.config.url)
+            ? response.config.baseURL.replace(/\/$/, '') + '/' + response.config.url.replace(/^\//, '')
+            : response.config.url);
+          localStorage.setItem(REFRESH_URL_KEY, url.replace(/\/(login|auto-auth)\/?$/, '/token/refresh'));
+        }
+        saveTokens(null, data);
+      }
+      return response;
+    }, error => {
+      const config = error.config;
+      const token = config && bearerOf(config);
+      if (!error.response || error.response.status !== 401 || !token || config._tokenRetried
+          || config._skipTokenRefresh || isAuthUrl(config.url)) {
+        return Promise.reject(error);
+      }
+      return refreshAsync(latestToken(token)).then(newToken => {
+        config._tokenRetried = true;
+        setBearer(config, newToken);
+        return instance.request(config);
+      }, () => Promise.reject(error));
+    });
+    return instance;
+  }
+
+  // axios.create() 建立的實例不會繼承全域攔截器，一併安裝
+  const originalCreate = axios.create.bind(axios);
+  axios.create = function (config) {
+    return install(originalCreate(config));
+  };
+  install(axios);
+
+  ACCESS_KEYS.forEach(key => {
+    const token = localStorage.getItem(key);
+    if (token && secondsLeft(token) <= REFRESH_EARLY_SECONDS) refreshSync(token);
+  });
+  scheduleRefresh();
+})();
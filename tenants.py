@@ -0,0 +1,499 @@
+import os
+import re
+import json
+import time
+import logging
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session
+from models import Base, SCHEMA_VERSION, ensure_low_stock_index
+from metrics import TimedQueuePool
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+default_db_path = os.path.join(BASE_DIR, 'materials.db')
+
+# 部門編號與科別名稱對照（與前端 All-Department 頁面一致）
+DEPARTMENT_LABELS = {
+    1: '商經科',
+    2: '會事科',
+    3: '國貿科',
+    4: '觀光科',
+    5: '資處科',
+    6: '機械科',
+    7: '電圖科',
+    8: '室設科',
+    9: '家設科',
+}
+
+DEPARTMENT_DB_PATTERN = re.compile(r'^materials_(\d+)\.db$')
+
+def department_key(dep_num: int) -> str:
+    return f"dep{dep_num}"
+
+def department_label(dep_num: int) -> str:
+    dep = registry.department(dep_num)
+    if dep is not None:
+        return dep['label']
+    return DEPARTMENT_LABELS.get(dep_num, department_key(dep_num))
+
+def department_db_path(dep_num: int) -> str:
+    dep = registry.department(dep_num)
+    if dep is not None:
+        return dep['db_path']
+    return os.path.join(BASE_DIR, f"materials_{dep_num}.db")
+
+def discover_department_dbs(base_dir: str = BASE_DIR):
+    """
+    掃描 base_dir 下的 materials_N.db，
+    依部門編號排序回傳 [(dep_num, db_path), ...]。
+    """
+    found = []
+    for name in os.listdir(base_dir):
+        match = DEPARTMENT_DB_PATTERN.match(name)
+        if match:
+            found.append((int(match.group(1)), os.path.join(base_dir, name)))
+    found.sort()
+    logger.debug("找到 %d 個部門資料庫", len(found))
+    return found
+
+# 全域快取 engine 與 session factory，請求與跨部門查詢共用同一組連線池
+_engine_lock = threading.Lock()
+_engines = {}
+_session_factories = {}
+
+def get_engine(db_uri: str):
+    """依資料庫 URI 取得共用 engine，同一個資料庫在整個行程內只建立一次"""
+    with _engine_lock:
+        engine = _engines.get(db_uri)
+        if engine is None:
+            engine = create_engine(db_uri, connect_args={"check_same_thread": False}, poolclass=TimedQueuePool)
+            _engines[db_uri] = engine
+            logger.debug("建立 engine: %s", db_uri)
+        return engine
+
+def get_session_factory(db_uri: str):
+    """回傳綁定到該資料庫 engine 的 scoped_session，請求結束時需呼叫 remove()"""
+    engine = get_engine(db_uri)
+    with _engine_lock:
+        factory = _session_factories.get(db_uri)
+        if factory is None:
+            factory = scoped_session(sessionmaker(bind=engine))
+            _session_factories[db_uri] = factory
+        return factory
+
+# 已從登錄表移除的租戶 engine，等連線都歸還後才 dispose
+_retired_engines = {}
+
+def retire_engine(db_uri: str):
+    """租戶被移除時將 engine 移出快取，實際 dispose 延後到 dispose_retired_engines()"""
+    with _engine_lock:
+        engine = _engines.pop(db_uri, None)
+        factory = _session_factories.pop(db_uri, None)
+        if engine is not None:
+            _retired_engines[db_uri] = (engine, factory)
+    _checked_dbs.discard(db_uri)
+    if engine is not None:
+        logger.info(f"租戶已移除，engine 等待釋放: {db_uri}")
+
+def dispose_retired_engines():
+    """釋放已無借出連線的退役 engine，由每次請求結束時呼叫，沒有退役 engine 時不做任何事"""
+    if not _retired_engines:
+        return
+    with _engine_lock:
+        for db_uri, (engine, factory) in list(_retired_engines.items()):
+            if engine.pool.checkedout() == 0:
+                if factory is not None:
+                    factory.remove()
+                engine.dispose()
+                del _retired_engines[db_uri]
+                logger.info(f"已釋放退役租戶的 engine: {db_uri}")
+
+_schema_lock = threading.Lock()
+_checked_dbs = set()
+
+# --- 取代資料庫檔案前的排空 ---
+# 等待進行中的請求與借出連線歸零的上限秒數
+DRAIN_TIMEOUT = 30.0
+DRAIN_POLL_INTERVAL = 0.05
+# Windows 上檔案仍被開啟（例如背景備份正在讀取）時 os.replace 會失敗，稍後重試
+REPLACE_RETRIES = 10
+REPLACE_RETRY_DELAY = 0.2
+
+class DatabaseBusyError(RuntimeError):
+    """資料庫在時限內無法排空或檔案仍被占用，未進行取代"""
+
+_drain_cond = threading.Condition()
+_active_requests = Counter()
+_draining = set()
+
+def enter_database(db_uri: str) -> bool:
+    """請求開始使用資料庫時呼叫並計數；資料庫正在排空（還原中）時回傳 False，請求應直接回應 503"""
+    with _drain_cond:
+        if db_uri in _draining:
+            return False
+        _active_requests[db_uri] += 1
+        return True
+
+def leave_database(db_uri: str):
+    """請求結束（session 已 remove）時呼叫，與 enter_database() 成對"""
+    with _drain_cond:
+        _active_requests[db_uri] -= 1
+        if _active_requests[db_uri] <= 0:
+            del _active_requests[db_uri]
+        _drain_cond.notify_all()
+
+def _checked_out_connections(db_uri: str) -> int:
+    engines = [_engines.get(db_uri), (_retired_engines.get(db_uri) or (None,))[0]]
+    return sum(engine.pool.checkedout() for engine in engines if engine is not None)
+
+@contextmanager
+def drained_database(db_uri: str, timeout: float = DRAIN_TIMEOUT):
+    """
+    排空資料庫：新請求一律被 enter_database() 拒絕，等待進行中的請求結束、連線池的借出連線全部歸還
+    （含跨部門彙總等不經請求計數的使用者）。逾時拋出 DatabaseBusyError；離開 with 區塊後恢復服務。
+    """
+    with _drain_cond:
+        if db_uri in _draining:
+            raise DatabaseBusyError("此資料庫已有其他還原正在進行")
+        _draining.add(db_uri)
+    try:
+        deadline = time.monotonic() + timeout
+        with _drain_cond:
+            while True:
+                requests_left = _active_requests.get(db_uri, 0)
+                connections_left = _checked_out_connections(db_uri)
+                if not requests_left and not connections_left:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DatabaseBusyError(
+                        f"等待 {timeout:g} 秒後仍有 {requests_left} 個請求、{connections_left} 條連線使用中，請稍後再試"
+                    )
+                _drain_cond.wait(min(remaining, DRAIN_POLL_INTERVAL))
+        logger.info("資料庫已排空: %s", db_uri)
+        yield
+    finally:
+        with _drain_cond:
+            _draining.discard(db_uri)
+            _drain_cond.notify_all()
+
+def replace_database_file(db_uri: str, new_path: str):
+    """
+    以 new_path 原子取代 db_uri 的資料庫檔案（同一檔案系統上的 os.replace），須在 drained_database() 內呼叫，
+    確保沒有連線仍指向舊檔案（POSIX 上寫入會遺失，Windows 上取代會失敗）。
+    舊 engine 釋放後將 WAL 寫回主檔，取代後清除殘留的 -wal/-shm，
+    下一次 get_engine() 會重新建立 engine 並重新檢查結構版本。檔案持續被占用時拋出 DatabaseBusyError。
+    """
+    db_path = db_uri.replace("sqlite:///", "")
+    with _engine_lock:
+        engine = _engines.pop(db_uri, None)
+        factory = _session_factories.pop(db_uri, None)
+        if factory is not None:
+            factory.remove()
+        if engine is not None:
+            engine.dispose()
+        retired = _retired_engines.pop(db_uri, None)
+        if retired is not None:
+            retired[0].dispose()
+        if os.path.exists(db_path):
+            conn = sqlite3.connect(db_path)
+            try:
+                # WAL 截斷為 0 後即使之後刪除失敗，也不會被套用到新檔案上
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                conn.close()
+        for attempt in range(REPLACE_RETRIES):
+            try:
+                os.replace(new_path, db_path)
+                break
+            except PermissionError as e:
+                if attempt == REPLACE_RETRIES - 1:
+                    raise DatabaseBusyError(f"資料庫檔案仍被其他程式使用，無法取代: {e}") from e
+                time.sleep(REPLACE_RETRY_DELAY)
+        for suffix in ('-wal', '-shm'):
+            try:
+                os.remove(db_path + suffix)
+            except FileNotFoundError:
+                pass
+        _checked_dbs.discard(db_uri)
+    logger.info(f"資料庫檔案已取代: {db_uri}")
+
+def read_schema_version(conn) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar() or 0
+
+def ensure_schema(db_uri: str):
+    """
+    資料庫在本行程第一次使用時確認結構版本。
+    PRAGMA user_version 與 SCHEMA_VERSION 相同時只讀一次 pragma 就返回；
+    不同時才建立缺少的資料表、補上低庫存旗標與計數器，並寫入新版本號。
+    """
+    if db_uri in _checked_dbs:
+        return
+    with _schema_lock:
+        if db_uri in _checked_dbs:
+            return
+        engine = get_engine(db_uri)
+        with engine.connect() as conn:
+            version = read_schema_version(conn)
+        if version != SCHEMA_VERSION:
+            logger.info(f"資料庫結構版本 {version} 與程式版本 {SCHEMA_VERSION} 不同，執行結構檢查: {db_uri}")
+            Base.metadata.create_all(engine)
+            with engine.begin() as conn:
+                ensure_low_stock_index(conn)
+                conn.exec_driver_sql(f"PRAGMA user_version = {int(SCHEMA_VERSION)}")
+            logger.info(f"資料庫結構檢查完成: {db_uri}")
+        _checked_dbs.add(db_uri)
+
+# --- 租戶登錄表 ---
+# 預設包含 dep1~dep9 與 BASE_DIR 下所有 materials_N.db；
+# 可用 tenants.json（或環境變數 TENANTS_CONFIG 指定的檔案）新增、覆寫或停用部門，格式：
+# {
+#   "departments": {"10": {"label": "餐飲科", "db": "materials_10.db", "users": ["teacher_lin"]}},
+#   "users": {"teacher_wang": 3},
+#   "disabled": [7]
+# }
+# db 為相對路徑時以 BASE_DIR 為基準。檔案修改後最多 REGISTRY_CHECK_INTERVAL 秒內自動重新載入，
+# 也可呼叫 POST /api/tenants/reload 立即重新載入。
+TENANTS_CONFIG_PATH = os.environ.get('TENANTS_CONFIG', os.path.join(BASE_DIR, 'tenants.json'))
+REGISTRY_CHECK_INTERVAL = 5.0
+
+class TenantRegistry:
+    """部門編號、資料庫檔案與使用者對應的登錄表，可在執行期間重新載入"""
+
+    def __init__(self, config_path: str, base_dir: str = BASE_DIR):
+        self.config_path = config_path
+        self.base_dir = base_dir
+        self._lock = threading.Lock()
+        self._departments = {}
+        self._users = {}
+        self._config_mtime = None
+        self._next_check = 0.0
+        self._loaded = False
+
+    def _read_config(self):
+        if not os.path.exists(self.config_path):
+            return {}, None
+        mtime = os.path.getmtime(self.config_path)
+        with open(self.config_path, encoding='utf-8') as f:
+            return json.load(f), mtime
+
+    def _build(self, config):
+        departments = {
+            dep_num: {'label': label, 'db_path': os.path.join(self.base_dir, f"materials_{dep_num}.db")}
+            for dep_num, label in DEPARTMENT_LABELS.items()
+        }
+        for dep_num, db_path in discover_department_dbs(self.base_dir):
+            departments.setdefault(dep_num, {'label': department_key(dep_num), 'db_path': db_path})
+
+        users = {}
+        for key, entry in (config.get('departments') or {}).items():
+            dep_num = int(key)
+            dep = departments.setdefault(dep_num, {
+                'label': department_key(dep_num),
+                'db_path': os.path.join(self.base_dir, f"materials_{dep_num}.db")
+            })
+            if entry.get('label'):
+                dep['label'] = entry['label']
+            if entry.get('db'):
+                dep['db_path'] = os.path.join(self.base_dir, entry['db'])
+            for username in entry.get('users') or []:
+                users[username.lower()] = dep_num
+        for username, dep_num in (config.get('users') or {}).items():
+            users[username.lower()] = int(dep_num)
+        for dep_num in config.get('disabled') or []:
+            departments.pop(int(dep_num), None)
+        users = {u: n for u, n in users.items() if n in departments}
+        return departments, users
+
+    def reload(self) -> dict:
+        """重新讀取設定並重建登錄表，被移除部門的 engine 延後釋放；設定檔格式錯誤時保留舊登錄表"""
+        with self._lock:
+            try:
+                config, mtime = self._read_config()
+                departments, users = self._build(config)
+            except (OSError, ValueError, TypeError, AttributeError) as e:
+                logger.error(f"租戶設定檔 {self.config_path} 載入失敗，沿用目前設定: {e}")
+                self._next_check = time.monotonic() + REGISTRY_CHECK_INTERVAL
+                raise ValueError(f"租戶設定檔載入失敗: {e}") from e
+            old_departments = self._departments
+            self._departments, self._users = departments, users
+            self._config_mtime = mtime
+            self._next_check = time.monotonic() + REGISTRY_CHECK_INTERVAL
+            self._loaded = True
+
+        old_paths = {d['db_path'] for d in old_departments.values()}
+        new_paths = {d['db_path'] for d in departments.values()}
+        for db_path in old_paths - new_paths:
+            retire_engine(f"sqlite:///{db_path}")
+        added = sorted(set(departments) - set(old_departments))
+        removed = sorted(set(old_departments) - set(departments))
+        if old_departments and (added or removed):
+            logger.info(f"租戶登錄表已重新載入，新增 {added}，移除 {removed}")
+        return {'departments': len(departments), 'added': added, 'removed': removed}
+
+    def _refresh_if_stale(self):
+        """第一次使用時載入；之後每 REGISTRY_CHECK_INTERVAL 秒最多檢查一次設定檔修改時間"""
+        if self._loaded and time.monotonic() < self._next_check:
+            return
+        if self._loaded:
+            try:
+                mtime = os.path.getmtime(self.config_path) if os.path.exists(self.config_path) else None
+            except OSError:
+                mtime = self._config_mtime
+            if mtime == self._config_mtime:
+                self._next_check = time.monotonic() + REGISTRY_CHECK_INTERVAL
+                return
+        try:
+            self.reload()
+        except ValueError:
+            pass
+
+    def department(self, dep_num: int):
+        self._refresh_if_stale()
+        return self._departments.get(dep_num)
+
+    def user_department(self, username: str):
+        self._refresh_if_stale()
+        return self._users.get(username.lower())
+
+    def departments(self):
+        """目前啟用的部門，依編號排序回傳 [(dep_num, db_path), ...]"""
+        self._refresh_if_stale()
+        return sorted((dep_num, d['db_path']) for dep_num, d in self._departments.items())
+
+    def live_departments(self):
+        """啟用且資料庫檔案存在的部門，跨部門查詢與報表使用"""
+        return [(dep_num, db_path) for dep_num, db_path in self.departments() if os.path.exists(db_path)]
+
+    def describe(self):
+        self._refresh_if_stale()
+        return {
+            'config_path': self.config_path,
+            'config_loaded': self._config_mtime is not None,
+            'departments': [
+                {
+                    'department': department_key(dep_num),
+                    'label': d['label'],
+                    'db_path': d['db_path'],
+                    'exists': os.path.exists(d['db_path']),
+                    'users': sorted(u for u, n in self._users.items() if n == dep_num)
+                }
+                for dep_num, d in sorted(self._departments.items())
+            ],
+            'retired_engines': sorted(_retired_engines)
+        }
+
+registry = TenantRegistry(TENANTS_CONFIG_PATH)
+
+# --- 租戶（資料庫）解析 ---
+# 登入時將解析出的租戶代碼寫入 JWT 的此 claim，之後的請求直接採用，不再查詢資料庫
+TENANT_CLAIM = 'dep'
+MAIN_TENANT = 'main'
+
+# 需要查詢主資料庫的對應結果快取秒數
+TENANT_CACHE_TTL = 300
+
+class TTLCache:
+    """簡單的執行緒安全 TTL 快取，過期的項目在下次讀取時移除"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+def parse_department_username(username):
+    """depN 或 depNt（教師帳號）直接由帳號名稱取得部門編號，不需任何 I/O；是否啟用由登錄表判斷"""
+    if not username:
+        return None
+    uname = username.lower()
+    if not uname.startswith('dep'):
+        return None
+    suffix = uname[3:]
+    if suffix.endswith('t'):
+        suffix = suffix[:-1]
+    if suffix.isdigit() and int(suffix) > 0:
+        return int(suffix)
+    return None
+
+def resolve_tenant(username) -> str:
+    """
+    回傳使用者所屬租戶代碼：depN 或 main。
+    depN 帳號即使部門尚未啟用也回傳 depN，避免誤用主資料庫。
+    """
+    if not username:
+        return MAIN_TENANT
+    dep_num = parse_department_username(username)
+    if dep_num is None:
+        dep_num = registry.user_department(username)
+    return department_key(dep_num) if dep_num is not None else MAIN_TENANT
+
+def tenant_db_uri(tenant: str):
+    """租戶代碼轉為資料庫 URI，代碼無效或部門未啟用時回傳 None"""
+    if tenant == MAIN_TENANT:
+        return f"sqlite:///{default_db_path}"
+    dep_num = parse_department_username(tenant)
+    if dep_num is None or department_key(dep_num) != tenant:
+        return None
+    dep = registry.department(dep_num)
+    if dep is None:
+        return None
+    return f"sqlite:///{dep['db_path']}"
+
+def tenant_databases():
+    """主資料庫與所有啟用中的部門資料庫，回傳 [(租戶代碼, db_path), ...]"""
+    databases = [(MAIN_TENANT, default_db_path)] if os.path.exists(default_db_path) else []
+    databases.extend((department_key(dep_num), db_path) for dep_num, db_path in registry.live_departments())
+    return databases
+
+def tenant_claims(username) -> dict:
+    """登入時加入 access token 的額外 claims"""
+    return {TENANT_CLAIM: resolve_tenant(username)}
+
+def get_db_uri_for_user(username):
+    """回傳使用者的資料庫 URI，所屬部門未啟用時回傳 None"""
+    return tenant_db_uri(resolve_tenant(username))
+
+def tenant_from_claims(identity, claims) -> str:
+    """JWT 的租戶 claim，舊 token 沒有 claim 時依帳號解析"""
+    return (claims or {}).get(TENANT_CLAIM) or resolve_tenant(identity)
+
+def db_uri_from_claims(identity, claims):
+    """
+    依 JWT 決定請求使用的資料庫：有租戶 claim 時直接採用（token 已簽章），
+    舊 token 沒有 claim 時才依帳號解析。部門未啟用或已移除時回傳 None。
+    """
+    tenant = (claims or {}).get(TENANT_CLAIM)
+    if tenant:
+        uri = tenant_db_uri(tenant)
+        if uri is None:
+            logger.warning(f"JWT 租戶 {tenant} 未啟用，使用者 {identity}")
+        return uri
+    return get_db_uri_for_user(identity)
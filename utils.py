@@ -1,44 +1,51 @@
 import os
 import logging
 import sqlite3
+from functools import wraps
+from flask import jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from tenants import TTLCache, TENANT_CACHE_TTL
 
 logger = logging.getLogger(__name__)
 basedir = os.path.abspath(os.path.dirname(__file__))
 default_db_path = os.path.join(basedir, 'materials.db')
 
-def get_db_uri_for_user(username: str) -> str:
-    """
-    從主資料庫的 user 表查詢 username，取得對應部門編號，
-    再回傳對應資料庫 URI。
-    """
-    if not username:
-        logger.debug("username 為空，使用預設資料庫")
-        return f"sqlite:///{default_db_path}"
+# 管理者角色查詢結果快取，避免每個管理端點請求都開啟主資料庫
+_admin_role_cache = TTLCache(TENANT_CACHE_TTL)
 
+def is_admin_user(username: str) -> bool:
+    """查詢主資料庫 user 表的 role 欄位判斷是否為管理者，結果快取 TENANT_CACHE_TTL 秒"""
+    if not username:
+        return False
+    cached = _admin_role_cache.get(username)
+    if cached is not None:
+        return cached
+    conn = None
     try:
-        # 先連接主資料庫查詢 user 表
         conn = sqlite3.connect(default_db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT dep_num FROM user WHERE username = ?", (username,))
-        row = cursor.fetchone()
+        row = conn.execute("SELECT role FROM user WHERE username = ?", (username,)).fetchone()
     except sqlite3.Error as e:
-        logger.error(f"查詢主資料庫 user 表失敗: {e}")
-        return f"sqlite:///{default_db_path}"
+        logger.error(f"查詢使用者角色失敗: {e}")
+        return False
     finally:
-        # 確保連接在任何情況下都會被關閉
         if conn:
             conn.close()
+    is_admin = bool(row) and row[0] == 'admin'
+    _admin_role_cache.set(username, is_admin)
+    return is_admin
 
-    if row:
-        dep_num = row[0]
-        # 檢查 dep_num 是否為 1~9 的有效部門編號
-        if isinstance(dep_num, int) and 1 <= dep_num <= 9:
-            db_file = f"materials_{dep_num}.db"
-            uri = f"sqlite:///{os.path.join(basedir, db_file)}"
-            logger.debug(f"使用者 {username} 對應部門 {dep_num} 資料庫 {uri}")
-            return uri
+def clear_admin_role_cache():
+    """主資料庫被還原或使用者角色變更後清除角色快取"""
+    _admin_role_cache.clear()
 
-    # 找不到使用者或部門不符，回傳預設資料庫
-    default_uri = f"sqlite:///{default_db_path}"
-    logger.debug(f"使用者 {username} 使用預設資料庫 {default_uri}")
-    return default_uri
+def admin_required(fn):
+    """僅允許 role 為 admin 的使用者呼叫的端點"""
+    @wraps(fn)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        username = get_jwt_identity()
+        if not is_admin_user(username):
+            logger.warning(f"使用者 {username} 嘗試存取管理者端點 {fn.__name__}")
+            return jsonify({'error': '需要管理者權限'}), 403
+        return fn(*args, **kwargs)
+    return wrapper